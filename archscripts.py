@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Single entry point for the archscripts tools.
+
+Each subcommand's module is imported only when that subcommand runs, so
+listing the commands or asking for help costs little more than starting
+the interpreter.
+"""
+
+import os
+import sys
+import argparse
+import importlib
+
+PROFILE_PATH = os.environ.get("ARCHSCRIPTS_PROFILE")
+
+# command -> (module, console log level, summary)
+COMMANDS = {
+    "install-wm": ("install_wm", "INFO", "Install a desktop and window manager with additional programs"),
+    "maintenance": ("maintenance", "WARNING", "System administration tasks"),
+    "update": ("system_update", "INFO", "Plan, prefetch and apply system upgrades in chunks"),
+    "schedule": ("update_scheduler", "INFO", "Schedule unattended updates with a systemd timer"),
+    "mirrors": ("mirror_rank", "INFO", "Rank pacman mirrors"),
+    "packages": ("pacman_db", "WARNING", "Query the pacman databases"),
+    "cleanup": ("pacman_cleanup", "INFO", "Plan removal of orphans and old cached packages"),
+    "network": ("network_setup", "WARNING", "Check the network and repair it if it is down"),
+    "net-probe": ("net_probe", "INFO", "Check link, route, gateway, DNS and TCP reachability"),
+    "net-fix": ("net_remediate", "INFO", "Apply the least disruptive network fix that works"),
+    "alacritty": ("configure_alacritty", "WARNING", "Write an Alacritty configuration"),
+    "python": ("install_python", "WARNING", "Install Python and set up ~/.pythonrc"),
+    "penv": ("init_penv", "WARNING", "Create and manage Python virtual environments"),
+    "env-sync": ("env_sync", "WARNING", "Sync a virtual environment with a lock file"),
+    "wheels": ("wheel_store", "INFO", "Manage the shared wheel store"),
+    "pypi": ("pypi_index", "INFO", "Search a local index of PyPI package names"),
+    "backup": ("backup_engine", "INFO", "Incremental snapshots of a directory tree"),
+    "logs": ("log_monitor", "INFO", "Watch the journal or log files for problems"),
+}
+
+
+def profile_args(profile, command):
+    """Turn a profile's section for command into arguments.
+
+    A section maps option names to values: true adds the bare flag, false
+    and null are skipped, lists repeat the option. The "args" key holds
+    positional arguments. Options given on the command line come later and
+    so take precedence.
+    """
+    section = profile.get(command, {})
+    argv = [str(value) for value in section.get("args", [])]
+    for key, value in section.items():
+        if key == "args" or value is None or value is False:
+            continue
+        option = f"--{key.replace('_', '-')}"
+        if value is True:
+            argv.append(option)
+        elif isinstance(value, list):
+            for item in value:
+                argv += [option, str(item)]
+        else:
+            argv += [option, str(value)]
+    return argv
+
+
+def load_profile(path):
+    # json pulls in re; only pay for it when a profile is used
+    import json
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="archscripts", formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Arch Linux provisioning and maintenance tools",
+        epilog="commands:\n" + "\n".join(f"  {name:<13} {summary}" for name, (_, _, summary) in COMMANDS.items()) +
+               "\n\nRun 'archscripts <command> --help' for a command's options.")
+    parser.add_argument("--profile", default=PROFILE_PATH,
+                        help="JSON file of default options per command, e.g. {\"install-wm\": {\"window-manager\": \"bspwm\"}}")
+    parser.add_argument("command", choices=COMMANDS, metavar="command", help="one of the commands below")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    command_args = args.args
+    if args.profile:
+        try:
+            command_args = profile_args(load_profile(args.profile), args.command) + command_args
+        except (OSError, ValueError, AttributeError) as e:
+            parser.error(f"cannot read profile {args.profile}: {e}")
+
+    module_name, console_level, _ = COMMANDS[args.command]
+    # The subcommand's usage and help then read "archscripts <command>"
+    sys.argv[0] = f"archscripts {args.command}"
+    module = importlib.import_module(module_name)
+    if "-h" not in command_args and "--help" not in command_args:
+        setup_logging = getattr(module, "setup_logging", None)
+        if setup_logging:
+            setup_logging()
+        else:
+            import logging
+            import telemetry
+            telemetry.setup(module_name, console_level=getattr(logging, console_level))
+    return module.main(command_args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,16 +17,15 @@ command_exists () {
   type "$1" &> /dev/null ;
 }
 
-# Function to check if necessary packages are installed
+# Function to check if necessary packages are installed, reading the pacman database directly
 check_packages() {
   local packages=( "pv" "lynis" "procps-ng" "inetutils" "pciutils" )
-  for package in "${packages[@]}"
-  do
-    if ! command_exists $package ; then
-      echo -e "${YELLOW}$package is not installed, installing...${NC}"
-      pacman -S --noconfirm $package
-    fi
-  done
+  local missing
+  missing=$(python3 "$(dirname "$0")/pacman_db.py" missing "${packages[@]}")
+  if [ -n "$missing" ]; then
+    echo -e "${YELLOW}Not installed, installing: $(echo $missing)${NC}"
+    pacman -S --needed --noconfirm $missing
+  fi
 }
 
 display_menu() {
@@ -64,7 +63,7 @@ while true; do
   case $action in
     1) pacman -Syu | pv -l ;;  # Use pipe viewer to simulate progress bar
     2) checkupdates | pv -l ;;
-    3) pacman -Q | pv -l ;;
+    3) python3 "$(dirname "$0")/pacman_db.py" list | pv -l ;;
     4) df -h ;;
     5) grub-mkconfig -o /boot/grub/grub.cfg; systemd-analyze; systemd-analyze blame ;;
     6) journalctl -p 3 -xb ;;
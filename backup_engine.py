@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import errno
+import shutil
+import fnmatch
+import tempfile
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import config_edit
+import telemetry
+
+# Repository layout:
+#   objects/ab/<sha256>       file contents, stored once
+#   snapshots/<name>/...      browsable trees of hardlinks into objects/
+#   manifests/<name>.json     path -> size, mtime, mode and hash for each snapshot
+
+
+def repo_paths(repo):
+    return {name: os.path.join(repo, name) for name in ("objects", "snapshots", "manifests")}
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def object_path(repo, sha256):
+    return os.path.join(repo, "objects", sha256[:2], sha256)
+
+
+def list_snapshots(repo):
+    try:
+        return sorted(name[:-len(".json")] for name in os.listdir(repo_paths(repo)["manifests"]) if name.endswith(".json"))
+    except FileNotFoundError:
+        return []
+
+
+def load_manifest(repo, snapshot):
+    with open(os.path.join(repo_paths(repo)["manifests"], f"{snapshot}.json")) as f:
+        return json.load(f)
+
+
+def previous_manifest(repo, source):
+    # The newest snapshot of the same source supplies the hashes of unchanged files
+    for snapshot in reversed(list_snapshots(repo)):
+        manifest = load_manifest(repo, snapshot)
+        if manifest["source"] == source:
+            return manifest
+    return None
+
+
+def scan_tree(source, excludes=()):
+    """Return (files, links, dirs) for source using only directory reads and lstat.
+
+    files maps a relative path to (size, mtime_ns, mode), links to their
+    target and dirs to their mode.
+    """
+    files, links, dirs = {}, {}, {}
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(source, rel_dir)) as entries:
+            for entry in entries:
+                rel = os.path.join(rel_dir, entry.name)
+                if any(fnmatch.fnmatch(rel, pattern) or fnmatch.fnmatch(entry.name, pattern) for pattern in excludes):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                if entry.is_symlink():
+                    links[rel] = os.readlink(entry.path)
+                elif entry.is_dir(follow_symlinks=False):
+                    dirs[rel] = st.st_mode & 0o7777
+                    stack.append(rel)
+                elif entry.is_file(follow_symlinks=False):
+                    files[rel] = (st.st_size, st.st_mtime_ns, st.st_mode & 0o7777)
+    return files, links, dirs
+
+
+def _store_object(repo, path):
+    """Copy path into the object store, hashing it on the way; returns (sha256, stored).
+
+    The content is read once, so the hash always matches what was stored
+    even if the file changes meanwhile. stored is False when another file
+    (or another thread) already supplied the object.
+    """
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=repo_paths(repo)["objects"], prefix=".store-")
+    try:
+        with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+            for block in iter(lambda: src.read(1024 * 1024), b""):
+                digest.update(block)
+                dst.write(block)
+        os.chmod(tmp, 0o444)
+        sha256 = digest.hexdigest()
+        obj = object_path(repo, sha256)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        try:
+            # link fails instead of replacing, so exactly one writer stores each object
+            os.link(tmp, obj)
+            stored = True
+        except FileExistsError:
+            stored = False
+    finally:
+        os.unlink(tmp)
+    return sha256, stored
+
+
+def _snapshot_name(paths):
+    # Backups within the same second get -1, -2, ...; the names still sort by age
+    base = time.strftime("%Y%m%dT%H%M%S")
+    name, count = base, 0
+    while (os.path.exists(os.path.join(paths["snapshots"], name))
+           or os.path.exists(os.path.join(paths["manifests"], f"{name}.json"))):
+        count += 1
+        name = f"{base}-{count}"
+    return name
+
+
+def _link_into_snapshot(obj, target):
+    try:
+        os.link(obj, target)
+    except OSError as e:
+        # Objects shared by very many snapshots can hit the filesystem's link limit
+        if e.errno != errno.EMLINK:
+            raise
+        shutil.copyfile(obj, target)
+
+
+def backup(source, repo, workers=8, excludes=(), snapshot=None):
+    """Snapshot source into repo and return (snapshot name, stats).
+
+    Unchanged files (same size and mtime as in the previous snapshot of this
+    source) are not read at all; changed files are hashed while workers
+    threads copy them. Only new content is stored; the snapshot itself is a
+    tree of hardlinks, published by renaming it into place.
+    """
+    source = os.path.abspath(source)
+    paths = repo_paths(repo)
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+    snapshot = snapshot or _snapshot_name(paths)
+    if os.path.exists(os.path.join(paths["snapshots"], snapshot)):
+        raise FileExistsError(f"Snapshot {snapshot} already exists in {repo}")
+    if os.path.abspath(repo).startswith(source + os.sep):
+        # Never back the repository up into itself
+        excludes = [*excludes, os.path.relpath(os.path.abspath(repo), source)]
+    previous = previous_manifest(repo, source)
+    old_files = previous["files"] if previous else {}
+
+    with telemetry.span("backup scan", source=source):
+        files, links, dirs = scan_tree(source, excludes)
+
+    entries, changed = {}, []
+    for rel, (size, mtime_ns, mode) in files.items():
+        old = old_files.get(rel)
+        if old and old[0] == size and old[1] == mtime_ns:
+            entries[rel] = [size, mtime_ns, mode, old[3]]
+        else:
+            changed.append(rel)
+
+    def store(rel):
+        return (rel, *_store_object(repo, os.path.join(source, rel)))
+
+    stats = {"files": len(files), "unchanged": len(entries), "hashed": 0, "stored": 0, "stored_bytes": 0, "vanished": 0}
+    with telemetry.span("backup copy", files=len(changed)), ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(store, rel) for rel in changed]
+        for future in futures:
+            try:
+                rel, sha256, stored = future.result()
+            except FileNotFoundError as e:
+                # Deleted between the scan and the copy
+                logging.warning(f"Skipping {e.filename}: it disappeared during the backup.")
+                stats["vanished"] += 1
+                continue
+            size, mtime_ns, mode = files[rel]
+            entries[rel] = [size, mtime_ns, mode, sha256]
+            stats["hashed"] += 1
+            if stored:
+                stats["stored"] += 1
+                stats["stored_bytes"] += size
+
+    with telemetry.span("backup snapshot", snapshot=snapshot):
+        partial = os.path.join(paths["snapshots"], f".{snapshot}.partial")
+        if os.path.exists(partial):
+            shutil.rmtree(partial)
+        os.makedirs(partial)
+        for rel in sorted(dirs):
+            os.makedirs(os.path.join(partial, rel), exist_ok=True)
+        for rel, (_, _, _, sha256) in entries.items():
+            _link_into_snapshot(object_path(repo, sha256), os.path.join(partial, rel))
+        for rel, target in links.items():
+            os.symlink(target, os.path.join(partial, rel))
+
+        manifest = {"source": source, "created": time.time(), "files": entries, "links": links, "dirs": dirs}
+        config_edit.write_atomic(os.path.join(paths["manifests"], f"{snapshot}.json"), json.dumps(manifest))
+        os.replace(partial, os.path.join(paths["snapshots"], snapshot))
+
+    logging.info(f"Snapshot {snapshot}: {stats}")
+    return snapshot, stats
+
+
+def restore(repo, snapshot, target, workers=8, prefix=""):
+    """Restore a snapshot (or the part of it under prefix) into target with its modes and mtimes."""
+    manifest = load_manifest(repo, snapshot)
+
+    def selected(rel):
+        return not prefix or rel == prefix or rel.startswith(prefix.rstrip("/") + "/")
+
+    os.makedirs(target, exist_ok=True)
+    for rel in sorted(manifest["dirs"]):
+        if selected(rel):
+            os.makedirs(os.path.join(target, rel), exist_ok=True)
+
+    def restore_file(item):
+        rel, (_, mtime_ns, mode, sha256) = item
+        dest = os.path.join(target, rel)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.restore"
+        shutil.copyfile(object_path(repo, sha256), tmp)
+        os.chmod(tmp, mode)
+        os.utime(tmp, ns=(mtime_ns, mtime_ns))
+        os.replace(tmp, dest)
+
+    items = [item for item in manifest["files"].items() if selected(item[0])]
+    with telemetry.span("backup restore", files=len(items)), ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        list(executor.map(restore_file, items))
+
+    for rel, link in manifest["links"].items():
+        if selected(rel):
+            dest = os.path.join(target, rel)
+            if os.path.lexists(dest):
+                os.unlink(dest)
+            os.symlink(link, dest)
+    # Directory modes last, so read-only directories do not block the files inside them
+    for rel, mode in manifest["dirs"].items():
+        if selected(rel):
+            os.chmod(os.path.join(target, rel), mode)
+    return len(items)
+
+
+def verify(repo, snapshot=None, workers=8):
+    """Re-hash the objects used by one or all snapshots; returns {sha256: problem}."""
+    snapshots = [snapshot] if snapshot else list_snapshots(repo)
+    wanted = set()
+    for name in snapshots:
+        wanted.update(entry[3] for entry in load_manifest(repo, name)["files"].values())
+
+    def check(sha256):
+        try:
+            return sha256, None if file_hash(object_path(repo, sha256)) == sha256 else "corrupt"
+        except FileNotFoundError:
+            return sha256, "missing"
+
+    with telemetry.span("backup verify", objects=len(wanted)), ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return {sha256: problem for sha256, problem in executor.map(check, sorted(wanted)) if problem}
+
+
+def prune(repo, keep):
+    """Drop all but the newest keep snapshots and the objects no snapshot links to any more."""
+    paths = repo_paths(repo)
+    removed = list_snapshots(repo)[:-keep] if keep > 0 else list_snapshots(repo)
+    for name in removed:
+        shutil.rmtree(os.path.join(paths["snapshots"], name), ignore_errors=True)
+        os.remove(os.path.join(paths["manifests"], f"{name}.json"))
+
+    # An object whose only link is its own entry in objects/ is unreferenced,
+    # unless a snapshot had to copy it after hitting the link limit
+    referenced = set()
+    for name in list_snapshots(repo):
+        referenced.update(entry[3] for entry in load_manifest(repo, name)["files"].values())
+    freed = 0
+    for root, _, names in os.walk(paths["objects"]):
+        for name in names:
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            if st.st_nlink == 1 and name not in referenced:
+                os.remove(path)
+                freed += st.st_size
+    return removed, freed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incremental, deduplicating snapshots of a directory tree")
+    parser.add_argument("--workers", type=int, default=8)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backup_parser = subparsers.add_parser("backup", help="Take a snapshot")
+    backup_parser.add_argument("source")
+    backup_parser.add_argument("repo")
+    backup_parser.add_argument("--exclude", action="append", default=[], help="Glob to skip (repeatable)")
+    restore_parser = subparsers.add_parser("restore", help="Restore a snapshot")
+    restore_parser.add_argument("repo")
+    restore_parser.add_argument("snapshot", help="Snapshot name or 'latest'")
+    restore_parser.add_argument("target")
+    restore_parser.add_argument("--path", default="", help="Only restore this file or directory")
+    verify_parser = subparsers.add_parser("verify", help="Check stored contents against their hashes")
+    verify_parser.add_argument("repo")
+    verify_parser.add_argument("snapshot", nargs="?")
+    list_parser = subparsers.add_parser("list", help="List snapshots")
+    list_parser.add_argument("repo")
+    prune_parser = subparsers.add_parser("prune", help="Keep only the newest snapshots")
+    prune_parser.add_argument("repo")
+    prune_parser.add_argument("--keep", type=int, required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == "backup":
+        snapshot, stats = backup(args.source, args.repo, args.workers, args.exclude)
+        print(f"Created snapshot {snapshot}: {stats['files']} files, {stats['hashed']} changed, "
+              f"{stats['stored']} new objects ({stats['stored_bytes'] / 1024 ** 2:.1f} MiB)")
+    elif args.command == "restore":
+        snapshot = list_snapshots(args.repo)[-1] if args.snapshot == "latest" else args.snapshot
+        count = restore(args.repo, snapshot, args.target, args.workers, args.path)
+        print(f"Restored {count} files from {snapshot} into {args.target}")
+    elif args.command == "verify":
+        problems = verify(args.repo, args.snapshot, args.workers)
+        for sha256, problem in problems.items():
+            print(f"{problem}: {sha256}")
+        print("All objects verified." if not problems else f"{len(problems)} object(s) failed verification.")
+        return 1 if problems else 0
+    elif args.command == "list":
+        for name in list_snapshots(args.repo):
+            manifest = load_manifest(args.repo, name)
+            print(f"{name}  {manifest['source']}  {len(manifest['files'])} files")
+    elif args.command == "prune":
+        removed, freed = prune(args.repo, args.keep)
+        print(f"Removed {len(removed)} snapshot(s), freed {freed / 1024 ** 2:.1f} MiB")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Compare shutil.copytree with venv_clone.clone_env on a synthetic large environment.
+
+    python3 benchmarks/bench_clone.py --size-mb 2000 --files 20000 --workdir /mnt/btrfs/tmp
+
+The workdir decides which clone path is measured: reflinks on btrfs/XFS,
+hardlinks plus copies elsewhere.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import subprocess
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import venv_clone
+
+
+def make_env(env_path, size_mb, files):
+    subprocess.run([sys.executable, "-m", "venv", "--without-pip", env_path], check=True)
+    site_packages = site_packages_dir(env_path)
+    chunk = os.urandom(1024 * 1024)
+    per_file = max(1, size_mb * 1024 * 1024 // files)
+    for i in range(files):
+        package_dir = os.path.join(site_packages, f"pkg{i // 500}")
+        os.makedirs(package_dir, exist_ok=True)
+        with open(os.path.join(package_dir, f"module{i}.so"), "wb") as f:
+            remaining = per_file
+            while remaining > 0:
+                f.write(chunk[:min(remaining, len(chunk))])
+                remaining -= len(chunk)
+    # A console script with an absolute shebang, like pip generates
+    script = os.path.join(env_path, "bin", "tool")
+    with open(script, "w") as f:
+        f.write(f"#!{os.path.abspath(env_path)}/bin/python\nimport sys\nprint(sys.prefix)\n")
+    os.chmod(script, 0o755)
+
+
+def site_packages_dir(env_path):
+    lib = os.path.join(env_path, "lib")
+    return os.path.join(lib, next(d for d in os.listdir(lib) if d.startswith("python")), "site-packages")
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def check_clone(env_path):
+    # The clone is usable when its console script runs with the clone as prefix
+    result = subprocess.run([os.path.join(env_path, "bin", "tool")], capture_output=True, text=True)
+    return result.returncode == 0 and os.path.realpath(result.stdout.strip()) == os.path.realpath(env_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=500)
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--workdir", default=None, help="Directory on the filesystem to benchmark")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_clone.", dir=args.workdir)
+    try:
+        base = os.path.join(workdir, "base")
+        print(f"Creating a {args.size_mb} MB environment with {args.files} files in {workdir}...")
+        make_env(base, args.size_mb, args.files)
+
+        copy_time, _ = timed(shutil.copytree, base, os.path.join(workdir, "copytree"))
+        fast_time, stats = timed(venv_clone.clone_env, base, os.path.join(workdir, "fast"))
+
+        print(f"{'Method':<12} {'Seconds':>9} {'Usable':>7}")
+        print(f"{'copytree':<12} {copy_time:>9.3f} {str(check_clone(os.path.join(workdir, 'copytree'))):>7}")
+        print(f"{'clone_env':<12} {fast_time:>9.3f} {str(check_clone(os.path.join(workdir, 'fast'))):>7}")
+        print(f"Speedup: {copy_time / fast_time:.1f}x  {stats}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
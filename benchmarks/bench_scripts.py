@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""Run the provisioning scripts end to end against fake system tools and time them.
+
+    python3 benchmarks/bench_scripts.py                     # run and report
+    python3 benchmarks/bench_scripts.py --save-baseline     # store the results
+    python3 benchmarks/bench_scripts.py --check             # fail on regressions
+
+pacman, pip, systemctl, nmcli, sudo and the other tools the scripts call are
+replaced on PATH by fake_tool.py, so nothing needs root or an Arch system.
+HOME and the working directory point into a scratch directory per scenario.
+Spawn counts come from the fakes' log, I/O from /proc/self/io (which
+includes reaped children) and per-step times from the telemetry event log.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import statistics
+import tarfile
+import subprocess
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+FAKE_TOOLS = [
+    "pacman", "pip", "systemctl", "nmcli", "sudo", "ping", "reboot", "yay", "paccache",
+    "journalctl", "arch-audit", "neofetch", "feh", "scrot", "cal", "p10k", "resolvectl",
+]
+ADDITIONAL_PROGRAMS = ["firefox", "alacritty", "neovim", "git", "htop", "ripgrep", "fd", "tmux", "zsh", "mpv"]
+
+
+def setup_install_wm(workdir):
+    with open(os.path.join(workdir, "additional_programs.json"), "w") as f:
+        json.dump(ADDITIONAL_PROGRAMS, f)
+
+
+def setup_install_wm_roots(workdir):
+    setup_install_wm(workdir)
+    # The fake pacman unpacks nothing, so provide the directory the lightdm package would
+    for role in ("desktop", "kiosk", "lab"):
+        os.makedirs(os.path.join(workdir, "roots", role, "etc", "lightdm"))
+
+
+def setup_init_penv(workdir):
+    # An existing environment whose pip is the fake, so nothing is downloaded
+    env_path = os.path.join(workdir, "envs", "bench_env")
+    subprocess.run([sys.executable, "-m", "venv", "--without-pip", env_path], check=True)
+    os.symlink(os.path.join(BENCH_DIR, "fake_tool.py"), os.path.join(env_path, "bin", "pip"))
+
+
+# name: (installed version, repository version, reason); archlinux-keyring goes in a chunk of its own
+UPDATE_PACKAGES = {
+    "archlinux-keyring": ("20240101-1", "20240601-1", 0),
+    "bash": ("5.2.021-1", "5.2.026-1", 0),
+    "readline": ("8.2.007-1", "8.2.010-1", 1),
+    "zlib": ("1:1.3-1", "1:1.3.1-1", 1),
+    "coreutils": ("9.4-3", "9.5-1", 0),
+}
+
+
+def _tar_member(name, content):
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    return info, io.BytesIO(content)
+
+
+def setup_maintenance_update(workdir):
+    """A pacman.conf with one file:// repository that upgrades every package in a fake local database."""
+    repo_dir = os.path.join(workdir, "repo")
+    local_dir = os.path.join(workdir, "pacman", "local")
+    sync_dir = os.path.join(workdir, "pacman", "sync")
+    os.makedirs(repo_dir)
+    os.makedirs(sync_dir)
+    package_size = 256 * 1024
+    with tarfile.open(os.path.join(repo_dir, "core.db"), "w:gz") as db:
+        for name, (installed, available, reason) in UPDATE_PACKAGES.items():
+            filename = f"{name}-{available.split(':')[-1]}-x86_64.pkg.tar.zst"
+            with open(os.path.join(repo_dir, filename), "wb") as f:
+                f.write(os.urandom(package_size))
+            desc = (f"%FILENAME%\n{filename}\n\n%NAME%\n{name}\n\n%VERSION%\n{available}\n\n"
+                    f"%CSIZE%\n{package_size}\n\n%ISIZE%\n{4 * package_size}\n\n")
+            db.addfile(*_tar_member(f"{name}-{available}/desc", desc.encode()))
+            os.makedirs(os.path.join(local_dir, f"{name}-{installed}"))
+            with open(os.path.join(local_dir, f"{name}-{installed}", "desc"), "w") as f:
+                f.write(f"%NAME%\n{name}\n\n%VERSION%\n{installed}\n\n%REASON%\n{reason}\n\n")
+    # The repository signs nothing, so apply must remove this stale signature
+    with open(os.path.join(sync_dir, "core.db.sig"), "wb") as f:
+        f.write(b"stale")
+    with open(os.path.join(workdir, "pacman.conf"), "w") as f:
+        f.write(f"[options]\nArchitecture = auto\n\n[core]\nServer = file://{repo_dir}\n")
+
+
+def setup_network_setup(workdir):
+    os.makedirs(os.path.join(workdir, "nm"))
+
+
+# name, script and arguments, stdin, extra environment, setup, expected exit status, needs root,
+# (tool, argument) pairs whose calls must all be running at once, most seconds the run may take
+SCENARIOS = [
+    {"name": "install_wm", "argv": ["install_wm.py", "--cache-dir", "{workdir}/pkg", "--journal", "{workdir}/journal.jsonl"],
+     "stdin": "xfce\nbspwm\n", "setup": setup_install_wm},
+    {"name": "install_wm-dry-run", "argv": ["install_wm.py", "--dry-run", "--cache-dir", "{workdir}/pkg", "--journal", "{workdir}/journal.jsonl"],
+     "stdin": "xfce\nbspwm\n", "setup": setup_install_wm},
+    {"name": "install_wm-bad-package", "argv": ["install_wm.py", "--cache-dir", "{workdir}/pkg", "--journal", "{workdir}/journal.jsonl"],
+     "stdin": "xfce\nbspwm\n", "env": {"FAKE_FAIL_PACMAN": r"-S --needed .*\bsxhkd\b"}, "setup": setup_install_wm,
+     "returncode": 1},
+    {"name": "install_wm-multi-root", "argv": ["install_wm.py", "--desktop-manager", "xfce", "--window-manager", "lightdm",
+                                               "--cache-dir", "{workdir}/pkg", "--journal", "{workdir}/journal.jsonl", "--jobs", "6",
+                                               "--target-root", "{workdir}/roots/desktop", "--target-root", "{workdir}/roots/kiosk",
+                                               "--target-root", "{workdir}/roots/lab"],
+     "stdin": "", "setup": setup_install_wm_roots,
+     # One call per target root; the targets must be provisioned side by side, not one after another
+     "overlap": [("pacman", "-S"), ("systemctl", "enable")]},
+    {"name": "init_penv", "argv": ["init_penv.py"],
+     "stdin": "{workdir}/envs\n1\n1\n2\n6\nrequests\n12\n\nq\n", "setup": setup_init_penv},
+    {"name": "maintenance-update", "argv": ["maintenance.py"], "stdin": "1\n", "setup": setup_maintenance_update},
+    {"name": "maintenance-cleanup", "argv": ["maintenance.py"], "stdin": "8\n"},
+    {"name": "configure_alacritty", "argv": ["configure_alacritty.py"], "stdin": ""},
+    {"name": "network_setup-wizard", "argv": ["network_setup.py", "--settle", "0.2", "--connections-dir", "{workdir}/nm"],
+     "stdin": "bench\neth0\n192.168.1.10/24\n192.168.1.1\n8.8.8.8\n", "env": {"ARCHSCRIPTS_NET_TARGETS": "127.0.0.1:9", "ARCHSCRIPTS_NET_DNS": "example.invalid"},
+     "setup": setup_network_setup, "root": True},
+    # A resolver that never answers must not stretch the check past its deadline
+    {"name": "net_probe-hung-dns", "argv": ["net_probe.py", "--timeout", "0.3", "--dns", "resolver.hung", "--target", "127.0.0.1:9"],
+     "stdin": "", "env": {"PYTHONPATH": f"{REPO_DIR}{os.pathsep}{os.path.join(BENCH_DIR, 'fake_resolver')}"},
+     "returncode": 1, "max_wall": 2.0},
+]
+
+
+def make_fake_bin(bin_dir):
+    os.makedirs(bin_dir)
+    for tool in FAKE_TOOLS:
+        os.symlink(os.path.join(BENCH_DIR, "fake_tool.py"), os.path.join(bin_dir, tool))
+
+
+def read_io():
+    with open("/proc/self/io") as f:
+        return {key: int(value) for key, value in (line.split(": ") for line in f if line.strip())}
+
+
+def read_jsonl(path):
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def step_breakdown(events, spawns):
+    """Return {top-level span: [seconds, spawns]}; spawns of concurrent steps overlap."""
+    steps = {}
+    for event in events:
+        if "span" not in event or event.get("parent") is not None:
+            continue
+        start = event["ts"] - event["elapsed"]
+        count = sum(1 for spawn in spawns if start <= spawn["ts"] <= event["ts"])
+        seconds, total = steps.get(event["span"], (0.0, 0))
+        steps[event["span"]] = [seconds + event["elapsed"], total + count]
+    return steps
+
+
+def serialized_calls(spawns, overlap, latency):
+    """Return the (tool, argument) pairs whose calls did not all run at once.
+
+    Every fake call takes latency seconds from the moment it is logged, so
+    the calls overlap only if the last one started before the first ended.
+    """
+    serialized = []
+    for tool, argument in overlap:
+        starts = [spawn["ts"] for spawn in spawns if spawn["tool"] == tool and argument in spawn["argv"]]
+        if len(starts) < 2 or max(starts) - min(starts) >= latency:
+            serialized.append(f"{tool} {argument}")
+    return serialized
+
+
+def run_scenario(scenario, latency, keep=False):
+    workdir = tempfile.mkdtemp(prefix=f"bench_{scenario['name']}.")
+    try:
+        bin_dir = os.path.join(workdir, "bin")
+        make_fake_bin(bin_dir)
+        for name in ("home", "mirror", "pkg"):
+            os.makedirs(os.path.join(workdir, name))
+        if scenario.get("setup"):
+            scenario["setup"](workdir)
+
+        spawn_log = os.path.join(workdir, "spawns.jsonl")
+        events_log = os.path.join(workdir, "events.jsonl")
+        env = dict(os.environ,
+                   PATH=f"{bin_dir}{os.pathsep}{os.environ['PATH']}",
+                   HOME=os.path.join(workdir, "home"),
+                   PYTHONPATH=REPO_DIR,
+                   PYTHONDONTWRITEBYTECODE="1",
+                   ARCHSCRIPTS_TELEMETRY=events_log,
+                   ARCHSCRIPTS_PYPI_INDEX=os.path.join(workdir, "simple.json"),
+                   # An empty candidate list, so no scenario probes real mirrors
+                   ARCHSCRIPTS_MIRRORLIST=os.path.join(workdir, "mirrorlist"),
+                   ARCHSCRIPTS_PACMAN_CONF=os.path.join(workdir, "pacman.conf"),
+                   ARCHSCRIPTS_PACMAN_DBPATH=os.path.join(workdir, "pacman"),
+                   FAKE_SPAWN_LOG=spawn_log,
+                   FAKE_MIRROR=os.path.join(workdir, "mirror"),
+                   FAKE_LATENCY=str(latency))
+        env.update(scenario.get("env", {}))
+        argv = [arg.format(workdir=workdir) for arg in scenario["argv"]]
+        argv[0] = os.path.join(REPO_DIR, argv[0])
+
+        io_before = read_io()
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, *argv], input=scenario["stdin"].format(workdir=workdir),
+                                capture_output=True, text=True, cwd=workdir, env=env)
+        wall = time.perf_counter() - start
+        io_after = read_io()
+
+        if result.returncode != scenario.get("returncode", 0):
+            print(f"{scenario['name']} exited with {result.returncode}:\n{result.stdout[-2000:]}\n{result.stderr[-2000:]}",
+                  file=sys.stderr)
+        spawns = read_jsonl(spawn_log)
+        return {
+            "returncode": result.returncode,
+            "wall": wall,
+            "spawns": len(spawns),
+            "read_bytes": io_after["rchar"] - io_before["rchar"],
+            "write_bytes": io_after["wchar"] - io_before["wchar"],
+            "steps": step_breakdown(read_jsonl(events_log), spawns),
+            "serialized": serialized_calls(spawns, scenario.get("overlap", []), latency),
+            "max_wall": scenario.get("max_wall"),
+        }
+    finally:
+        if keep:
+            print(f"Kept {workdir}")
+        else:
+            shutil.rmtree(workdir)
+
+
+def run_all(scenarios, latency, repeat, keep=False):
+    results = {}
+    for scenario in scenarios:
+        runs = [run_scenario(scenario, latency, keep) for _ in range(repeat)]
+        # The median run is reported so that one slow outlier does not trip the gate
+        median = sorted(runs, key=lambda run: run["wall"])[len(runs) // 2]
+        median["wall"] = statistics.median(run["wall"] for run in runs)
+        results[scenario["name"]] = median
+    return results
+
+
+def print_results(results):
+    print(f"{'Scenario':<42} {'Exit':>4} {'Wall':>8} {'Spawns':>6} {'Read':>10} {'Written':>10}")
+    for name, result in results.items():
+        print(f"{name:<42} {result['returncode']:>4} {result['wall']:>7.2f}s {result['spawns']:>6} "
+              f"{result['read_bytes'] / 1024:>8.0f}K {result['write_bytes'] / 1024:>8.0f}K")
+        for step, (seconds, spawns) in sorted(result["steps"].items(), key=lambda item: -item[1][0]):
+            print(f"  {step[:40]:<40} {'':>4} {seconds:>7.2f}s {spawns:>6}")
+
+
+def compare(results, baseline, tolerance, slack=0.25):
+    """Return a list of regressions against baseline.
+
+    Spawn counts are deterministic and must not grow at all; wall time and
+    I/O may grow by tolerance (a fraction) plus a small absolute slack.
+    """
+    regressions = []
+    for name, result in results.items():
+        for calls in result.get("serialized", []):
+            regressions.append(f"{name}: '{calls}' calls ran one after another instead of concurrently")
+        if result["max_wall"] is not None and result["wall"] > result["max_wall"]:
+            regressions.append(f"{name}: took {result['wall']:.2f}s, over its limit of {result['max_wall']:.2f}s")
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["returncode"] != base["returncode"]:
+            regressions.append(f"{name}: exit status {base['returncode']} -> {result['returncode']}")
+        if result["spawns"] > base["spawns"]:
+            regressions.append(f"{name}: spawns {base['spawns']} -> {result['spawns']}")
+        if result["wall"] > base["wall"] * (1 + tolerance) + slack:
+            regressions.append(f"{name}: wall time {base['wall']:.2f}s -> {result['wall']:.2f}s")
+        for key in ("read_bytes", "write_bytes"):
+            if result[key] > base[key] * (1 + tolerance) + 1024 * 1024:
+                regressions.append(f"{name}: {key} {base[key]} -> {result[key]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", help="Scenario names to run")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds each fake tool call takes")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario; the median is reported")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="Exit 1 if results regress against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative growth of wall time and I/O")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directories for inspection")
+    args = parser.parse_args()
+
+    scenarios = [s for s in SCENARIOS if not args.only or s["name"] in args.only]
+    skipped = [s["name"] for s in scenarios if s.get("root") and os.geteuid() != 0]
+    if skipped:
+        print(f"Skipping {', '.join(skipped)}: needs root.")
+    results = run_all([s for s in scenarios if s["name"] not in skipped], args.latency, max(1, args.repeat), args.keep)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+            f.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+    if args.check:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
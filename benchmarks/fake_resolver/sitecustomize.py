@@ -0,0 +1,21 @@
+"""Make lookups of names under .hung block, as with an unresponsive resolver.
+
+Put on PYTHONPATH by bench_scripts.py for scenarios that need a resolver
+that never answers; FAKE_DNS_HANG sets how long a lookup blocks.
+"""
+
+import os
+import time
+import socket
+
+_getaddrinfo = socket.getaddrinfo
+
+
+def getaddrinfo(host, *args, **kwargs):
+    if isinstance(host, str) and host.endswith(".hung"):
+        time.sleep(float(os.environ.get("FAKE_DNS_HANG", "10")))
+        raise socket.gaierror(socket.EAI_AGAIN, "Temporary failure in name resolution")
+    return _getaddrinfo(host, *args, **kwargs)
+
+
+socket.getaddrinfo = getaddrinfo
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Stand-in for pacman, pip, systemctl, nmcli, sudo and friends, used by bench_scripts.py.
+
+The tool is chosen by the name it is invoked as (bench_scripts.py symlinks
+every tool name to this file). Behaviour is controlled by environment:
+
+    FAKE_SPAWN_LOG         append one JSON line per invocation here
+    FAKE_LATENCY           seconds to sleep per invocation
+    FAKE_LATENCY_<TOOL>    per-tool override, e.g. FAKE_LATENCY_PACMAN=0.5
+    FAKE_FAIL_<TOOL>       regex; fail when it matches the joined arguments
+    FAKE_MIRROR            directory that pacman -Sp URLs point into
+    FAKE_PACKAGE_SIZE      size in bytes of the package files it creates
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+
+# Options taking a value, so their argument is not mistaken for a package
+PACMAN_VALUE_OPTIONS = {"--print-format", "--cachedir", "--dbpath", "--root", "--config", "--sysroot", "-r", "-b"}
+PIP_VALUE_OPTIONS = {"--wheel-dir", "-w", "--log", "--find-links", "-f", "--index-url", "-i", "-r", "--requirement", "-c"}
+
+
+def env_key(tool):
+    return re.sub(r"\W", "_", tool).upper()
+
+
+def record(tool, args):
+    log_path = os.environ.get("FAKE_SPAWN_LOG")
+    if log_path:
+        line = json.dumps({"tool": tool, "argv": args, "ts": time.time(), "pid": os.getpid()}) + "\n"
+        # A single O_APPEND write keeps lines from concurrent fakes intact
+        fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+
+def positional(args, value_options):
+    names, skip = [], False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in value_options:
+            skip = True
+        elif not arg.startswith("-"):
+            names.append(arg)
+    return names
+
+
+def option_value(args, *names):
+    for i, arg in enumerate(args[:-1]):
+        if arg in names:
+            return args[i + 1]
+    return None
+
+
+def fake_pacman(args):
+    if any(arg.startswith("-S") and "p" in arg[1:] for arg in args):
+        mirror = os.environ.get("FAKE_MIRROR", "/tmp")
+        size = int(os.environ.get("FAKE_PACKAGE_SIZE", 64 * 1024))
+        for name in positional(args[1:], PACMAN_VALUE_OPTIONS):
+            path = os.path.join(mirror, f"{name}-1.0-1-x86_64.pkg.tar.zst")
+            if not os.path.exists(path):
+                with open(path, "wb") as f:
+                    f.write(b"\0" * size)
+            print(f"file://{path}")
+    return 0
+
+
+def _requirements(args):
+    names = positional(args[1:], PIP_VALUE_OPTIONS)
+    requirement_file = option_value(args, "-r", "--requirement")
+    if requirement_file:
+        with open(requirement_file) as f:
+            names += [line.split()[0] for line in f if line.strip() and not line.startswith("#")]
+    return [re.split(r"[<>=!~;\[ ]", name)[0] for name in names]
+
+
+def _site_packages():
+    # Installed "distributions" go next to the pip we were invoked as, if it is in a venv
+    prefix = os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0])))
+    return next(iter(glob.glob(os.path.join(prefix, "lib", "python*", "site-packages"))), None)
+
+
+def fake_pip(args):
+    command = args[0] if args else ""
+    if command == "--version":
+        print("pip 24.0 (fake)")
+    elif command == "wheel":
+        wheel_dir = option_value(args, "--wheel-dir", "-w") or "."
+        for name in _requirements(args):
+            with open(os.path.join(wheel_dir, f"{name.replace('-', '_')}-1.0-py3-none-any.whl"), "wb") as f:
+                f.write(name.encode())
+    elif command == "install":
+        find_links = option_value(args, "--find-links", "-f")
+        site_packages = _site_packages()
+        for name in _requirements(args):
+            wheel = f"{name.replace('-', '_')}-1.0-py3-none-any.whl"
+            if "--no-index" in args and not (find_links and os.path.exists(os.path.join(find_links, wheel))):
+                print(f"ERROR: No matching distribution found for {name}", file=sys.stderr)
+                return 1
+            if site_packages:
+                dist_info = os.path.join(site_packages, f"{name.replace('-', '_')}-1.0.dist-info")
+                os.makedirs(dist_info, exist_ok=True)
+                with open(os.path.join(dist_info, "METADATA"), "w") as f:
+                    f.write(f"Metadata-Version: 2.1\nName: {name}\nVersion: 1.0\n")
+    elif command == "uninstall":
+        site_packages = _site_packages()
+        for name in positional(args[1:], PIP_VALUE_OPTIONS):
+            for dist_info in glob.glob(os.path.join(site_packages or "/nonexistent", f"{name.replace('-', '_')}-*.dist-info")):
+                for entry in os.listdir(dist_info):
+                    os.remove(os.path.join(dist_info, entry))
+                os.rmdir(dist_info)
+    return 0
+
+
+def fake_sudo(args):
+    while args and args[0].startswith("-"):
+        args = args[2:] if args[0] in ("-u", "-g") else args[1:]
+    os.execvp(args[0], args)
+
+
+def main():
+    tool = os.path.basename(sys.argv[0])
+    args = sys.argv[1:]
+    record(tool, args)
+
+    key = env_key(tool)
+    time.sleep(float(os.environ.get(f"FAKE_LATENCY_{key}", os.environ.get("FAKE_LATENCY", "0"))))
+    fail = os.environ.get(f"FAKE_FAIL_{key}")
+    if fail and re.search(fail, " ".join(args)):
+        print(f"{tool}: injected failure for '{' '.join(args)}'", file=sys.stderr)
+        return int(os.environ.get("FAKE_FAIL_CODE", "1"))
+
+    if tool == "sudo":
+        fake_sudo(args)
+    if tool == "pacman":
+        return fake_pacman(args)
+    if tool == "pip":
+        return fake_pip(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
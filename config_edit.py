@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import copy
+import logging
+import tempfile
+
+import telemetry
+
+# Edits are plain dicts so they can also be sent to the privileged helper.
+
+
+def ini_set(section, key, value):
+    """Set key=value in [section], uncommenting '#key=' if present."""
+    return {"op": "ini_set", "section": section, "key": key, "value": value}
+
+
+def shell_block(name, body):
+    """Keep body between '# >>> archscripts name >>>' markers, replacing any earlier version."""
+    return {"op": "shell_block", "name": name, "body": body}
+
+
+def remove_lines(lines):
+    """Drop every line equal to one of lines, e.g. copies left by older append-only versions."""
+    return {"op": "remove_lines", "lines": list(lines)}
+
+
+def yaml_merge(data):
+    """Deep-merge a mapping into a YAML document (needs PyYAML)."""
+    return {"op": "yaml_merge", "data": data}
+
+
+def replace_content(content):
+    """Make the whole file equal to content."""
+    return {"op": "replace_content", "content": content}
+
+
+def _ini_set(text, section, key, value):
+    lines = text.splitlines()
+    header = f"[{section}]"
+    key_re = re.compile(rf"^\s*#?\s*{re.escape(key)}\s*=")
+    new_line = f"{key}={value}"
+
+    start = next((i for i, line in enumerate(lines) if line.strip() == header), None)
+    if start is None:
+        if lines and lines[-1].strip():
+            lines.append("")
+        lines += [header, new_line]
+        return "\n".join(lines) + "\n"
+
+    end = next((i for i in range(start + 1, len(lines)) if lines[i].lstrip().startswith("[")), len(lines))
+    matches = [i for i in range(start + 1, end) if key_re.match(lines[i])]
+    active = [i for i in matches if not lines[i].lstrip().startswith("#")]
+    if active:
+        lines[active[0]] = new_line
+    elif matches:
+        lines[matches[0]] = new_line
+    else:
+        insert_at = end
+        while insert_at > start + 1 and not lines[insert_at - 1].strip():
+            insert_at -= 1
+        lines.insert(insert_at, new_line)
+    return "\n".join(lines) + "\n"
+
+
+def _shell_block(text, name, body):
+    begin = f"# >>> archscripts {name} >>>"
+    end = f"# <<< archscripts {name} <<<"
+    block = f"{begin}\n{body.rstrip()}\n{end}\n"
+    pattern = re.compile(rf"^{re.escape(begin)}\n.*?^{re.escape(end)}\n?", re.MULTILINE | re.DOTALL)
+    if pattern.search(text):
+        return pattern.sub(lambda _: block, text, count=1)
+    if text and not text.endswith("\n"):
+        text += "\n"
+    return text + ("\n" if text else "") + block
+
+
+def _remove_lines(text, lines):
+    unwanted = set(lines)
+    kept = []
+    for line in text.splitlines():
+        if line in unwanted:
+            # Also drop the blank separator line written in front of it
+            if kept and not kept[-1].strip():
+                kept.pop()
+            continue
+        kept.append(line)
+    return "\n".join(kept) + "\n" if kept else ""
+
+
+def _merge(base, data):
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            _merge(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+
+def _yaml_merge(text, data):
+    try:
+        import yaml
+    except ImportError:
+        raise RuntimeError("YAML edits require PyYAML (pacman -S python-yaml)")
+    document = yaml.safe_load(text) or {}
+    merged = _merge(copy.deepcopy(document), data)
+    if merged == document:
+        return text
+    return yaml.safe_dump(merged, default_flow_style=False, sort_keys=False)
+
+
+def apply_edit(text, edit):
+    op = edit["op"]
+    if op == "ini_set":
+        return _ini_set(text, edit["section"], edit["key"], edit["value"])
+    if op == "shell_block":
+        return _shell_block(text, edit["name"], edit["body"])
+    if op == "remove_lines":
+        return _remove_lines(text, edit["lines"])
+    if op == "yaml_merge":
+        return _yaml_merge(text, edit["data"])
+    if op == "replace_content":
+        return edit["content"]
+    raise ValueError(f"Unknown config edit '{op}'")
+
+
+def write_atomic(path, content, mode=None):
+    """Write content to a temporary file beside path, fsync it and rename it into place."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is None and os.path.exists(path):
+            mode = os.stat(path).st_mode & 0o7777
+        os.chmod(tmp, mode if mode is not None else 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def apply_edits(path, edits, mode=None, backup=True):
+    """Apply a batch of edits with one read and at most one atomic write.
+
+    Nothing is written when the edits leave the file unchanged. Otherwise the
+    previous content is kept as a single '<path>.bak'. Returns True if the
+    file changed.
+    """
+    with telemetry.span("edit config", path=path):
+        return _apply_edits(path, edits, mode, backup)
+
+
+def _apply_edits(path, edits, mode, backup):
+    try:
+        with open(path) as f:
+            original = f.read()
+        exists = True
+    except FileNotFoundError:
+        original, exists = "", False
+
+    text = original
+    for edit in edits:
+        text = apply_edit(text, edit)
+
+    if exists and text == original:
+        if mode is not None and os.stat(path).st_mode & 0o7777 != mode:
+            os.chmod(path, mode)
+            return True
+        logging.info(f"{path} is already up to date.")
+        return False
+
+    if exists and backup:
+        write_atomic(f"{path}.bak", original, os.stat(path).st_mode & 0o7777)
+    write_atomic(path, text, mode)
+    logging.info(f"Updated {path}.")
+    return True
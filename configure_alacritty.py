@@ -1,26 +1,37 @@
 import os
-import subprocess
+import sys
+import logging
+import argparse
+
+import config_edit
+import mirror_rank
+import pacman_db
+import telemetry
+
+CONFIG_DIR = os.path.expanduser("~/.config/alacritty")
 
 def print_colored(msg, color_code):
     print(f"\033[{color_code}m{msg}\033[0m")
 
-def backup_file(file):
-    if os.path.isfile(file):
-        backup = f"{file}.bak"
-        print_colored(f"Backing up {file} to {backup}...", "1;34")
-        subprocess.run(["cp", file, backup])
-
 def create_config_directory(directory):
     os.makedirs(directory, exist_ok=True)
 
 def write_config(file, content):
-    with open(file, "w") as f:
-        f.write(content)
+    # Leaves the file untouched when nothing changed, otherwise keeps the old one as <file>.bak
+    existed = os.path.isfile(file)
+    changed = config_edit.apply_edits(file, [config_edit.replace_content(content)])
+    if changed and existed:
+        print_colored(f"Updated {file}, previous version saved as {file}.bak", "1;34")
+    return changed
 
 def install_packages(packages):
+    db = pacman_db.get_db()
+    missing = [package for package in packages if not db.satisfied(package)]
+    if not missing:
+        return
+    mirror_rank.ensure_ranked()
     package_manager = "pacman" if os.path.exists("/usr/bin/pacman") else "yay"
-    subprocess.run([f"sudo {package_manager} -Syu --noconfirm"])
-    subprocess.run([f"sudo {package_manager} -S --noconfirm"] + packages)
+    telemetry.run(["sudo", package_manager, "-S", "--needed", "--noconfirm"] + missing)
 
 
 def tips_and_tricks():
@@ -52,12 +63,9 @@ def tips_and_tricks():
 
 
 
-def configure_alacritty(install_optional=False):
-    alacritty_config_dir = os.path.expanduser("~/.config/alacritty")
+def configure_alacritty(install_optional=False, alacritty_config_dir=CONFIG_DIR):
     alacritty_config_file = os.path.join(alacritty_config_dir, "alacritty.yml")
 
-    backup_file(alacritty_config_file)
-
     create_config_directory(alacritty_config_dir)
 
     alacritty_config_content = '''
@@ -95,13 +103,27 @@ shell:
 
     if install_optional:
         install_packages(["zsh", "fonts-powerline"])
-        subprocess.run(["p10k", "configure"])
+        telemetry.run(["p10k", "configure"])
 
     write_config(alacritty_config_file, alacritty_config_content)
 
     print_colored("Alacritty configuration updated for maximum performance and copy-paste support.", "1;32")
 
 
-configure_alacritty()
-tips_and_tricks()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write an Alacritty configuration")
+    parser.add_argument("--install-optional", action="store_true", help="Also install zsh and powerline fonts and run p10k configure")
+    parser.add_argument("--config-dir", default=CONFIG_DIR)
+    parser.add_argument("--no-tips", action="store_true", help="Do not print the tips afterwards")
+    args = parser.parse_args(argv)
+
+    configure_alacritty(args.install_optional, args.config_dir)
+    if not args.no_tips:
+        tips_and_tricks()
+    return 0
+
+
+if __name__ == "__main__":
+    telemetry.setup("configure_alacritty", console_level=logging.WARNING)
+    sys.exit(main())
 
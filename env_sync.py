@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import hashlib
+import logging
+import argparse
+import tempfile
+
+import config_edit
+import telemetry
+import venv_index
+import wheel_store
+
+LOCK_HEADER = "# archscripts lock file, regenerate with env_sync.py --write-lock"
+# Kept outside the environment so writing it does not change the env's mtime
+STAMP_DIR = os.path.expanduser("~/.cache/archscripts/sync-stamps")
+# Installer tooling is never removed just because the lock file omits it
+KEEP = {"pip", "setuptools", "wheel"}
+
+_LINE_RE = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*==\s*([^\s;\\]+)(.*)$")
+
+
+def read_lock(lock_path):
+    """Return {normalized name: (name, version, [hashes])} from a name==version lock file."""
+    locked = {}
+    with open(lock_path) as f:
+        content = f.read().replace("\\\n", " ")
+    for line in content.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        match = _LINE_RE.match(line)
+        if not match:
+            raise ValueError(f"Unsupported lock file line in {lock_path}: {line}")
+        name, version, rest = match.groups()
+        hashes = re.findall(r"--hash=(\S+)", rest)
+        locked[venv_index.normalize_name(name)] = (name, version, hashes)
+    return locked
+
+
+def plan_sync(locked, installed):
+    """Return (install, remove): lock lines to install and distribution names to uninstall."""
+    install = [entry for key, entry in sorted(locked.items())
+               if installed.get(key, [None, None])[1] != entry[1]]
+    remove = [installed[key][0] for key in sorted(installed)
+              if key not in locked and key not in KEEP]
+    return install, remove
+
+
+def _lock_line(name, version, hashes):
+    return " ".join([f"{name}=={version}", *(f"--hash={h}" for h in hashes)])
+
+
+def _lock_digest(lock_path):
+    with open(lock_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _stamp(env_path, lock_path):
+    return {"lock": _lock_digest(lock_path), "env": venv_index.env_mtime(env_path)}
+
+
+def _stamp_path(env_path):
+    return os.path.join(STAMP_DIR, hashlib.sha256(os.path.abspath(env_path).encode()).hexdigest() + ".json")
+
+
+def _read_stamp(env_path):
+    try:
+        with open(_stamp_path(env_path)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_lock(env_path, lock_path, store=wheel_store.STORE_PATH):
+    """Write a lock file for the installed distributions, atomically.
+
+    Hashes come from the wheel store, only for wheels that were downloaded:
+    a wheel built here has a hash no other machine can reproduce. They are
+    only written when every distribution has one, since pip requires
+    hashes on all lines or none.
+    """
+    installed = venv_index.scan_env(env_path)["packages"]
+    store_index = wheel_store.load_index(store)
+    hashes = {}
+    for entry in store_index.values():
+        # Entries from before builds were recorded may be built ones too
+        if entry.get("built", True):
+            continue
+        hashes.setdefault((entry["name"], entry["version"]), []).append(f"sha256:{entry['sha256']}")
+
+    entries = [(name, version, sorted(hashes.get((key, version), [])))
+               for key, (name, version) in sorted(installed.items()) if key not in KEEP]
+    if not all(entry_hashes for _, _, entry_hashes in entries):
+        entries = [(name, version, []) for name, version, _ in entries]
+    content = "\n".join([LOCK_HEADER, *(_lock_line(*entry) for entry in entries)]) + "\n"
+    config_edit.write_atomic(lock_path, content)
+    return lock_path
+
+
+@telemetry.timed("sync environment")
+def sync(env_path, lock_path, store=wheel_store.STORE_PATH):
+    """Make env_path match lock_path with the fewest pip operations.
+
+    When neither the lock file nor the environment changed since the last
+    sync, only a stamp comparison is done. Returns (installed, removed).
+    """
+    stamp = _read_stamp(env_path)
+    if stamp is not None and stamp == _stamp(env_path, lock_path):
+        logging.info(f"{env_path} is in sync with {lock_path}.")
+        return [], []
+
+    locked = read_lock(lock_path)
+    installed = venv_index.scan_env(env_path)["packages"]
+    install, remove = plan_sync(locked, installed)
+
+    if remove:
+        logging.info(f"Removing {' '.join(remove)} from {env_path}")
+        telemetry.run([os.path.join(env_path, "bin", "pip"), "uninstall", "-y", *remove], check=True)
+    if install:
+        logging.info(f"Installing {' '.join(f'{n}=={v}' for n, v, _ in install)} into {env_path}")
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", prefix="sync.") as requirements:
+            requirements.write("\n".join(_lock_line(*entry) for entry in install) + "\n")
+            requirements.flush()
+            # One transaction for every install, upgrade and downgrade
+            wheel_store.install(env_path, ["--no-deps", "-r", requirements.name], store=store)
+
+    os.makedirs(STAMP_DIR, exist_ok=True)
+    config_edit.write_atomic(_stamp_path(env_path), json.dumps(_stamp(env_path, lock_path)))
+    return [f"{n}=={v}" for n, v, _ in install], remove
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync a virtual environment with a lock file")
+    parser.add_argument("env_path")
+    parser.add_argument("lock_path", nargs="?", help="Defaults to <env>/requirements.lock")
+    parser.add_argument("--write-lock", action="store_true", help="Write the lock file from the environment instead")
+    args = parser.parse_args(argv)
+    lock_path = args.lock_path or os.path.join(args.env_path, "requirements.lock")
+
+    if args.write_lock:
+        write_lock(args.env_path, lock_path)
+        print(f"Wrote {lock_path}")
+        return 0
+
+    installed, removed = sync(args.env_path, lock_path)
+    if installed or removed:
+        print(f"Installed {len(installed)}, removed {len(removed)} package(s).")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())
@@ -6,20 +6,43 @@ import subprocess
 import sys
 import platform
 import logging
+import fnmatch
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from rich.console import Console
-from rich.table import Table
+
+import env_sync
+import pypi_index
+import telemetry
+import venv_clone
+import venv_index
+import wheel_store
+
+
+
+class _LazyConsole:
+    # rich takes longer to import than the rest of the script; only load it once something is printed
+    def __getattr__(self, name):
+        return getattr(_console(), name)
+
+
+def _console():
+    global console
+    if isinstance(console, _LazyConsole):
+        from rich.console import Console
+        console = Console()
+    return console
+
+
+console = _LazyConsole()
 
 
 def setup_logging():
     """Set up logging configuration."""
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    # Progress is printed through rich, so the console only shows warnings
+    telemetry.setup("init_penv", console_level=logging.WARNING)
 
 # Function to delete the virtual environment at the given path
 def delete_virtual_environment(env_path):
@@ -27,28 +50,35 @@ def delete_virtual_environment(env_path):
     logging.info(f"Deleted virtual environment at {env_path}")
     console.print(f"Deleted virtual environment at {env_path}")
 
-# Function to clone an existing virtual environment to a new location
-def clone_virtual_environment(src_env_path, dest_env_name, folder_path):
+# Function to clone an existing virtual environment to a new location.
+# The fast mode reflinks or hardlinks files and rewrites bin/ and pyvenv.cfg
+# so that the clone works from its new path.
+def clone_virtual_environment(src_env_path, dest_env_name, folder_path, fast=True):
     dest_env_path = os.path.join(folder_path, dest_env_name)
-    shutil.copytree(src_env_path, dest_env_path)
+    with telemetry.span("clone environment", fast=fast):
+        if fast:
+            stats = venv_clone.clone_env(src_env_path, dest_env_path)
+            logging.info(f"Clone of {src_env_path}: {stats}")
+        else:
+            shutil.copytree(src_env_path, dest_env_path)
     logging.info(f"Cloned virtual environment at {dest_env_path}")
     console.print(f"Cloned virtual environment at {dest_env_path}")
 
 # Function to update a package in the virtual environment
 def update_package(env_path, package_name):
-    subprocess.run([os.path.join(env_path, "bin", "pip"), "install", "--upgrade", package_name], check=True)
+    wheel_store.install(env_path, [package_name], upgrade=True)
     logging.info(f"{package_name} updated successfully.")
     console.print(f"{package_name} updated successfully.")
 
 # Function to downgrade a package in the virtual environment
 def downgrade_package(env_path, package_name, version):
-    subprocess.run([os.path.join(env_path, "bin", "pip"), "install", f"{package_name}=={version}"], check=True)
+    wheel_store.install(env_path, [f"{package_name}=={version}"])
     logging.info(f"{package_name} downgraded to version {version}.")
     console.print(f"{package_name} downgraded to version {version}.")
 
 # Function to uninstall a package from the virtual environment
 def uninstall_package(env_path, package_name):
-    subprocess.run([os.path.join(env_path, "bin", "pip"), "uninstall", "-y", package_name], check=True)
+    telemetry.run([os.path.join(env_path, "bin", "pip"), "uninstall", "-y", package_name], check=True)
     logging.info(f"{package_name} uninstalled successfully.")
     console.print(f"{package_name} uninstalled successfully.")
 
@@ -64,48 +94,176 @@ def is_executable_installed(executable):
 def search_existing_envs(folder_path):
     """Search for existing virtual environments in the given folder."""
     folder_path = Path(folder_path)
-    existing_envs = [d for d in folder_path.glob("*") if d.is_dir()]
+    existing_envs = sorted(d for d in folder_path.glob("*") if d.is_dir() and venv_index.is_virtual_environment(d))
     return [str(env_path.relative_to(folder_path)) for env_path in existing_envs]
 
 
 # Function to create a new virtual environment at the given path
 def create_virtual_environment(env_path):
     python_executable = "python3" if platform.system() != "Windows" else "python"
-    subprocess.check_call([python_executable, "-m", "venv", env_path])
+    telemetry.run([python_executable, "-m", "venv", env_path], check=True)
     logging.info(f"Created virtual environment at {env_path}")
     console.print(f"Created virtual environment at {env_path}")
 
 
-# Function to create a requirements.txt file for the virtual environment
-def create_requirements_file(env_path):
-    subprocess.run([os.path.join(env_path, "bin", "pip"), "freeze", "--local", ">", "requirements.txt"], shell=True, check=True, text=True)
-    logging.info("requirements.txt file created successfully.")
-    console.print("requirements.txt file created successfully.")
+# Function to create a requirements.txt file for the virtual environment.
+# It is read from the installed metadata and doubles as a lock file for env_sync.
+def create_requirements_file(env_path, requirements_path="requirements.txt"):
+    env_sync.write_lock(env_path, requirements_path)
+    logging.info(f"{requirements_path} file created successfully.")
+    console.print(f"{requirements_path} file created successfully.")
+
+# Function to make the virtual environment match a lock file
+def sync_environment(env_path, lock_path):
+    installed, removed = env_sync.sync(env_path, lock_path)
+    logging.info(f"Synced {env_path} with {lock_path}: {len(installed)} installed, {len(removed)} removed.")
+    console.print(f"Synced with {lock_path}: {len(installed)} installed, {len(removed)} removed.")
 
 
 def upgrade_packages(env_path):
-    subprocess.run([os.path.join(env_path, "bin", "pip"), "install", "--upgrade", "pip", "setuptools", "wheel"], check=True)
+    wheel_store.install(env_path, ["pip", "setuptools", "wheel"], upgrade=True)
     logging.info("pip, setuptools, and wheel upgraded successfully.")
     print("pip, setuptools, and wheel upgraded successfully.")
 
 def list_installed_packages(env_path):
-    result = subprocess.run([os.path.join(env_path, "bin", "pip"), "list"], capture_output=True, check=True, text=True)
+    # Read the distribution metadata directly instead of starting pip
+    from rich.table import Table
+    record = venv_index.scan_env(env_path)
 
-    console = Console()
     table = Table(show_header=True, header_style="bold magenta")
     table.add_column("Package")
     table.add_column("Version")
 
-    lines = result.stdout.split("\n")[2:-1]  # Remove header lines and trailing newline
-    for line in lines:
-        package, version = line.split()
+    for package, version in sorted(record["packages"].values(), key=lambda item: item[0].lower()):
         table.add_row(package, version)
 
     console.print("\nInstalled packages in the selected environment:")
     console.print(table)
 
-def create_requirements_file(env_path):
-    subprocess.run([os.path.join(env_path, "bin", "pip"), "freeze", "--local", ">", "requirements.txt"], shell=True, check=True)
+def find_environments(folder_path, requirement):
+    """Show the environments in folder_path with a package matching requirement, e.g. 'requests<2.31'."""
+    from rich.table import Table
+    index = venv_index.build_index(folder_path)
+    matches = venv_index.find_envs(index, requirement)
+
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Environment")
+    table.add_column("Version")
+    for env_path, version in matches:
+        table.add_row(os.path.basename(env_path), version)
+
+    console.print(f"\n{len(matches)} of {len(index)} environments match '{requirement}':")
+    console.print(table)
+    return matches
+
+def freeze_requirements(env_path):
+    """Write requirements.txt inside the environment."""
+    create_requirements_file(env_path, os.path.join(env_path, "requirements.txt"))
+
+BATCH_OPERATIONS = {
+    "update": (update_package, ["package"]),
+    "downgrade": (downgrade_package, ["package", "version"]),
+    "uninstall": (uninstall_package, ["package"]),
+    "freeze": (freeze_requirements, []),
+    "sync": (sync_environment, ["lock file"]),
+    "upgrade-tools": (upgrade_packages, []),
+}
+
+BATCH_LOG_DIR = os.path.expanduser("~/.cache/archscripts/batch-logs")
+
+def select_environments(folder_path, selector):
+    """Return the environment paths in folder_path matching selector.
+
+    selector is "all", a glob such as "web-*", a comma separated list of
+    names, or "has:<requirement>" such as "has:requests<2.31".
+    """
+    if selector.startswith("has:"):
+        index = venv_index.build_index(folder_path)
+        return [env_path for env_path, _ in venv_index.find_envs(index, selector[len("has:"):])]
+
+    names = search_existing_envs(folder_path)
+    if selector == "all":
+        selected = names
+    elif "," in selector:
+        wanted = {name.strip() for name in selector.split(",")}
+        selected = [name for name in names if name in wanted]
+    else:
+        selected = fnmatch.filter(names, selector)
+    return [os.path.join(folder_path, name) for name in selected]
+
+def _run_batch_operation(env_path, operation, args):
+    # Runs in a worker process; pip output goes to a per-environment log file
+    func = BATCH_OPERATIONS[operation][0]
+    os.makedirs(BATCH_LOG_DIR, exist_ok=True)
+    log_path = os.path.join(BATCH_LOG_DIR, f"{os.path.basename(env_path)}.log")
+    saved_fds = os.dup(1), os.dup(2)
+    start = time.monotonic()
+    with open(log_path, "w") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            func(env_path, *args)
+            ok, message = True, ""
+        except subprocess.CalledProcessError as e:
+            ok, message = False, f"exit status {e.returncode}, see {log_path}"
+        except Exception as e:
+            ok, message = False, f"{e}, see {log_path}"
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            os.close(saved_fds[0])
+            os.close(saved_fds[1])
+    return env_path, ok, time.monotonic() - start, message
+
+def _init_batch_worker():
+    # Spawned workers start without the parent's logging, so each gets a listener of its own
+    telemetry.setup("init_penv", console_level=logging.WARNING, report=False)
+
+def run_batch(folder_path, selector, operation, args=(), workers=4):
+    """Run operation on every environment matching selector with bounded concurrency."""
+    from rich.progress import Progress
+    from rich.table import Table
+    env_paths = select_environments(folder_path, selector)
+    if not env_paths:
+        console.print(f"No environments match '{selector}'.")
+        return []
+
+    results = []
+    with Progress(console=_console()) as progress:
+        task = progress.add_task(f"{operation} on {len(env_paths)} environments", total=len(env_paths))
+        # Spawn, not fork: a forked worker would inherit the telemetry listener's queue and locks mid-use
+        with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_batch_worker) as executor:
+            futures = [executor.submit(_run_batch_operation, env_path, operation, tuple(args)) for env_path in env_paths]
+            for future in as_completed(futures):
+                env_path, ok, elapsed, message = future.result()
+                results.append((env_path, ok, elapsed, message))
+                logging.info(f"{operation} on {env_path}: {'ok' if ok else 'failed'} ({elapsed:.1f}s) {message}")
+                progress.advance(task)
+
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Environment")
+    table.add_column("Result")
+    table.add_column("Time", justify="right")
+    table.add_column("Details")
+    for env_path, ok, elapsed, message in sorted(results):
+        table.add_row(os.path.basename(env_path), "[green]ok[/green]" if ok else "[red]failed[/red]", f"{elapsed:.1f}s", message)
+    console.print(table)
+    failed = sum(1 for _, ok, _, _ in results if not ok)
+    console.print(f"{len(results) - failed} succeeded, {failed} failed.")
+    return results
+
+def prompt_batch_operation(folder_path):
+    selector = prompt_user("Select environments (all, a glob, a comma separated list or has:<requirement>)", "all")
+    operation = prompt_user(f"Operation ({'/'.join(BATCH_OPERATIONS)})", "update")
+    if operation not in BATCH_OPERATIONS:
+        print("Invalid operation.")
+        return
+    args = [input(f"Enter the {name}: ").strip() for name in BATCH_OPERATIONS[operation][1]]
+    workers = int(prompt_user("Number of parallel workers", str(os.cpu_count() or 4)))
+    run_batch(folder_path, selector, operation, args, workers)
 
 def prompt_user(message, default_value):
     user_input = input(f"{message} (default: {default_value}): ").strip()
@@ -116,7 +274,7 @@ def yes_no_prompt(message):
     return user_input == 'y'
 
 
-def main():
+def check_executables():
     if not is_executable_installed("python3"):
         print("Python 3 is not installed. Please install Python 3 and try again.")
         sys.exit(1)
@@ -125,13 +283,24 @@ def main():
         print("pip is not installed. Please install pip and try again.")
         sys.exit(1)
 
-    default_folder_path = os.path.join(os.path.expanduser("~"), "python_envs")
-    folder_path = prompt_user("Enter the folder path for the virtual environments", default_folder_path)
+
+def choose_environment(folder_path=None, env_name=None, upgrade=True):
+    """Return the environment to work on, creating it if needed; missing choices are asked for."""
+    if folder_path is None:
+        default_folder_path = os.path.join(os.path.expanduser("~"), "python_envs")
+        folder_path = prompt_user("Enter the folder path for the virtual environments", default_folder_path)
 
     os.makedirs(folder_path, exist_ok=True)
 
     existing_envs = search_existing_envs(folder_path)
-    if existing_envs:
+    if env_name is not None:
+        env_path = os.path.join(folder_path, env_name)
+        if env_name in existing_envs:
+            print(f"Using existing virtual environment: {env_name}")
+        else:
+            print(f"Creating virtual environment at {env_path}...")
+            create_virtual_environment(env_path)
+    elif existing_envs:
         print(f"\nFound existing virtual environments in {folder_path}:")
         for i, env in enumerate(existing_envs, start=1):
             print(f"{i}. {env}")
@@ -161,33 +330,86 @@ def main():
 
     print(f"\nTo activate the virtual environment, run: {activate_script}")
 
-    print("\nUpgrading pip, setuptools, and wheel...")
-    upgrade_packages(env_path)
+    if upgrade:
+        print("\nUpgrading pip, setuptools, and wheel...")
+        upgrade_packages(env_path)
     print("\nDone! You can now install packages using pip inside your virtual environment.")
 
     return env_path
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create and manage Python virtual environments",
+                                     epilog="Without an action, an interactive menu is shown.")
+    parser.add_argument("--folder", help="Folder holding the environments (asked for when omitted)")
+    parser.add_argument("--env", help="Environment name; created if it does not exist (asked for when omitted)")
+    parser.add_argument("--no-upgrade", action="store_true", help="Do not upgrade pip, setuptools and wheel")
+    actions = parser.add_mutually_exclusive_group()
+    actions.add_argument("--list", action="store_true", help="List the installed packages")
+    actions.add_argument("--freeze", action="store_true", help="Write requirements.txt inside the environment")
+    actions.add_argument("--sync", metavar="LOCK", help="Make the environment match a lock file")
+    actions.add_argument("--install", nargs="+", metavar="PACKAGE", help="Install packages")
+    actions.add_argument("--find", metavar="REQUIREMENT", help="Find environments with a package matching a requirement")
+    actions.add_argument("--batch", choices=BATCH_OPERATIONS, help="Run an operation across several environments")
+    parser.add_argument("--select", default="all", help="Environments for --batch: all, a glob, names or has:<requirement>")
+    parser.add_argument("--arg", action="append", default=[], help="Argument for the --batch operation (repeatable)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Parallel workers for --batch")
+    args = parser.parse_args(argv)
+
+    check_executables()
+
+    # These work on the folder, so no environment has to be chosen
+    if args.batch or args.find:
+        folder_path = args.folder or prompt_user("Enter the folder path for the virtual environments",
+                                                 os.path.join(os.path.expanduser("~"), "python_envs"))
+        if args.find:
+            find_environments(folder_path, args.find)
+            return 0
+        results = run_batch(folder_path, args.select, args.batch, args.arg, args.workers)
+        return 0 if all(ok for _, ok, _, _ in results) else 1
+
+    env_path = choose_environment(args.folder, args.env, upgrade=not args.no_upgrade)
+    if args.list:
+        list_installed_packages(env_path)
+    elif args.freeze:
+        freeze_requirements(env_path)
+    elif args.sync:
+        sync_environment(env_path, args.sync)
+    elif args.install:
+        wheel_store.install(env_path, args.install)
+    else:
+        main_loop(env_path)
+    return 0
+
+
 def search_and_install_packages(env_path):
     try:
-        subprocess.run([os.path.join(env_path, "bin", "pip"), "install", "pip_search"], check=True)
-    except subprocess.CalledProcessError:
-        print("Failed to install pip_search. Skipping package search and installation.")
-        return
+        pypi_index.ensure_fresh()
+    except OSError as e:
+        # A stale index still answers searches while offline
+        logging.warning(f"Could not refresh the package index: {e}")
 
     while True:
         search_term = input("Enter the package name to search or 'q' to quit: ").strip()
         if search_term.lower() == 'q':
             break
 
-        search_command = f"{os.path.join(env_path, 'bin', 'python')} -m pip_search {search_term}"
-        result = subprocess.run(search_command, capture_output=True, check=True, text=True, shell=True)
-        print(f"\nSearch results for '{search_term}':\n{result.stdout}")
+        from rich.table import Table
+        results = pypi_index.search(search_term)
+        if not results:
+            console.print(f"No packages match '{search_term}'.")
+            continue
+        table = Table(show_header=True, header_style="bold magenta")
+        table.add_column("Package")
+        for name in results:
+            table.add_row(name)
+        console.print(f"\nSearch results for '{search_term}':")
+        console.print(table)
 
         package_to_install = input("Enter the package name to install or 'q' to quit: ").strip()
         if package_to_install.lower() == 'q':
             break
-        subprocess.run([os.path.join(env_path, "bin", "pip"), "install", package_to_install], check=True)
+        wheel_store.install(env_path, [package_to_install])
         print(f"\n{package_to_install} installed successfully.")
 
 
@@ -200,7 +422,6 @@ def main_loop(env_path):
             list_installed_packages(env_path)
         elif action == '2':
             create_requirements_file(env_path)
-            print("requirements.txt file created successfully.")
         elif action == '3':
             search_and_install_packages(env_path)
         elif action == '4':
@@ -221,6 +442,14 @@ def main_loop(env_path):
             uninstall_package(env_path, package_name)
         elif action == '9':
             activate_virtual_environment(env_path)
+        elif action == '10':
+            requirement = input("Enter a requirement to look for (e.g. requests<2.31): ").strip()
+            find_environments(os.path.dirname(env_path), requirement)
+        elif action == '11':
+            prompt_batch_operation(os.path.dirname(env_path))
+        elif action == '12':
+            lock_path = prompt_user("Enter the lock file to sync with", "requirements.txt")
+            sync_environment(env_path, lock_path)
         elif action.lower() == 'q':
             break
         else:
@@ -237,7 +466,6 @@ def activate_virtual_environment(env_path):
 
 # Modify prompt_for_action function
 def prompt_for_action():
-    console = Console()
     console.print("\nChoose an action:", style="bold")
     console.print("1. List installed packages")
     console.print("2. Create requirements.txt file")
@@ -248,11 +476,14 @@ def prompt_for_action():
     console.print("7. Downgrade a package")
     console.print("8. Uninstall a package")
     console.print("9. Activate virtual environment")
+    console.print("10. Find environments by requirement")
+    console.print("11. Run an operation across several environments")
+    console.print("12. Sync with a lock file")
     console.print("q. Quit")
 
     user_input = input("Enter the number of the action or 'q' to quit: ").strip()
     return user_input
 
 if __name__ == "__main__":
-    env_path = main()
-    main_loop(env_path)
+    setup_logging()
+    sys.exit(main())
@@ -1,17 +1,29 @@
 #!/usr/bin/env python3
 
-import subprocess
 import os
+import sys
+import logging
+import argparse
 
-def run(command):
-    subprocess.call(command, shell=True)
+import config_edit
+import mirror_rank
+import privileged_executor
+import telemetry
+
+def run_privileged(argv):
+    # Reuses one elevated helper instead of a new shell and sudo per command
+    try:
+        privileged_executor.get_executor().run(argv)
+    except privileged_executor.CommandError as e:
+        print(f"Error executing {' '.join(argv)}: {e.stderr.strip()}")
 
 def install_python():
-    # Update the package lists for upgrades and new package installations
-    run("sudo pacman -Sy")
+    # Update the package lists for upgrades and new package installations, from the fastest mirrors
+    mirror_rank.ensure_ranked()
+    run_privileged(["pacman", "-Sy"])
 
     # Install Python and pip
-    run("sudo pacman -S python python-pip")
+    run_privileged(["pacman", "-S", "--needed", "--noconfirm", "python", "python-pip"])
 
 def setup_python():
     # Create a .pythonrc file in the user's home directory
@@ -37,17 +49,27 @@ except:
 """
 
     # Write the content to .pythonrc
-    with open(pythonrc_path, "w") as f:
-        f.write(pythonrc_content)
+    config_edit.apply_edits(pythonrc_path, [config_edit.replace_content(pythonrc_content)])
 
-    # Add the .pythonrc file to the zshrc to run when a new shell opens
+    # Add the .pythonrc file to the zshrc to run when a new shell opens.
+    # Older versions appended these lines on every run, so drop those copies first.
     zshrc_path = os.path.expanduser("~/.zshrc")
+    config_edit.apply_edits(zshrc_path, [
+        config_edit.remove_lines(["# Python personal configurations", f"export PYTHONSTARTUP={pythonrc_path}"]),
+        config_edit.shell_block("python", f"export PYTHONSTARTUP={pythonrc_path}"),
+    ])
 
-    with open(zshrc_path, "a") as f:
-        f.write("\n# Python personal configurations\n")
-        f.write(f"export PYTHONSTARTUP={pythonrc_path}\n")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Install Python and pip and set up ~/.pythonrc")
+    parser.add_argument("--config-only", action="store_true", help="Only write ~/.pythonrc and the zshrc block")
+    args = parser.parse_args(argv)
 
-if __name__ == "__main__":
-    install_python()
+    if not args.config_only:
+        install_python()
     setup_python()
     print("Python installation and configuration completed.")
+    return 0
+
+if __name__ == "__main__":
+    telemetry.setup("install_python", console_level=logging.WARNING)
+    sys.exit(main())
@@ -1,32 +1,207 @@
+import os
 import subprocess
+import sys
+import glob
 import logging
 import json
 import argparse
-
-logging.basicConfig(filename='installation.log', level=logging.INFO)
-
-
-def run_command(command, dry_run=False):
+import tempfile
+import time
+from functools import partial
+
+import config_edit
+import mirror_rank
+import pacman_db
+import pacman_fetch
+import privileged_executor
+import step_journal
+import taskgraph
+import telemetry
+
+DESKTOP_MANAGERS = ["xfce", "gnome", "kde", "mate", "lxde"]
+WINDOW_MANAGERS = ["lightdm", "bspwm", "i3wm", "dwm", "awesome", "xmonad"]
+
+
+def run_command(command, dry_run=False, privileged=False):
+    # Strings run through the shell; argument lists run directly, and
+    # privileged ones go through the long-lived elevated helper
+    display = command if isinstance(command, str) else " ".join(command)
     if dry_run:
-        logging.info(f"[Dry Run] Skipping command execution: {command}")
+        logging.info(f"[Dry Run] Skipping command execution: {display}")
     else:
         try:
-            subprocess.run(command, shell=True, check=True)
+            if privileged:
+                result = privileged_executor.get_executor().run(command)
+                logging.info(f"Executed {display} in {result['elapsed']:.2f}s")
+                logging.debug(result["stdout"])
+            else:
+                telemetry.run(command, shell=isinstance(command, str), check=True)
         except subprocess.CalledProcessError as e:
-            error_msg = f"Error executing command: {command}"
-            if e.output is not None and isinstance(e.output, bytes):
-                error_msg += f"\n{e.output.decode()}"
+            error_msg = f"Error executing command: {display}"
+            if e.stderr:
+                error_msg += f"\n{e.stderr.strip()}"
             logging.error(error_msg)
             print(error_msg)
             raise
 
 
-def install_package(package_name, dry_run=False):
+class PackagePlan:
+    """Deduplicated set of packages to install in one pacman transaction."""
+
+    def __init__(self):
+        self.packages = []
+        self.post_install = []
+
+    def add(self, package_name):
+        if package_name not in self.packages:
+            self.packages.append(package_name)
+
+    def after(self, package_name, func, *args, resources=()):
+        # Run func(*args) once package_name has been installed successfully;
+        # resources are the config paths or locks the function needs for itself
+        self.post_install.append((package_name, func, args, tuple(resources)))
+
+
+def target_path(root, path):
+    # A path inside a target root; no root means the running system
+    return os.path.join(root, path.lstrip("/")) if root else path
+
+
+def installed_packages(db_path=pacman_db.LOCAL_DB):
+    """Return the names of installed packages, and everything they provide, from the local pacman database."""
+    return set(pacman_db.provider_index(pacman_db.load_local(db_path)))
+
+
+def install_package(package_name, dry_run=False, plan=None):
+    if plan is not None:
+        plan.add(package_name)
+        return
+
     logging.info(f"Installing {package_name}...")
-    run_command(f"sudo pacman -S --needed {package_name}", dry_run)
+    run_command(["pacman", "-S", "--needed", "--noconfirm", package_name], dry_run, privileged=True)
     logging.info(f"{package_name} installation completed.")
 
 
+def resolve_for_empty_root(packages):
+    """Return the URLs of packages and all their dependencies, whatever the host has installed."""
+    with tempfile.TemporaryDirectory() as db_path:
+        # An empty local database next to the host's sync databases
+        os.mkdir(os.path.join(db_path, "local"))
+        os.symlink(pacman_db.SYNC_DIR, os.path.join(db_path, "sync"))
+        return pacman_fetch.resolve_package_urls(packages, ["--dbpath", db_path])
+
+
+def prefetch_planned_packages(plan, cache_dir, shared_cache=None, workers=4, dry_run=False, roots=()):
+    """Download every planned package into cache_dir before anything is installed.
+
+    With target roots the downloads are resolved once for all of them, so
+    every target installs from the same cache.
+    """
+    if roots:
+        missing = [installed_packages(target_path(root, pacman_db.LOCAL_DB)) for root in roots]
+        pending = [name for name in plan.packages if any(name not in installed for installed in missing)]
+    else:
+        installed = installed_packages()
+        pending = [name for name in plan.packages if name not in installed]
+    logging.info(f"Resolving downloads for {len(pending)} packages...")
+    try:
+        urls = resolve_for_empty_root(pending) if roots else pacman_fetch.resolve_package_urls(pending)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.warning(f"Could not resolve package downloads, skipping prefetch: {e}")
+        return {}
+
+    if dry_run:
+        for url in urls:
+            logging.info(f"[Dry Run] Skipping download: {url}")
+        return {}
+
+    logging.info(f"Prefetching {len(urls)} packages into {cache_dir} with {workers} workers...")
+    results = pacman_fetch.prefetch_packages(urls, cache_dir, shared_cache, workers)
+    failed = [name for name, (source, _) in results.items() if source == "failed"]
+    if failed:
+        print(f"{len(failed)} package(s) could not be prefetched and will be downloaded by pacman.")
+    return results
+
+
+def pacman_install_command(cache_dir=None, root=None):
+    pacman = ["pacman", "-S", "--needed", "--noconfirm"]
+    if root:
+        pacman += ["--root", root, "--dbpath", target_path(root, "/var/lib/pacman")]
+        # Whatever still has to be downloaded lands in the target's own cache, so
+        # concurrent targets never write the same file; prefetched packages are read from cache_dir
+        pacman += ["--cachedir", target_path(root, pacman_fetch.PACMAN_CACHE_DIR)]
+        if cache_dir:
+            pacman += ["--cachedir", cache_dir]
+    elif cache_dir and cache_dir != pacman_fetch.PACMAN_CACHE_DIR:
+        # Read the prefetched packages, still falling back to the system cache
+        pacman += ["--cachedir", cache_dir, "--cachedir", pacman_fetch.PACMAN_CACHE_DIR]
+    return pacman
+
+
+def install_planned_packages(plan, dry_run=False, chunk_size=0, cache_dir=None, root=None):
+    """Install every planned package in as few pacman transactions as possible.
+
+    Packages already present in the local database are dropped up front. A
+    chunk that fails is retried package by package so that a single bad name
+    only fails itself. Returns a {package: (status, seconds)} report.
+    """
+    installed = installed_packages(target_path(root, pacman_db.LOCAL_DB))
+    pending = [name for name in plan.packages if name not in installed]
+    results = {name: ("present", 0.0) for name in plan.packages if name in installed}
+    pacman = pacman_install_command(cache_dir, root)
+
+    if chunk_size <= 0:
+        chunk_size = len(pending) or 1
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+
+    for chunk in chunks:
+        logging.info(f"Installing {len(chunk)} packages in one transaction: {' '.join(chunk)}")
+        start = time.monotonic()
+        try:
+            run_command(pacman + chunk, dry_run, privileged=True)
+        except subprocess.CalledProcessError:
+            logging.warning("Transaction failed, retrying packages one at a time...")
+            for name in chunk:
+                start = time.monotonic()
+                try:
+                    run_command(pacman + [name], dry_run, privileged=True)
+                    results[name] = ("installed", time.monotonic() - start)
+                except subprocess.CalledProcessError:
+                    results[name] = ("failed", time.monotonic() - start)
+        else:
+            elapsed = time.monotonic() - start
+            for name in chunk:
+                results[name] = ("installed", elapsed)
+
+    report_package_results(results, root)
+    return results
+
+
+def run_post_install(package_name, func, args, results, **kwargs):
+    """Run configuration deferred by the plan if its package was installed."""
+    if results.get(package_name, ("failed",))[0] != "failed":
+        return func(*args, **kwargs)
+    logging.warning(f"Skipping {func.__name__} because {package_name} failed to install.")
+
+
+def report_package_results(results, root=None):
+    # Built as one block so reports of concurrent targets do not interleave
+    lines = [f"Packages in {root}:"] if root else []
+    lines.append(f"{'Package':<32} {'Status':<10} {'Time':>8}")
+    for name, (status, elapsed) in results.items():
+        lines.append(f"{name:<32} {status:<10} {elapsed:>7.2f}s")
+        where = f" in {root}" if root else ""
+        if status == "failed":
+            logging.error(f"Failed to install {name}{where} ({elapsed:.2f}s)")
+        else:
+            logging.info(f"{name}{where}: {status} ({elapsed:.2f}s)")
+    print("\n".join(lines))
+
+    failed = [name for name, (status, _) in results.items() if status == "failed"]
+    if failed:
+        print(f"{len(failed)} package(s) failed to install: {' '.join(failed)}")
+
+
 def prompt_user(message, options):
     user_input = ""
     while user_input not in options:
@@ -34,29 +209,38 @@ def prompt_user(message, options):
     return user_input
 
 
-def enable_service(service_name):
-    run_command(f"sudo systemctl enable {service_name}")
+def enable_service(service_name, dry_run=False, root=None):
+    root_option = [f"--root={root}"] if root else []
+    run_command(["systemctl", *root_option, "enable", service_name], dry_run, privileged=True)
 
 
-def configure_lightdm():
+def configure_lightdm(dry_run=False, root=None):
     logging.info("Configuring LightDM...")
-    run_command("sudo sed -i 's/^#greeter-session=.*/greeter-session=lightdm-gtk-greeter/' /etc/lightdm/lightdm.conf")
-    run_command("echo '[Seat:*]\nsession-wrapper=/etc/lightdm/Xsession' | sudo tee -a /etc/lightdm/lightdm.conf")
-    run_command("sudo bash -c 'echo -e \"#!/bin/bash\\nexec bspwm\" > /etc/lightdm/Xsession'")
-    run_command("sudo chmod +x /etc/lightdm/Xsession")
+    lightdm_conf = target_path(root, "/etc/lightdm/lightdm.conf")
+    xsession = target_path(root, "/etc/lightdm/Xsession")
+    if dry_run:
+        logging.info(f"[Dry Run] Skipping edits of {lightdm_conf} and {xsession}")
+    else:
+        executor = privileged_executor.get_executor()
+        executor.edit_config(lightdm_conf, [
+            config_edit.ini_set("Seat:*", "greeter-session", "lightdm-gtk-greeter"),
+            # The path LightDM runs on the provisioned system, not where it was written from
+            config_edit.ini_set("Seat:*", "session-wrapper", "/etc/lightdm/Xsession"),
+        ])
+        executor.edit_config(xsession, [config_edit.replace_content("#!/bin/bash\nexec bspwm\n")], mode=0o755)
     logging.info("LightDM configuration completed.")
 
 
-def configure_i3wm():
+def configure_i3wm(root=None):
     logging.info("Configuring i3wm...")
     # Add configuration steps for i3wm here
     logging.info("i3wm configuration completed.")
 
 
-def install_desktop_manager(dry_run=False):
-    options = ["xfce", "gnome", "kde", "mate", "lxde"]
-    desktop_manager = prompt_user(f"Select the desktop manager to install ({'/'.join(options)}): ", options)
-    install_package(desktop_manager, dry_run)
+def install_desktop_manager(dry_run=False, plan=None, desktop_manager=None):
+    if desktop_manager not in DESKTOP_MANAGERS:
+        desktop_manager = prompt_user(f"Select the desktop manager to install ({'/'.join(DESKTOP_MANAGERS)}): ", DESKTOP_MANAGERS)
+    install_package(desktop_manager, dry_run, plan)
     
     if desktop_manager == "gnome":
         logging.info("Configuring GNOME...")
@@ -76,30 +260,37 @@ def install_desktop_manager(dry_run=False):
         logging.info("MATE configuration completed.")
     elif desktop_manager == "lxde":
         logging.info("Configuring LXDE...")
-        install_package("lxde", dry_run)
+        install_package("lxde", dry_run, plan)
         # Additional configuration steps for LXDE
         logging.info("LXDE configuration completed.")
 
 
-def install_window_manager(dry_run=False):
-    options = ["lightdm", "bspwm", "i3wm", "dwm", "awesome", "xmonad"]
-    window_manager = prompt_user(f"Select the window manager to install ({'/'.join(options)}): ", options)
+def install_window_manager(dry_run=False, plan=None, window_manager=None):
+    if window_manager not in WINDOW_MANAGERS:
+        window_manager = prompt_user(f"Select the window manager to install ({'/'.join(WINDOW_MANAGERS)}): ", WINDOW_MANAGERS)
     
     if window_manager == "lightdm":
-        install_package("lightdm", dry_run)
-        install_package("lightdm-gtk-greeter", dry_run)
-        configure_lightdm()
-        enable_service("lightdm")
+        install_package("lightdm", dry_run, plan)
+        install_package("lightdm-gtk-greeter", dry_run, plan)
+        if plan is not None:
+            plan.after("lightdm", configure_lightdm, dry_run, resources=["/etc/lightdm"])
+            plan.after("lightdm", enable_service, "lightdm", dry_run, resources=["systemd-units"])
+        else:
+            configure_lightdm(dry_run)
+            enable_service("lightdm", dry_run)
     elif window_manager == "bspwm":
-        install_package("bspwm", dry_run)
-        install_package("sxhkd", dry_run)
+        install_package("bspwm", dry_run, plan)
+        install_package("sxhkd", dry_run, plan)
         # Additional configuration steps for BSPWM
     elif window_manager == "i3wm":
-        install_package("i3-gaps", dry_run)
-        install_package("i3status", dry_run)
-        configure_i3wm()
+        install_package("i3-gaps", dry_run, plan)
+        install_package("i3status", dry_run, plan)
+        if plan is not None:
+            plan.after("i3-gaps", configure_i3wm, resources=["i3-config"])
+        else:
+            configure_i3wm()
     elif window_manager in ["dwm", "awesome", "xmonad"]:
-        install_package(window_manager, dry_run)
+        install_package(window_manager, dry_run, plan)
         # Additional configuration steps for the other window managers
 
 
@@ -121,7 +312,7 @@ def install_dynamic_window_manager(dry_run=False):
     logging.info("Dynamic window manager installation completed.")
 
 
-def install_additional_programs(config_file, dry_run=False):
+def install_additional_programs(config_file, dry_run=False, plan=None):
     logging.info("Installing additional programs...")
     
     try:
@@ -132,7 +323,7 @@ def install_additional_programs(config_file, dry_run=False):
         programs = []
 
     for program in programs:
-        install_package(program, dry_run)
+        install_package(program, dry_run, plan)
 
     logging.info("Additional programs installation completed.")
 
@@ -149,15 +340,16 @@ def perform_post_installation_steps(dry_run=False):
     logging.info("Post-installation steps completed.")
 
 
-def update_system():
+def update_system(dry_run=False):
     logging.info("Updating the system...")
-    run_command("sudo pacman -Syu", dry_run=False)
+    mirror_rank.ensure_ranked(dry_run=dry_run)
+    run_command(["pacman", "-Syu", "--noconfirm"], dry_run, privileged=True)
     logging.info("System update completed.")
 
 
-def reboot_system():
+def reboot_system(dry_run=False):
     logging.info("Rebooting the system...")
-    run_command("sudo reboot")
+    run_command(["reboot"], dry_run, privileged=True)
 
 
 def rollback():
@@ -190,7 +382,149 @@ def rollback():
 
 
 def setup_logging():
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    # One call configures the console, installation.log and the telemetry event log
+    telemetry.setup("install_wm", log_file="installation.log")
+
+
+def prepare_root(root, dry_run=False):
+    """Create pacman's directories in a target root and copy in the host's sync databases.
+
+    Every target then resolves against the same database snapshot as the
+    shared prefetch, and so installs the package versions it downloaded.
+    """
+    db_path = target_path(root, "/var/lib/pacman")
+    run_command(["mkdir", "-p", os.path.join(db_path, "local"), os.path.join(db_path, "sync"),
+                 target_path(root, pacman_fetch.PACMAN_CACHE_DIR)], dry_run, privileged=True)
+    databases = sorted(glob.glob(os.path.join(pacman_db.SYNC_DIR, "*.db")))
+    if databases:
+        run_command(["cp", "-p", "--", *databases, os.path.join(db_path, "sync")], dry_run, privileged=True)
+    else:
+        logging.warning(f"No sync databases in {pacman_db.SYNC_DIR}; pacman will have none in {root} either.")
+
+
+def install_packages_step(plan, dry_run=False, chunk_size=0, cache_dir=None, root=None):
+    results = install_planned_packages(plan, dry_run, chunk_size, cache_dir, root)
+    failed = [name for name, (status, _) in results.items() if status == "failed"]
+    if failed:
+        # Fail the step so the next run retries it; installed packages are skipped then
+        where = f" in {root}" if root else ""
+        raise RuntimeError(f"{len(failed)} package(s) failed to install{where}: {' '.join(failed)}")
+    return results
+
+
+def build_tasks(plan, args, journal):
+    """Return the installation steps as a dependency graph of tasks."""
+    dry_run = args.dry_run
+    tasks = [
+        taskgraph.Task("prefetch-packages",
+                       partial(prefetch_planned_packages, plan, args.cache_dir, args.shared_cache, args.download_workers, dry_run),
+                       resources=["pacman-cache"],
+                       inputs={"packages": plan.packages},
+                       estimate=0.5 * len(plan.packages)),
+        taskgraph.Task("install-packages",
+                       partial(install_packages_step, plan, dry_run, args.chunk_size, args.cache_dir),
+                       deps=["prefetch-packages"],
+                       resources=["pacman-db", "pacman-cache"],
+                       inputs={"packages": plan.packages},
+                       estimate=2.0 * len(plan.packages)),
+        taskgraph.Task("install-stacking-window-manager", partial(install_stacking_window_manager, dry_run=dry_run)),
+        taskgraph.Task("install-tiling-window-manager", partial(install_tiling_window_manager, dry_run=dry_run)),
+        taskgraph.Task("install-dynamic-window-manager", partial(install_dynamic_window_manager, dry_run=dry_run)),
+        taskgraph.Task("configure-additional-programs", partial(configure_additional_programs, dry_run=dry_run),
+                       deps=["install-packages"]),
+    ]
+
+    def post_install(package_name, func, func_args):
+        return run_post_install(package_name, func, func_args, journal.last_result("install-packages") or {})
+
+    for package_name, func, func_args, resources in plan.post_install:
+        name = "-".join([func.__name__.replace("_", "-"), *(arg for arg in func_args if isinstance(arg, str))])
+        tasks.append(taskgraph.Task(
+            name,
+            partial(post_install, package_name, func, func_args),
+            deps=["install-packages"],
+            resources=resources,
+            inputs={"package": package_name, "args": list(func_args)},
+            estimate=0.5))
+
+    configuration = [task.name for task in tasks]
+    tasks += [
+        taskgraph.Task("post-installation-steps", partial(perform_post_installation_steps, dry_run=dry_run),
+                       deps=configuration),
+        taskgraph.Task("update-system", partial(update_system, dry_run),
+                       deps=["post-installation-steps"], resources=["pacman-db"], estimate=30.0),
+        taskgraph.Task("reboot-system", partial(reboot_system, dry_run), deps=["update-system"]),
+    ]
+    return tasks
+
+
+def build_target_tasks(plan, args, journal):
+    """Return the steps provisioning every target root from one plan and one download cache.
+
+    Packages are prefetched once for all targets. Each target then gets its
+    own chain of steps, suffixed with "@<root>", whose resources are
+    separate from every other target's, so the targets proceed in parallel.
+    """
+    dry_run = args.dry_run
+    roots = args.target_root
+    tasks = [
+        taskgraph.Task("prefetch-packages",
+                       partial(prefetch_planned_packages, plan, args.cache_dir, args.shared_cache, args.download_workers,
+                               dry_run, roots),
+                       resources=["pacman-cache"],
+                       inputs={"packages": plan.packages, "roots": roots},
+                       estimate=0.5 * len(plan.packages)),
+    ]
+
+    def post_install(root, package_name, func, func_args):
+        results = journal.last_result(f"install-packages@{root}") or {}
+        return run_post_install(package_name, func, func_args, results, root=root)
+
+    for root in roots:
+        tasks += [
+            taskgraph.Task(f"prepare-root@{root}", partial(prepare_root, root, dry_run),
+                           resources=[f"{root}:pacman-db"], inputs={"root": root}),
+            taskgraph.Task(f"install-packages@{root}",
+                           partial(install_packages_step, plan, dry_run, args.chunk_size, args.cache_dir, root),
+                           deps=["prefetch-packages", f"prepare-root@{root}"],
+                           resources=[f"{root}:pacman-db"],
+                           inputs={"packages": plan.packages, "root": root},
+                           estimate=2.0 * len(plan.packages)),
+        ]
+        configuration = []
+        for package_name, func, func_args, resources in plan.post_install:
+            name = "-".join([func.__name__.replace("_", "-"), *(arg for arg in func_args if isinstance(arg, str))])
+            configuration.append(f"{name}@{root}")
+            tasks.append(taskgraph.Task(
+                f"{name}@{root}",
+                partial(post_install, root, package_name, func, func_args),
+                deps=[f"install-packages@{root}"],
+                resources=[f"{root}:{resource}" for resource in resources],
+                inputs={"package": package_name, "args": list(func_args), "root": root},
+                estimate=0.5))
+        tasks += [
+            taskgraph.Task(f"configure-additional-programs@{root}", partial(configure_additional_programs, dry_run=dry_run),
+                           deps=[f"install-packages@{root}"]),
+            taskgraph.Task(f"post-installation-steps@{root}", partial(perform_post_installation_steps, dry_run=dry_run),
+                           deps=[*configuration, f"configure-additional-programs@{root}"]),
+        ]
+    return tasks
+
+
+def report_target_timings(roots, journal, started):
+    """Print how long each target's steps of this run took and when the target was done."""
+    width = max(len("Target"), *(len(root) for root in roots))
+    print(f"{'Target':<{width}} {'Steps':>5} {'Busy':>9} {'Ready at':>9}  Status")
+    for root in roots:
+        entries = [entry for step, entry in journal.entries.items()
+                   if step.endswith(f"@{root}") and entry["finished"] >= started]
+        if not entries:
+            print(f"{root:<{width}} {0:>5} {'-':>9} {'-':>9}  unchanged")
+            continue
+        busy = sum(entry["elapsed"] for entry in entries)
+        ready = max(entry["finished"] for entry in entries) - started
+        status = "failed" if any(entry["status"] == "failed" for entry in entries) else "ok"
+        print(f"{root:<{width}} {len(entries):>5} {busy:>8.2f}s {ready:>8.2f}s  {status}")
 
 
 def cleanup():
@@ -199,26 +533,46 @@ def cleanup():
     logging.info("Cleanup completed.")
 
 
-if __name__ == "__main__":
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Installation script")
     parser.add_argument("--dry-run", action="store_true", help="Perform a dry run without executing commands")
-    args = parser.parse_args()
+    parser.add_argument("--desktop-manager", choices=DESKTOP_MANAGERS, help="Desktop manager to install (asked for when omitted)")
+    parser.add_argument("--window-manager", choices=WINDOW_MANAGERS, help="Window manager to install (asked for when omitted)")
+    parser.add_argument("--programs", default="additional_programs.json", help="JSON list of additional programs to install")
+    parser.add_argument("--chunk-size", type=int, default=0, help="Maximum packages per pacman transaction (0 = single transaction)")
+    parser.add_argument("--download-workers", type=int, default=4, help="Number of parallel package downloads")
+    parser.add_argument("--cache-dir", default=pacman_fetch.default_cache_dir(), help="Directory to prefetch packages into")
+    parser.add_argument("--shared-cache", help="Shared package cache to check first (path or file:// URL)")
+    parser.add_argument("--journal", default="install_journal.jsonl", help="Step journal used to resume interrupted runs")
+    parser.add_argument("--jobs", type=int, default=4, help="Number of steps that may run concurrently")
+    parser.add_argument("--fresh", action="store_true", help="Ignore the step journal and run every step")
+    parser.add_argument("--target-root", action="append", default=[],
+                        help="Provision this directory (a chroot or mounted image) instead of the running system; repeatable")
+    args = parser.parse_args(argv)
+    args.target_root = [os.path.abspath(root) for root in args.target_root]
 
     try:
         setup_logging()
 
-        install_desktop_manager(dry_run=args.dry_run)
-        install_window_manager(dry_run=args.dry_run)
-        install_stacking_window_manager(dry_run=args.dry_run)
-        install_tiling_window_manager(dry_run=args.dry_run)
-        install_dynamic_window_manager(dry_run=args.dry_run)
+        # Dry runs must neither skip steps nor mark them as done
+        journal = step_journal.StepJournal(None if args.dry_run else args.journal)
+        if args.fresh:
+            journal.reset()
 
-        install_additional_programs("additional_programs.json", dry_run=args.dry_run)
-        configure_additional_programs(dry_run=args.dry_run)
+        plan = PackagePlan()
+        install_desktop_manager(dry_run=args.dry_run, plan=plan, desktop_manager=args.desktop_manager)
+        install_window_manager(dry_run=args.dry_run, plan=plan, window_manager=args.window_manager)
+        install_additional_programs(args.programs, dry_run=args.dry_run, plan=plan)
 
-        perform_post_installation_steps(dry_run=args.dry_run)
-        update_system()
-        reboot_system()
+        tasks = build_target_tasks(plan, args, journal) if args.target_root else build_tasks(plan, args, journal)
+        if args.dry_run:
+            taskgraph.print_schedule(tasks, step_journal.StepJournal(args.journal), args.jobs)
+        started = time.time()
+        try:
+            taskgraph.run_graph(tasks, journal, args.jobs)
+        finally:
+            if args.target_root:
+                report_target_timings(args.target_root, journal, started)
 
     except Exception as e:
         logging.error(f"Error during script execution: {str(e)}")
@@ -228,3 +582,8 @@ if __name__ == "__main__":
 
     finally:
         cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import time
+import ctypes
+import ctypes.util
+import select
+import signal
+import logging
+import argparse
+import subprocess
+from collections import Counter, deque
+
+import config_edit
+
+STATE_PATH = os.path.expanduser("~/.cache/archscripts/log_monitor.json")
+SEVERITIES = ["emerg", "alert", "crit", "err", "warning", "notice", "info", "debug"]
+# A line longer than this without a newline is cut, so one bad writer cannot grow memory
+MAX_PARTIAL_LINE = 64 * 1024
+
+# (name, pattern, severity or None to keep the entry's own)
+DEFAULT_RULES = [
+    ("oom", r"Out of memory|oom-kill|invoked oom-killer", "crit"),
+    ("segfault", r"segfault at|general protection fault|core dumped", "err"),
+    ("unit-failed", r"Failed to start|entered failed state|Main process exited, code=", "err"),
+    ("auth-failure", r"authentication failure|Failed password|Invalid user", "warning"),
+    ("disk-error", r"I/O error|Buffer I/O error|EXT4-fs error|BTRFS error|critical medium error", "crit"),
+    ("thermal", r"temperature above threshold|cpu clock throttled", "warning"),
+    ("network", r"link is not ready|Link is Down|carrier lost|DHCP.*(timed out|failed)", "warning"),
+]
+
+
+def compile_rules(rules):
+    """Combine rules into one alternation so each line is scanned once.
+
+    Returns (pattern, {group name: (rule name, severity)}); the first rule
+    that matches wins.
+    """
+    groups, parts = {}, []
+    for i, (name, pattern, severity) in enumerate(rules):
+        # The wrapping group closes after any group inside the rule, so it is always lastgroup
+        groups[f"r{i}"] = (name, severity)
+        parts.append(f"(?P<r{i}>{pattern})")
+    return re.compile("|".join(parts) or r"(?!)", re.IGNORECASE), groups
+
+
+def load_rules(path):
+    # A JSON list of {"name": ..., "pattern": ..., "severity": ...} objects
+    with open(path) as f:
+        return [(rule["name"], rule["pattern"], rule.get("severity")) for rule in json.load(f)]
+
+
+class RollingCounter:
+    """Counts per key over a sliding time window, in fixed-size buckets.
+
+    Memory is bounded by buckets * max_keys; keys beyond max_keys in a
+    bucket are counted under "other".
+    """
+
+    def __init__(self, window=300, buckets=30, max_keys=500):
+        self.bucket_size = window / buckets
+        self.buckets = deque(maxlen=buckets)
+        self.max_keys = max_keys
+
+    def add(self, key, ts):
+        start = ts - ts % self.bucket_size
+        if not self.buckets or self.buckets[-1][0] < start:
+            self.buckets.append((start, Counter()))
+        counts = self.buckets[-1][1]
+        if key not in counts and len(counts) >= self.max_keys:
+            key = ("other",) + key[1:] if isinstance(key, tuple) else "other"
+        counts[key] += 1
+
+    def totals(self, now=None):
+        now = time.time() if now is None else now
+        horizon = now - self.bucket_size * self.buckets.maxlen
+        total = Counter()
+        for start, counts in self.buckets:
+            if start >= horizon:
+                total.update(counts)
+        return total
+
+
+class LogMonitor:
+    def __init__(self, rules=DEFAULT_RULES, window=300):
+        self.pattern, self.groups = compile_rules(rules)
+        self.by_unit = RollingCounter(window)
+        self.by_rule = RollingCounter(window)
+        self.lines = 0
+
+    def process(self, ts, unit, severity, message):
+        """Count one entry; returns (rule, severity) if a rule matched, else None."""
+        self.lines += 1
+        match = self.pattern.search(message)
+        if match is None:
+            self.by_unit.add((unit, severity), ts)
+            return None
+        rule, rule_severity = self.groups[match.lastgroup]
+        severity = rule_severity or severity
+        self.by_unit.add((unit, severity), ts)
+        self.by_rule.add(rule, ts)
+        return rule, severity
+
+
+def load_state(path=STATE_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"journal": {}, "files": {}}
+
+
+def save_state(state, path=STATE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    config_edit.write_atomic(path, json.dumps(state))
+
+
+def _journal_message(entry):
+    message = entry.get("MESSAGE", "")
+    if isinstance(message, list):
+        # Non-UTF-8 messages are exported as byte arrays
+        message = bytes(message).decode("utf-8", errors="replace")
+    return message or ""
+
+
+def journal_entries(state, journal_file=None, follow=True, from_start=False):
+    """Yield (ts, unit, severity, message) from journalctl -o json, tracking the cursor in state.
+
+    journal_file reads an exported .journal file instead of the system
+    journal, from its beginning. Without a saved cursor only new system
+    journal entries are read, unless from_start is set.
+    """
+    key = journal_file or "system"
+    command = ["journalctl", "-o", "json", "--no-pager"]
+    if journal_file:
+        command.append(f"--file={journal_file}")
+    cursor = state["journal"].get(key)
+    if cursor:
+        command.append(f"--after-cursor={cursor}")
+    elif not from_start and not journal_file:
+        command += ["-n", "0"]
+    if follow:
+        command.append("-f")
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=1024 * 1024)
+    try:
+        for line in process.stdout:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            unit = entry.get("_SYSTEMD_UNIT") or entry.get("SYSLOG_IDENTIFIER") or entry.get("_TRANSPORT", "unknown")
+            try:
+                severity = SEVERITIES[int(entry.get("PRIORITY", 6))]
+            except (ValueError, IndexError):
+                severity = "info"
+            ts = int(entry.get("__REALTIME_TIMESTAMP", time.time() * 1e6)) / 1e6
+            state["journal"][key] = entry.get("__CURSOR", cursor)
+            yield ts, unit, severity, _journal_message(entry)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+class _Inotify:
+    IN_MODIFY = 0x002
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def watch(self, directory):
+        mask = self.IN_MODIFY | self.IN_CREATE | self.IN_MOVED_TO
+        if self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout):
+        # The events themselves are not needed, only the wakeup
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            os.read(self.fd, 64 * 1024)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def file_entries(paths, state, follow=True, from_start=False, poll_interval=1.0):
+    """Yield (ts, unit, severity, message) for lines appended to plain log files.
+
+    Files are woken up by inotify on their directories (polling if inotify
+    is unavailable); rotation is detected by inode change or truncation.
+    Offsets are kept in state so a restart resumes where it stopped.
+    """
+    files = {}
+    for path in paths:
+        saved = state["files"].get(path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+        if saved and st and saved[0] == st.st_ino and saved[1] <= st.st_size:
+            offset = saved[1]
+        else:
+            offset = 0 if from_start or st is None else st.st_size
+        files[path] = {"inode": st.st_ino if st else None, "offset": offset, "partial": b""}
+
+    inotify = None
+    if follow:
+        try:
+            inotify = _Inotify()
+            for directory in {os.path.dirname(os.path.abspath(path)) for path in paths}:
+                inotify.watch(directory)
+        except (OSError, AttributeError) as e:
+            logging.info(f"inotify unavailable ({e}), polling every {poll_interval}s.")
+            inotify = None
+
+    try:
+        while True:
+            for path, info in files.items():
+                yield from _read_new_lines(path, info, state)
+            if not follow:
+                return
+            if inotify:
+                inotify.wait(poll_interval * 5)
+            else:
+                time.sleep(poll_interval)
+    finally:
+        if inotify:
+            inotify.close()
+
+
+def _read_new_lines(path, info, state):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return
+    if st.st_ino != info["inode"] or st.st_size < info["offset"]:
+        # Rotated or truncated: start the new file from its beginning
+        info.update(inode=st.st_ino, offset=0, partial=b"")
+    if st.st_size == info["offset"]:
+        return
+
+    unit = os.path.basename(path)
+    with open(path, "rb") as f:
+        f.seek(info["offset"])
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            position = info["offset"] - len(info["partial"])
+            info["offset"] += len(block)
+            lines = (info["partial"] + block).split(b"\n")
+            info["partial"] = lines.pop()[-MAX_PARTIAL_LINE:]
+            now = time.time()
+            for line in lines:
+                # The saved offset always points just past the last line handed out
+                position += len(line) + 1
+                state["files"][path] = [info["inode"], position]
+                yield now, unit, "info", line.decode("utf-8", errors="replace")
+
+
+def print_summary(monitor, top=10):
+    units = monitor.by_unit.totals()
+    rules = monitor.by_rule.totals()
+    print(f"\n{monitor.lines} lines processed. Last {monitor.by_unit.bucket_size * monitor.by_unit.buckets.maxlen:.0f}s:")
+    for (unit, severity), count in units.most_common(top):
+        print(f"  {unit:<40} {severity:<8} {count:>8}")
+    for rule, count in rules.most_common():
+        print(f"  rule {rule:<35} {count:>8}")
+
+
+def monitor(entries, log_monitor, state, state_path=STATE_PATH, summary_interval=60, save_interval=5):
+    """Feed entries through log_monitor, printing matches and periodic summaries.
+
+    The cursor state is saved every save_interval seconds and on exit.
+    """
+    last_save = last_summary = time.monotonic()
+    try:
+        for ts, unit, severity, message in entries:
+            matched = log_monitor.process(ts, unit, severity, message)
+            if matched:
+                rule, rule_severity = matched
+                stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+                print(f"{stamp} [{rule_severity}] {rule} {unit}: {message[:300]}")
+            now = time.monotonic()
+            if now - last_save >= save_interval:
+                save_state(state, state_path)
+                last_save = now
+            if summary_interval and now - last_summary >= summary_interval:
+                print_summary(log_monitor)
+                last_summary = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        save_state(state, state_path)
+    print_summary(log_monitor)
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch the journal or log files for problems")
+    parser.add_argument("--file", action="append", default=[], help="Follow a plain log file (repeatable)")
+    parser.add_argument("--journal-file", help="Read an exported .journal file instead of the system journal")
+    parser.add_argument("--rules", help="JSON file with rules to use instead of the defaults")
+    parser.add_argument("--from-start", action="store_true", help="Read existing entries when no cursor is saved")
+    parser.add_argument("--no-follow", action="store_true", help="Stop at the end of the input")
+    parser.add_argument("--summary-interval", type=int, default=60)
+    parser.add_argument("--state", default=STATE_PATH, help="Where the cursor is kept between runs")
+    args = parser.parse_args(argv)
+
+    # SIGTERM (e.g. from systemd) stops the same way as Ctrl+C so the cursor is saved
+    signal.signal(signal.SIGTERM, _interrupt)
+
+    state = load_state(args.state)
+    follow = not args.no_follow
+    if args.file:
+        entries = file_entries(args.file, state, follow, args.from_start)
+    else:
+        entries = journal_entries(state, args.journal_file, follow and not args.journal_file, args.from_start)
+    log_monitor = LogMonitor(load_rules(args.rules) if args.rules else DEFAULT_RULES)
+    monitor(entries, log_monitor, state, args.state, args.summary_interval)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())
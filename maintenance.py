@@ -1,103 +1,138 @@
 import os
-import subprocess
+import sys
+import logging
 import random
+import argparse
+
+import backup_engine
+import log_monitor
+import pacman_cleanup
+import pacman_db
+import sizes
+import system_update
+import telemetry
+import update_scheduler
+
+BACKUP_REPOSITORY = os.path.expanduser('~/.local/share/archscripts/backups')
 
 def run_command(command):
-    subprocess.run(command, check=True)
+    logging.info(f"Running {' '.join(command)}")
+    telemetry.run(command, check=True)
+
+# Menu number -> (action name, title); the names double as command-line actions
+ACTIONS = {
+    "1": ("update", "Update system"),
+    "2": ("remove-orphans", "Remove unnecessary packages"),
+    "3": ("clean-cache", "Clean package cache"),
+    "4": ("auto-updates", "Configure automatic updates"),
+    "5": ("backup", "Backup important files"),
+    "6": ("logs", "Monitor system logs"),
+    "7": ("security", "Check security updates"),
+    "8": ("cleanup", "Perform system cleanup"),
+    "9": ("info", "Display system information"),
+    "10": ("surprise", "Surprise upgrades"),
+    "11": ("install-extra", "Install additional packages"),
+    "12": ("wallpaper", "Change wallpaper"),
+    "13": ("screenshot", "Take a screenshot"),
+    "14": ("calendar", "Show calendar"),
+}
 
 def system_administration_tool():
     print("System Administration Tool")
     print("==========================")
-    print("1. Update system")
-    print("2. Remove unnecessary packages")
-    print("3. Clean package cache")
-    print("4. Configure automatic updates")
-    print("5. Backup important files")
-    print("6. Monitor system logs")
-    print("7. Check security updates")
-    print("8. Perform system cleanup")
-    print("9. Display system information")
-    print("10. Surprise upgrades")
-    print("11. Install additional packages")
-    print("12. Change wallpaper")
-    print("13. Take a screenshot")
-    print("14. Show calendar")
-
-    choice = input("Select an action (1-14): ")
-
-    if choice == "1":
+    for number, (_, title) in ACTIONS.items():
+        print(f"{number}. {title}")
+
+    choice = input(f"Select an action (1-{len(ACTIONS)}): ")
+    if choice not in ACTIONS:
+        print("Invalid choice. Please select a valid option.")
+        return None
+    return ACTIONS[choice][0]
+
+def run_action(action, args):
+    if action == "update":
         update_system()
-    elif choice == "2":
-        remove_unnecessary_packages()
-    elif choice == "3":
-        clean_package_cache()
-    elif choice == "4":
-        configure_automatic_updates()
-    elif choice == "5":
-        backup_files()
-    elif choice == "6":
+    elif action == "remove-orphans":
+        remove_unnecessary_packages(args.yes)
+    elif action == "clean-cache":
+        clean_package_cache(args.keep, args.yes, args.free_target)
+    elif action == "auto-updates":
+        configure_automatic_updates(args.window)
+    elif action == "backup":
+        backup_files(args.source, args.repository)
+    elif action == "logs":
         monitor_system_logs()
-    elif choice == "7":
+    elif action == "security":
         check_security_updates()
-    elif choice == "8":
-        perform_system_cleanup()
-    elif choice == "9":
+    elif action == "cleanup":
+        perform_system_cleanup(args.keep, args.yes, args.free_target)
+    elif action == "info":
         display_system_info()
-    elif choice == "10":
+    elif action == "surprise":
         surprise_upgrades()
-    elif choice == "11":
+    elif action == "install-extra":
         install_additional_packages()
-    elif choice == "12":
+    elif action == "wallpaper":
         change_wallpaper()
-    elif choice == "13":
+    elif action == "screenshot":
         take_screenshot()
-    elif choice == "14":
+    elif action == "calendar":
         show_calendar()
-    else:
-        print("Invalid choice. Please select a valid option.")
 
 def update_system():
-    run_command(['sudo', 'pacman', '-Syu', '--noconfirm'])
-
-def remove_unnecessary_packages():
-    packages_to_remove = ['package1', 'package2', 'package3']
-    run_command(['sudo', 'pacman', '-Rns'] + packages_to_remove)
-
-def clean_package_cache():
-    run_command(['sudo', 'paccache', '-r'])
-
-def configure_automatic_updates(script_path='/path/to/update.sh'):
-    if not os.path.exists(script_path):
-        # Create the update script
-        with open(script_path, 'w') as file:
-            file.write('#!/bin/bash\n')
-            file.write('pacman -Syu --noconfirm\n')
-
-        # Make the script executable
-        os.chmod(script_path, 0o755)
-
-    cron_entry = '0 3 * * * /bin/bash {}'.format(script_path)
-    # Add the cron entry
-    run_command(['echo', '{} | crontab -'.format(cron_entry)], shell=True)
-
-def backup_files():
-    source_directory = input('Enter the source directory: ') or '/path/to/source/'
-    backup_destination = '/path/to/backup/destination/'
-    run_command(['rsync', '-av', '--delete', source_directory, backup_destination])
+    # Downloads run in the background while earlier chunks install
+    system_update.update()
+
+def confirm(message, assume_yes=False):
+    if assume_yes:
+        return True
+    return input(f'{message} (y/n): ').strip().lower() == 'y'
+
+def remove_unnecessary_packages(assume_yes=False):
+    # Orphans are computed from the local database, keeping optional dependencies
+    orphans = pacman_cleanup.plan_orphan_removal(pacman_db.load_local())
+    if not orphans:
+        print('No orphaned packages found.')
+        return
+    pacman_cleanup.print_plan(orphans, 'Orphaned packages')
+    if confirm('Remove these packages?', assume_yes):
+        run_command(['sudo', 'pacman', '-Rns', '--noconfirm'] + [name for name, _ in orphans])
+
+def clean_package_cache(keep=3, assume_yes=False, free_target=None):
+    plan = pacman_cleanup.plan_cache_cleanup(pacman_db.load_local(), keep=keep, free_target=free_target)
+    if not plan:
+        print('Nothing to remove from the package cache.')
+        return
+    pacman_cleanup.print_plan(plan, 'Cached package files')
+    if confirm('Delete these files?', assume_yes):
+        paths = [path for path, _, _ in plan]
+        signatures = [f'{path}.sig' for path in paths if os.path.exists(f'{path}.sig')]
+        run_command(['sudo', 'rm', '-f', '--'] + paths + signatures)
+
+def configure_automatic_updates(window='02:00-05:00'):
+    # A systemd timer in this host's slot of the window, so a fleet does not hit the mirrors at once
+    calendar = update_scheduler.install(window=window)
+    print(f"Automatic updates scheduled daily at {calendar.split()[-1]}, plus a random delay of up to 15 minutes.")
+
+def backup_files(source_directory=None, backup_repository=None):
+    if source_directory is None:
+        source_directory = input('Enter the source directory: ') or os.path.expanduser('~')
+    if backup_repository is None:
+        backup_repository = input(f'Enter the backup repository ({BACKUP_REPOSITORY}): ') or BACKUP_REPOSITORY
+    # Incremental: only files whose size or mtime changed since the last snapshot are read
+    snapshot, stats = backup_engine.backup(source_directory, backup_repository)
+    print(f"Created snapshot {snapshot}: {stats['files']} files, {stats['hashed']} changed, {stats['stored']} new objects")
 
 def monitor_system_logs():
-    log_files = ['/var/log/syslog', '/var/log/messages']
-    for log_file in log_files:
-        with open(log_file, 'r') as file:
-            # Read and analyze log entries
-            # Perform actions based on log content
-            pass
+    # Arch logs to the journal; follow it until Ctrl+C, resuming from the saved cursor
+    log_monitor.main([])
 
 def check_security_updates():
     run_command(['sudo', 'arch-audit', '-u'])
 
-def perform_system_cleanup():
-    run_command(['sudo', 'paccache', '-r'])
+def perform_system_cleanup(keep=3, assume_yes=False, free_target=None):
+    remove_unnecessary_packages(assume_yes)
+    clean_package_cache(keep, assume_yes, free_target)
     run_command(['sudo', 'journalctl', '--vacuum-size=100M'])
 
 def display_system_info():
@@ -125,5 +160,24 @@ def take_screenshot():
 def show_calendar():
     run_command(['cal'])
 
-# Main program
-system_administration_tool()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="System administration tasks; shows a menu when no action is given")
+    parser.add_argument("action", nargs="?", choices=[name for name, _ in ACTIONS.values()])
+    parser.add_argument("-y", "--yes", action="store_true", help="Answer yes to every confirmation")
+    parser.add_argument("--keep", type=int, default=3, help="Cached versions of each package to keep")
+    parser.add_argument("--free-target", type=sizes.parse_size,
+                        help="Remove older cached versions too until this much disk is free, e.g. 10G")
+    parser.add_argument("--window", default="02:00-05:00", help="Window for automatic updates")
+    parser.add_argument("--source", help="Directory to back up (asked for when omitted)")
+    parser.add_argument("--repository", help="Backup repository (asked for when omitted)")
+    args = parser.parse_args(argv)
+
+    action = args.action or system_administration_tool()
+    if action is None:
+        return 1
+    run_action(action, args)
+    return 0
+
+if __name__ == "__main__":
+    telemetry.setup("maintenance", console_level=logging.WARNING)
+    sys.exit(main())
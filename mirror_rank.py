@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import ssl
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import urllib.parse
+
+import config_edit
+import privileged_executor
+
+MIRRORLIST = os.environ.get("ARCHSCRIPTS_MIRRORLIST", "/etc/pacman.d/mirrorlist")
+CACHE_PATH = os.path.expanduser("~/.cache/archscripts/mirror_scores.json")
+CACHE_VERSION = 1
+# Scores younger than this are reused instead of probing again
+SCORE_TTL = 6 * 3600
+# The sample is a prefix of a repository database, which every mirror carries
+SAMPLE_REPO = "core"
+SAMPLE_BYTES = 256 * 1024
+# Mirrors are ranked by the estimated time to download a package of this size
+TYPICAL_PACKAGE = 4 * 1024 * 1024
+# Mirrors that synced this much later than the freshest one rank behind all fresh ones
+MAX_LAG = 24 * 3600
+# Commented-out mirrors that scored best last time are probed again alongside the active ones
+KEEP_BEST = 10
+
+_SERVER_RE = re.compile(r"^\s*#?\s*Server\s*=\s*(\S+)", re.MULTILINE)
+_ACTIVE_SERVER_RE = re.compile(r"^\s*Server\s*=\s*(\S+)", re.MULTILINE)
+# The stock mirrorlist groups its commented-out servers under "## Country" headers
+_HEADER_RE = re.compile(r"^\s*##\s*(.*?)\s*$")
+
+
+def read_servers(path=MIRRORLIST, active_only=False):
+    """Return the Server URLs in a mirrorlist in file order, including commented-out ones unless active_only."""
+    try:
+        with open(path) as f:
+            text = f.read()
+    except FileNotFoundError:
+        return []
+    return list(dict.fromkeys((_ACTIVE_SERVER_RE if active_only else _SERVER_RE).findall(text)))
+
+
+def read_mirrorlist(path=MIRRORLIST):
+    """Return [(url, country, active)] for every Server line in file order.
+
+    country is the last "## " header above the line, or None.
+    """
+    entries, seen, country = [], set(), None
+    try:
+        with open(path) as f:
+            for line in f:
+                header = _HEADER_RE.match(line)
+                if header:
+                    country = header.group(1) or None
+                    continue
+                server = _SERVER_RE.match(line)
+                if server and server.group(1) not in seen:
+                    seen.add(server.group(1))
+                    entries.append((server.group(1), country, _ACTIVE_SERVER_RE.match(line) is not None))
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def select_candidates(entries, cache, keep=KEEP_BEST, countries=(), all_servers=False):
+    """Return the URLs worth probing out of read_mirrorlist entries.
+
+    That is the active servers, the keep best-scored commented-out ones
+    from the cache and every server under one of countries; all_servers
+    takes every entry instead. The stock mirrorlist lists hundreds of
+    commented-out servers, so probing all of them is opt-in.
+    """
+    if all_servers:
+        return [url for url, _, _ in entries]
+    active = [url for url, _, is_active in entries if is_active]
+    scored = [cache["scores"][url] for url, _, is_active in entries if not is_active and url in cache["scores"]]
+    best = [score["url"] for score in rank(scored)[:keep]]
+    wanted = {country.lower() for country in countries}
+    local = [url for url, country, _ in entries if country and country.lower() in wanted]
+    return list(dict.fromkeys([*active, *best, *local]))
+
+
+def mirror_base(url):
+    # 'https://host/archlinux/$repo/os/$arch' -> 'https://host/archlinux/'
+    return url.split("$repo", 1)[0]
+
+
+async def http_get(url, limit, timeout):
+    """GET url with a raw HTTP/1.1 request; returns (status, body, seconds to first byte, body seconds).
+
+    At most limit bytes of the body are read, so a large sample file costs
+    no more than the prefix that is measured.
+    """
+    parts = urllib.parse.urlsplit(url)
+    secure = parts.scheme == "https"
+    port = parts.port or (443 if secure else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path += f"?{parts.query}"
+
+    start = time.monotonic()
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, port, ssl=ssl.create_default_context() if secure else None), timeout)
+    try:
+        writer.write((f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nUser-Agent: archscripts-mirror-rank\r\n"
+                      f"Range: bytes=0-{limit - 1}\r\nConnection: close\r\n\r\n").encode())
+        await writer.drain()
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+        first_byte = time.monotonic() - start
+
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        status = int(status_line.split()[1])
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        body_start = time.monotonic()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await asyncio.wait_for(_read_chunked(reader, limit), timeout)
+        else:
+            # Servers ignoring Range send the whole file; reading stops at limit either way
+            body = await asyncio.wait_for(_read_until(reader, min(int(headers.get("content-length", limit)), limit)), timeout)
+        return status, body, first_byte, time.monotonic() - body_start
+    finally:
+        writer.close()
+
+
+async def _read_until(reader, limit):
+    body = b""
+    while len(body) < limit:
+        block = await reader.read(limit - len(body))
+        if not block:
+            break
+        body += block
+    return body
+
+
+async def _read_chunked(reader, limit):
+    body = b""
+    while len(body) < limit:
+        size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+        if size == 0:
+            break
+        body += await reader.readexactly(size)
+        await reader.readline()
+    return body[:limit]
+
+
+async def probe(url, arch, timeout=10.0):
+    """Measure one mirror; returns a score dict (with "error" set if the probe failed)."""
+    base = mirror_base(url)
+    result = {"url": url, "checked": time.time(), "latency": None, "throughput": None, "lastsync": None, "error": None}
+    try:
+        status, body, latency, _ = await http_get(f"{base}lastsync", 64, timeout)
+        if status != 200:
+            raise OSError(f"lastsync returned HTTP {status}")
+        result["latency"] = latency
+        result["lastsync"] = int(body.strip())
+
+        sample_url = url.replace("$repo", SAMPLE_REPO).replace("$arch", arch) + f"/{SAMPLE_REPO}.db"
+        status, body, _, seconds = await http_get(sample_url, SAMPLE_BYTES, timeout)
+        if status not in (200, 206) or not body:
+            raise OSError(f"{SAMPLE_REPO}.db returned HTTP {status}")
+        result["throughput"] = len(body) / max(seconds, 1e-6)
+    except (OSError, ValueError, IndexError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+        result["error"] = str(e) or type(e).__name__
+    return result
+
+
+async def probe_all(urls, arch, concurrency=16, timeout=10.0):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(url):
+        async with semaphore:
+            return await probe(url, arch, timeout)
+
+    return await asyncio.gather(*(limited(url) for url in urls))
+
+
+def estimated_seconds(score):
+    return score["latency"] + TYPICAL_PACKAGE / score["throughput"]
+
+
+def rank(scores, max_lag=MAX_LAG):
+    """Return the working mirrors' scores, best first.
+
+    Mirrors lagging the freshest one by more than max_lag come after all
+    fresh mirrors, however fast they are.
+    """
+    working = [score for score in scores if not score["error"]]
+    if not working:
+        return []
+    newest = max(score["lastsync"] for score in working)
+    return sorted(working, key=lambda score: (newest - score["lastsync"] > max_lag, estimated_seconds(score)))
+
+
+def load_cache(path=CACHE_PATH):
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+        if cache.get("version") == CACHE_VERSION:
+            return cache
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return {"version": CACHE_VERSION, "scores": {}}
+
+
+def save_cache(cache, path=CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    config_edit.write_atomic(path, json.dumps(cache))
+
+
+def score_mirrors(urls, arch=None, ttl=SCORE_TTL, cache_path=CACHE_PATH, concurrency=16, timeout=10.0):
+    """Return scores for urls, probing only those without a cached score younger than ttl."""
+    arch = arch or os.uname().machine
+    cache = load_cache(cache_path)
+    now = time.time()
+    stale = [url for url in urls if now - cache["scores"].get(url, {}).get("checked", 0) >= ttl]
+    if stale:
+        logging.info(f"Probing {len(stale)} mirrors ({len(urls) - len(stale)} cached)...")
+        for score in asyncio.run(probe_all(stale, arch, concurrency, timeout)):
+            cache["scores"][score["url"]] = score
+        save_cache(cache, cache_path)
+    return [cache["scores"][url] for url in urls]
+
+
+def render_mirrorlist(ranked, entries, count):
+    """Return mirrorlist text with the best count mirrors enabled and every other entry commented out."""
+    chosen = [score["url"] for score in ranked[:count]]
+    lines = [f"# Ranked by archscripts mirror_rank on {time.strftime('%Y-%m-%d %H:%M:%S')}", ""]
+    for score in ranked[:count]:
+        lines.append(f"# {estimated_seconds(score):.2f}s per {TYPICAL_PACKAGE // (1024 * 1024)} MiB, "
+                     f"synced {time.strftime('%Y-%m-%d %H:%M', time.gmtime(score['lastsync']))} UTC")
+        lines.append(f"Server = {score['url']}")
+    # Keeping the rest as comments, under their headers, keeps them as candidates for the next ranking
+    rest = [(url, country) for url, country, _ in entries if url not in chosen]
+    for i, (url, country) in enumerate(rest):
+        if i == 0 or country != rest[i - 1][1]:
+            lines.append("")
+            if country:
+                lines.append(f"## {country}")
+        lines.append(f"#Server = {url}")
+    return "\n".join(lines) + "\n"
+
+
+def write_mirrorlist(path, content):
+    directory = os.path.dirname(os.path.abspath(path))
+    if os.access(directory, os.W_OK):
+        config_edit.write_atomic(path, content, 0o644)
+    else:
+        privileged_executor.get_executor().write_file(path, content, 0o644)
+
+
+def update_mirrorlist(path=MIRRORLIST, output=None, extra=(), count=5, ttl=SCORE_TTL, dry_run=False, countries=(),
+                      all_servers=False, keep=KEEP_BEST, **probe_options):
+    """Rank mirrors from path (plus extra) and write the best count to output (default path).
+
+    The candidates are chosen by select_candidates. Returns the ranked
+    scores, or an empty list when there was nothing to rank or no mirror
+    answered; the mirrorlist is then left alone.
+    """
+    entries = read_mirrorlist(path)
+    known = {url for url, _, _ in entries}
+    entries += [(url, None, False) for url in dict.fromkeys(extra) if url not in known]
+    cache = load_cache(probe_options.get("cache_path", CACHE_PATH))
+    candidates = list(dict.fromkeys([*select_candidates(entries, cache, keep, countries, all_servers), *extra]))
+    if not candidates:
+        logging.info(f"No active or previously ranked mirrors in {path}, not ranking; "
+                     f"pick some with --country or probe them all with --all-servers.")
+        return []
+    ranked = rank(score_mirrors(candidates, ttl=ttl, **probe_options))
+    if not ranked:
+        logging.warning("No mirror answered, keeping the current mirrorlist.")
+        return []
+    output = output or path
+    if [score["url"] for score in ranked[:count]] == read_servers(output, active_only=True):
+        logging.info(f"{output} already lists the best mirrors in order.")
+        return ranked
+    content = render_mirrorlist(ranked, entries, count)
+    if dry_run:
+        logging.info(f"[Dry Run] Skipping mirrorlist write to {output}")
+    else:
+        write_mirrorlist(output, content)
+        logging.info(f"Wrote {min(count, len(ranked))} ranked mirrors to {output}")
+    return ranked
+
+
+def ensure_ranked(path=MIRRORLIST, dry_run=False):
+    """Rank mirrors before a sync, never failing the caller; within SCORE_TTL of the last run this costs no probes."""
+    try:
+        update_mirrorlist(path, dry_run=dry_run)
+    except (OSError, privileged_executor.CommandError) as e:
+        logging.warning(f"Mirror ranking failed, keeping the current mirrorlist: {e}")
+
+
+def print_ranking(ranked):
+    print(f"{'Mirror':<60} {'Latency':>8} {'Speed':>11} {'Estimate':>9}")
+    for score in ranked:
+        print(f"{score['url'][:60]:<60} {score['latency'] * 1000:>6.0f}ms "
+              f"{score['throughput'] / 1024:>7.0f}KiB/s {estimated_seconds(score):>8.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rank pacman mirrors by latency, speed and freshness")
+    parser.add_argument("--mirrorlist", default=MIRRORLIST, help="Where the candidate mirrors are read from")
+    parser.add_argument("--output", help="Where to write the ranked list (default: --mirrorlist)")
+    parser.add_argument("--mirror", action="append", default=[], help="Extra candidate Server URL (repeatable)")
+    parser.add_argument("--country", action="append", default=[],
+                        help="Also probe the commented-out servers under this '## Country' header (repeatable)")
+    parser.add_argument("--all-servers", action="store_true", help="Probe every commented-out server too")
+    parser.add_argument("--keep", type=int, default=KEEP_BEST,
+                        help="Commented-out mirrors that scored best last time to probe again")
+    parser.add_argument("--count", type=int, default=5, help="Mirrors to enable")
+    parser.add_argument("--ttl", type=int, default=SCORE_TTL, help="Seconds a cached score stays valid")
+    parser.add_argument("--force", action="store_true", help="Probe every mirror, ignoring cached scores")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--dry-run", action="store_true", help="Print the ranking without writing the mirrorlist")
+    args = parser.parse_args(argv)
+
+    ranked = update_mirrorlist(args.mirrorlist, args.output, args.mirror, args.count, 0 if args.force else args.ttl,
+                               args.dry_run, args.country, args.all_servers, args.keep,
+                               concurrency=args.concurrency, timeout=args.timeout)
+    print_ranking(ranked)
+    return 0 if ranked else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())
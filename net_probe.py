@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import errno
+import signal
+import socket
+import struct
+import asyncio
+import logging
+import argparse
+import threading
+
+SYS_NET = "/sys/class/net"
+ROUTE_PATH = "/proc/net/route"
+ARP_PATH = "/proc/net/arp"
+# Addresses rather than names, so a TCP failure is not really a DNS failure
+DEFAULT_TARGETS = os.environ.get("ARCHSCRIPTS_NET_TARGETS", "1.1.1.1:443,8.8.8.8:53,9.9.9.9:443").split(",")
+DEFAULT_NAMES = os.environ.get("ARCHSCRIPTS_NET_DNS", "archlinux.org,example.com").split(",")
+# Lowest first: the first failing layer is where remediation starts
+LAYERS = ["link", "route", "gateway", "dns", "tcp"]
+
+
+def _layer(ok, latency=None, detail=""):
+    return {"ok": ok, "latency": latency, "detail": detail}
+
+
+def read_links(sys_net=SYS_NET):
+    """Return {interface: (operstate, carrier)} for every interface except loopback."""
+    links = {}
+    for name in sorted(os.listdir(sys_net)):
+        if name == "lo":
+            continue
+        path = os.path.join(sys_net, name)
+        try:
+            with open(os.path.join(path, "operstate")) as f:
+                operstate = f.read().strip()
+        except OSError:
+            continue
+        try:
+            with open(os.path.join(path, "carrier")) as f:
+                carrier = f.read().strip() == "1"
+        except OSError:
+            # Reading carrier of an interface that is administratively down fails with EINVAL
+            carrier = False
+        links[name] = (operstate, carrier)
+    return links
+
+
+def link_layer(sys_net=SYS_NET):
+    links = read_links(sys_net)
+    # Tunnels and some drivers report "unknown" while carrying traffic
+    up = [name for name, (operstate, carrier) in links.items() if operstate == "up" or (operstate == "unknown" and carrier)]
+    detail = ", ".join(f"{name} {operstate}{'' if carrier else ' no-carrier'}" for name, (operstate, carrier) in links.items())
+    return _layer(bool(up), detail=detail or "no interfaces"), up
+
+
+def default_route(route_path=ROUTE_PATH):
+    """Return (interface, gateway or None) of the lowest-metric IPv4 default route, or None."""
+    best = None
+    try:
+        with open(route_path) as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if len(fields) < 8 or fields[1] != "00000000" or not int(fields[3], 16) & 0x1:
+                    continue
+                metric = int(fields[6])
+                gateway = socket.inet_ntoa(struct.pack("<L", int(fields[2], 16)))
+                if best is None or metric < best[0]:
+                    best = (metric, fields[0], None if gateway == "0.0.0.0" else gateway)
+    except (OSError, StopIteration):
+        return None
+    return best[1:] if best else None
+
+
+def arp_complete(address, arp_path=ARP_PATH):
+    try:
+        with open(arp_path) as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if fields and fields[0] == address:
+                    # ATF_COM: the neighbour answered
+                    return bool(int(fields[2], 16) & 0x2)
+    except (OSError, StopIteration):
+        pass
+    return False
+
+
+def _checksum(data):
+    data += b"\0" * (len(data) % 2)
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    return ~(total + (total >> 16)) & 0xFFFF
+
+
+async def icmp_ping(address, timeout):
+    """Round trip of one ICMP echo over an unprivileged ping socket; None if such sockets are not allowed."""
+    loop = asyncio.get_running_loop()
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    except OSError as e:
+        # net.ipv4.ping_group_range excludes this user
+        if e.errno in (errno.EACCES, errno.EPERM, errno.EPROTONOSUPPORT):
+            return None
+        raise
+    with sock:
+        sock.setblocking(False)
+        sock.connect((address, 0))
+        header = struct.pack("!BBHHH", 8, 0, 0, 0, 1) + b"archscripts"
+        packet = header[:2] + struct.pack("!H", _checksum(header)) + header[4:]
+        start = time.monotonic()
+        await loop.sock_sendall(sock, packet)
+        while True:
+            reply = await asyncio.wait_for(loop.sock_recv(sock, 1024), timeout - (time.monotonic() - start))
+            if reply[:1] == b"\0":
+                return time.monotonic() - start
+
+
+async def gateway_layer(gateway, timeout, arp_path=ARP_PATH):
+    """Reachable if it answers a ping or, since many routers drop ICMP, completes ARP."""
+    start = time.monotonic()
+    try:
+        latency = await icmp_ping(gateway, timeout)
+        if latency is not None:
+            return _layer(True, latency, f"{gateway} answered ping")
+    except (OSError, asyncio.TimeoutError):
+        pass
+    # A datagram to the discard port makes the kernel resolve the neighbour
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            sock.sendto(b"", (gateway, 9))
+    except OSError:
+        pass
+    while time.monotonic() - start < timeout:
+        if arp_complete(gateway, arp_path):
+            return _layer(True, time.monotonic() - start, f"{gateway} resolved by ARP")
+        await asyncio.sleep(0.02)
+    return _layer(False, detail=f"{gateway} did not answer")
+
+
+async def _timed(coroutine, timeout):
+    start = time.monotonic()
+    try:
+        await asyncio.wait_for(coroutine, timeout)
+        return True, time.monotonic() - start, ""
+    except asyncio.TimeoutError:
+        return False, None, "timed out"
+    except OSError as e:
+        return False, None, e.strerror or str(e)
+
+
+def _settle(future, result, error):
+    # The probe may have stopped waiting for this lookup already
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+async def _resolve(name):
+    """getaddrinfo on a daemon thread of its own.
+
+    A hung lookup cannot be cancelled; on the loop's executor it would hold
+    up the end of the probe, and a pool worker would still be joined when
+    the interpreter exits. Here the probe simply stops waiting for it.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def lookup():
+        try:
+            result, error = socket.getaddrinfo(name, None, type=socket.SOCK_STREAM), None
+        except OSError as e:
+            result, error = None, e
+        try:
+            loop.call_soon_threadsafe(_settle, future, result, error)
+        except RuntimeError:
+            # The loop was closed while the lookup hung
+            pass
+
+    threading.Thread(target=lookup, name=f"resolve {name}", daemon=True).start()
+    await future
+
+
+async def _connect(host, port):
+    _, writer = await asyncio.open_connection(host, port)
+    writer.close()
+
+
+def _any_layer(results, labels):
+    # The layer works if any of its targets does; its latency is the fastest one's
+    successes = [latency for ok, latency, _ in results if ok]
+    detail = ", ".join(f"{label} {f'{latency * 1000:.0f}ms' if ok else error}"
+                       for label, (ok, latency, error) in zip(labels, results))
+    return _layer(bool(successes), min(successes) if successes else None, detail)
+
+
+async def probe_async(targets=DEFAULT_TARGETS, names=DEFAULT_NAMES, timeout=2.0, sys_net=SYS_NET,
+                      route_path=ROUTE_PATH, arp_path=ARP_PATH):
+    start = time.monotonic()
+    layers = {}
+    layers["link"], _ = link_layer(sys_net)
+    route = default_route(route_path)
+    layers["route"] = _layer(route is not None, detail=f"via {route[1] or 'point-to-point'} dev {route[0]}" if route else
+                             "no default route")
+
+    # Every probe starts at once, so the whole check takes at most timeout
+    endpoints = [target.rsplit(":", 1) for target in targets]
+    gateway = gateway_layer(route[1], timeout, arp_path) if route and route[1] else None
+    results = await asyncio.gather(
+        *([gateway] if gateway else []),
+        asyncio.gather(*(_timed(_resolve(name), timeout) for name in names)),
+        asyncio.gather(*(_timed(_connect(host, int(port)), timeout) for host, port in endpoints)))
+    if gateway:
+        layers["gateway"] = results[0]
+    else:
+        layers["gateway"] = _layer(route is not None, detail="no gateway on the route" if route else "no default route")
+    layers["dns"] = _any_layer(results[-2], names)
+    layers["tcp"] = _any_layer(results[-1], targets)
+
+    if layers["tcp"]["ok"] and layers["dns"]["ok"]:
+        verdict = "up"
+    elif layers["tcp"]["ok"]:
+        verdict = "degraded"
+    else:
+        verdict = "down"
+    failed = next((layer for layer in LAYERS if not layers[layer]["ok"]), None) if verdict != "up" else None
+    return {"verdict": verdict, "failed_layer": failed, "layers": layers, "elapsed": time.monotonic() - start}
+
+
+def probe(targets=DEFAULT_TARGETS, names=DEFAULT_NAMES, timeout=2.0, **paths):
+    """Check each network layer concurrently; returns a health dict.
+
+    verdict is "up" (TCP and DNS work), "degraded" (TCP works, DNS does
+    not) or "down"; failed_layer is the lowest layer that failed when the
+    verdict is not "up". Every layer reports ok, latency and detail.
+    """
+    # Not asyncio.run: it waits for the default executor's threads, and so
+    # for any lookup stuck in there (say, a host name passed as a target)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(probe_async(targets, names, timeout, **paths))
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        # Shuts the default executor down without waiting
+        loop.close()
+
+
+def format_result(result):
+    lines = [f"Network {result['verdict']} ({result['elapsed'] * 1000:.0f}ms)"]
+    for name in LAYERS:
+        layer = result["layers"][name]
+        latency = f"{layer['latency'] * 1000:.0f}ms" if layer["latency"] is not None else ""
+        lines.append(f"  {'ok  ' if layer['ok'] else 'FAIL'} {name:<8} {latency:>7}  {layer['detail']}")
+    return "\n".join(lines)
+
+
+def watch(min_interval=2.0, max_interval=60.0, count=None, verbose=False, **probe_options):
+    """Probe repeatedly, backing off while the network stays up and returning to min_interval on any problem."""
+    interval, last, probes = min_interval, None, 0
+    while count is None or probes < count:
+        result = probe(**probe_options)
+        probes += 1
+        changed = result["verdict"] != last
+        if changed or verbose:
+            stamp = time.strftime("%H:%M:%S")
+            failed = f", failed at {result['failed_layer']}" if result["failed_layer"] else ""
+            print(f"{stamp} {result['verdict']}{failed} ({result['elapsed'] * 1000:.0f}ms)", flush=True)
+        interval = min(interval * 2, max_interval) if result["verdict"] == "up" and not changed else min_interval
+        last = result["verdict"]
+        if count is None or probes < count:
+            time.sleep(interval)
+    return last
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check link, route, gateway, DNS and TCP reachability concurrently")
+    parser.add_argument("--target", action="append", help="host:port to connect to (repeatable)")
+    parser.add_argument("--dns", action="append", help="Name to resolve (repeatable)")
+    parser.add_argument("--timeout", type=float, default=2.0, help="Deadline for every probe, and so for the whole check")
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--watch", action="store_true", help="Keep probing, printing verdict changes")
+    parser.add_argument("--min-interval", type=float, default=2.0)
+    parser.add_argument("--max-interval", type=float, default=60.0)
+    parser.add_argument("--count", type=int, help="Stop watching after this many probes")
+    parser.add_argument("--verbose", action="store_true", help="In watch mode, print every probe")
+    args = parser.parse_args(argv)
+    options = {"targets": args.target or DEFAULT_TARGETS, "names": args.dns or DEFAULT_NAMES, "timeout": args.timeout}
+
+    if args.watch:
+        signal.signal(signal.SIGTERM, _interrupt)
+        try:
+            last = watch(args.min_interval, args.max_interval, args.count, args.verbose, **options)
+        except KeyboardInterrupt:
+            return 0
+        return 0 if last != "down" else 1
+
+    result = probe(**options)
+    print(json.dumps(result, indent=1) if args.json else format_result(result))
+    return 0 if result["verdict"] != "down" else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import logging
+import argparse
+import subprocess
+
+import net_probe
+import telemetry
+
+
+def _flush_dns(interface):
+    telemetry.run(["resolvectl", "flush-caches"], check=True)
+
+
+def _reapply(interface):
+    # Re-runs the active connection's configuration (and DHCP) without taking the link down
+    telemetry.run(["nmcli", "device", "reapply", interface], check=True)
+
+
+def _bounce(interface):
+    telemetry.run(["nmcli", "device", "disconnect", interface], check=True)
+    telemetry.run(["nmcli", "device", "connect", interface], check=True)
+
+
+def _restart(interface):
+    telemetry.run(["systemctl", "restart", "NetworkManager"], check=True)
+
+
+DISRUPTION = ["nothing", "interface", "all"]
+# Cheapest first: (name, action, layers it can fix, what it disconnects)
+LADDER = [
+    ("flush-dns", _flush_dns, {"dns"}, "nothing"),
+    ("reapply", _reapply, {"route", "gateway", "dns", "tcp"}, "nothing"),
+    ("bounce-link", _bounce, {"link", "route", "gateway", "tcp"}, "interface"),
+    ("restart-networkmanager", _restart, set(net_probe.LAYERS), "all"),
+]
+
+
+def pick_interface(sys_net=net_probe.SYS_NET, route_path=net_probe.ROUTE_PATH):
+    """The default route's interface, else the first physical interface, preferring one with carrier."""
+    route = net_probe.default_route(route_path)
+    if route:
+        return route[0]
+    links = net_probe.read_links(sys_net)
+    physical = [name for name in links if os.path.exists(os.path.join(sys_net, name, "device"))]
+    with_carrier = [name for name in physical if links[name][1]]
+    return (with_carrier or physical or list(links) or [None])[0]
+
+
+def wait_until_up(probe, settle, interval=0.5):
+    """Re-probe until the network is up or settle seconds pass; returns the last result."""
+    deadline = time.monotonic() + settle
+    while True:
+        result = probe()
+        if result["verdict"] == "up" or time.monotonic() + interval > deadline:
+            return result
+        time.sleep(interval)
+
+
+def remediate(result=None, settle=10.0, probe=None, interface=None, max_disruption="all"):
+    """Climb the ladder from the cheapest rung that can fix the failed layer until the network is up.
+
+    Returns (fixed, steps) where steps is a list of dicts with the rung,
+    its seconds including the re-probe, the verdict after it and what it
+    disconnected. Rungs more disruptive than max_disruption ("nothing",
+    "interface" or "all") are not tried.
+    """
+    probe = probe or net_probe.probe
+    result = result or probe()
+    steps = []
+    if result["verdict"] == "up":
+        return True, steps
+    interface = interface or pick_interface()
+
+    for name, action, layers, disruption in LADDER:
+        # Once a rung has run, the failed layer may have moved; recheck against the latest result
+        if result["failed_layer"] not in layers or DISRUPTION.index(disruption) > DISRUPTION.index(max_disruption):
+            continue
+        if interface is None and name in ("reapply", "bounce-link"):
+            continue
+        logging.info(f"Trying {name} for a failure at the {result['failed_layer']} layer...")
+        start = time.monotonic()
+        with telemetry.span(f"remediate {name}", interface=interface):
+            try:
+                action(interface)
+            except (OSError, subprocess.CalledProcessError) as e:
+                logging.warning(f"{name} failed: {e}")
+                steps.append({"rung": name, "seconds": time.monotonic() - start, "verdict": result["verdict"],
+                              "disconnected": "nothing", "error": str(e)})
+                continue
+            result = wait_until_up(probe, settle)
+        steps.append({"rung": name, "seconds": time.monotonic() - start, "verdict": result["verdict"],
+                      "disconnected": interface if disruption == "interface" else disruption})
+        if result["verdict"] == "up":
+            return True, steps
+    return False, steps
+
+
+def print_steps(steps):
+    for step in steps:
+        error = f" ({step['error']})" if "error" in step else ""
+        print(f"  {step['rung']:<24} {step['seconds']:>6.1f}s  network {step['verdict']}, "
+              f"disconnected {step['disconnected']}{error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Diagnose the network and apply the least disruptive fix that works")
+    parser.add_argument("--interface", help="Interface to repair (default: the default route's)")
+    parser.add_argument("--settle", type=float, default=10.0, help="Seconds to wait for each fix to take effect")
+    parser.add_argument("--max-disruption", choices=DISRUPTION, default="all",
+                        help="Most disruptive kind of fix allowed")
+    args = parser.parse_args(argv)
+
+    result = net_probe.probe()
+    print(net_probe.format_result(result))
+    fixed, steps = remediate(result, args.settle, interface=args.interface, max_disruption=args.max_disruption)
+    print_steps(steps)
+    print("Network is up." if fixed else "Network is still not working.")
+    return 0 if fixed else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())
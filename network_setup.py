@@ -2,71 +2,164 @@
 
 import subprocess
 import os
+import sys
+import json
+import logging
+import argparse
+import ipaddress
+from uuid import NAMESPACE_URL, uuid5
+
+import net_probe
+import net_remediate
+import privileged_executor
+import telemetry
+
+PROFILES_PATH = os.path.expanduser("~/.config/archscripts/network_profiles.json")
+CONNECTIONS_DIR = "/etc/NetworkManager/system-connections"
 
 def is_root():
     return os.geteuid() == 0
 
 def check_network():
-    try:
-        response = subprocess.check_call(["ping", "-c", "1", "8.8.8.8"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return response == 0
-    except subprocess.CalledProcessError:
-        return False
+    # Link, route, gateway, DNS and TCP are probed concurrently, within one bounded timeout
+    return net_probe.probe()["verdict"] != "down"
 
-def fix_ethernet():
-    try:
-        print("Attempting to restart network service...")
-        subprocess.run(["systemctl", "restart", "NetworkManager"], check=True)
-        if check_network():
-            print("✅ Network is now up!")
-            return True
-        else:
-            print("❌ Failed to fix the network issue. Starting the setup wizard...")
-            return setup_wizard()
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e}")
+def fix_ethernet(settle=10.0, profiles_path=PROFILES_PATH, connections_dir=CONNECTIONS_DIR, diagnosis=None):
+    # Cheapest fix first; the profiles are only rewritten when nothing else worked
+    diagnosis = diagnosis or net_probe.probe()
+    print(f"Network {diagnosis['verdict']}, failing at the {diagnosis['failed_layer']} layer.")
+    fixed, steps = net_remediate.remediate(diagnosis, settle)
+    net_remediate.print_steps(steps)
+    if fixed:
+        print(f"✅ Network is now up after {steps[-1]['rung'] if steps else 'no changes'}!")
+        return True
+    if diagnosis["verdict"] != "down":
+        # Degraded means the link and routing work, so rewriting the profiles would not help
+        print("❌ Failed to fix the network issue.")
         return False
+    print("❌ Failed to fix the network issue. Starting the setup wizard...")
+    return setup_wizard(profiles_path, connections_dir)
+
+def load_profiles(path):
+    # A JSON object or list of objects: name, interface, and either method "auto"
+    # or address (CIDR), gateway and dns (a list)
+    with open(path) as f:
+        profiles = json.load(f)
+    return profiles if isinstance(profiles, list) else [profiles]
+
+def prompt_profile():
+    conn_name = input("Enter connection name (e.g., MyConnection): ")
+    if_name = input("Enter interface name (usually like eth0, enp2s0): ")
+    ip_addr = input("Enter IP Address with prefix length (e.g., 192.168.1.10/24): ")
+    gateway = input("Enter Gateway (e.g., 192.168.1.1): ")
+    dns = input("Enter DNS (e.g., 8.8.8.8,8.8.4.4): ")
 
-def setup_wizard():
+    # Basic validation
+    if not all([conn_name, if_name, ip_addr, gateway, dns]):
+        print("❌ All fields must be filled!")
+        return None
+    return {"name": conn_name, "interface": if_name, "address": ip_addr, "gateway": gateway, "dns": dns.split(",")}
+
+def render_keyfile(profile):
+    """Return the NetworkManager keyfile for a profile."""
+    # A stable uuid, so rewriting a profile updates the connection instead of duplicating it
+    uuid = uuid5(NAMESPACE_URL, f"archscripts-network/{profile['name']}")
+    lines = [
+        "[connection]",
+        f"id={profile['name']}",
+        f"uuid={uuid}",
+        "type=ethernet",
+        f"interface-name={profile['interface']}",
+        "autoconnect=true",
+        "",
+        "[ethernet]",
+        "",
+        "[ipv4]",
+    ]
+    if profile.get("method", "manual") == "auto":
+        lines.append("method=auto")
+    else:
+        address = profile["address"]
+        # A bare address would be a /32, leaving the gateway off-link; guessing a prefix could be as wrong
+        if "/" not in address:
+            raise ValueError(f"Address {address} of profile {profile['name']} needs a prefix length, e.g. {address}/24")
+        ipaddress.ip_interface(address)
+        lines += ["method=manual", f"address1={address},{profile['gateway']}"]
+    dns = profile.get("dns", [])
+    if isinstance(dns, str):
+        dns = dns.split(",")
+    if dns:
+        lines.append(f"dns={';'.join(server.strip() for server in dns)};")
+    lines += ["", "[ipv6]", "method=auto", ""]
+    return "\n".join(lines)
+
+def keyfile_path(profile, connections_dir=CONNECTIONS_DIR):
+    name = profile["name"]
+    # The name becomes a file name and an id= line, so it must not leave the directory or add lines
+    if not name or "/" in name or ".." in name or not name.isprintable():
+        raise ValueError(f"Invalid profile name {name!r}")
+    return os.path.join(connections_dir, f"{name}.nmconnection")
+
+def write_profiles(profiles, connections_dir=CONNECTIONS_DIR):
+    """Write every profile as a keyfile, then have NetworkManager load them all at once.
+
+    Every profile is checked before anything is written.
+    """
+    keyfiles = [(keyfile_path(profile, connections_dir), render_keyfile(profile)) for profile in profiles]
+    executor = privileged_executor.get_executor()
+    for path, content in keyfiles:
+        # NetworkManager ignores keyfiles readable by other users
+        executor.write_file(path, content, 0o600)
+    telemetry.run(["nmcli", "connection", "reload"], check=True)
+
+def setup_wizard(profiles_path=PROFILES_PATH, connections_dir=CONNECTIONS_DIR):
     print("---------------------------------")
     print("🛠 Network Setup Wizard")
     print("---------------------------------")
 
     try:
-        conn_name = input("Enter connection name (e.g., MyConnection): ")
-        if_name = input("Enter interface name (usually like eth0, enp2s0): ")
-        ip_addr = input("Enter IP Address (e.g., 192.168.1.10): ")
-        gateway = input("Enter Gateway (e.g., 192.168.1.1): ")
-        dns = input("Enter DNS (e.g., 8.8.8.8,8.8.4.4): ")
-
-        # Basic validation
-        if not all([conn_name, if_name, ip_addr, gateway, dns]):
-            print("❌ All fields must be filled!")
-            return False
-
-        # Configure the connection
-        subprocess.run(["nmcli", "con", "add", "type", "ethernet", "con-name", conn_name, "ifname", if_name, "ip4", ip_addr, "gw4", gateway], check=True)
-        subprocess.run(["nmcli", "con", "mod", conn_name, "ipv4.dns", dns], check=True)
-
-        # Activate the connection
-        subprocess.run(["nmcli", "con", "up", conn_name], check=True)
+        if os.path.exists(profiles_path):
+            print(f"Using the profiles in {profiles_path}")
+            profiles = load_profiles(profiles_path)
+        else:
+            profile = prompt_profile()
+            if profile is None:
+                return False
+            profiles = [profile]
+
+        write_profiles(profiles, connections_dir)
+        # Activate the first profile
+        telemetry.run(["nmcli", "connection", "up", profiles[0]["name"]], check=True)
         return check_network()
 
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, OSError, KeyError, ValueError) as e:
         print(f"Error: {e}")
         return False
 
-if __name__ == "__main__":
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the network and repair it if it is down")
+    parser.add_argument("--profiles", default=PROFILES_PATH, help="JSON connection profiles used by the setup wizard")
+    parser.add_argument("--connections-dir", default=CONNECTIONS_DIR, help="Where NetworkManager keyfiles are written")
+    parser.add_argument("--settle", type=float, default=10.0, help="Seconds to wait for each fix to take effect")
+    args = parser.parse_args(argv)
+
     if not is_root():
         print("❌ This script must be run as root")
-        exit(1)
+        return 1
 
     print("🌐 Checking network connectivity...")
-    if not check_network():
-        print("❌ Network is down. Attempting to fix...")
-        if fix_ethernet():
+    diagnosis = net_probe.probe()
+    if diagnosis["verdict"] != "up":
+        print(f"❌ Network is {diagnosis['verdict']}. Attempting to fix...")
+        # The remediation starts from this diagnosis instead of probing again
+        if fix_ethernet(args.settle, args.profiles, args.connections_dir, diagnosis):
             print("✅ Network setup successful and now up!")
         else:
             print("❌ Failed to establish the network connection. Please check your settings.")
     else:
         print("✅ Network is up. No issues detected.")
+    return 0
+
+if __name__ == "__main__":
+    telemetry.setup("network_setup", console_level=logging.WARNING)
+    sys.exit(main())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import shutil
+import logging
+import argparse
+from functools import cmp_to_key
+
+import pacman_db
+import sizes
+
+PACKAGE_CACHE = "/var/cache/pacman/pkg"
+_PACKAGE_FILE_RE = re.compile(r"^(?P<name>.+)-(?P<version>[^-]+-[^-]+)-(?P<arch>[^-]+)\.pkg\.tar(\.\w+)?$")
+
+
+def find_orphans(packages, keep_optional=True):
+    """Return dependency-installed packages that no explicitly installed package needs.
+
+    The dependency graph is walked from every explicit package, resolving
+    names through provides. With keep_optional, optdepends of kept packages
+    are kept as well. Unlike pacman -Qdt this also catches chains of
+    orphans that only depend on each other.
+    """
+    providers = pacman_db.provider_index(packages)
+    keep = set()
+    stack = [name for name, package in packages.items() if package["explicit"]]
+    while stack:
+        name = stack.pop()
+        if name in keep:
+            continue
+        keep.add(name)
+        package = packages[name]
+        deps = package["depends"] + (package["optdepends"] if keep_optional else [])
+        for dep in deps:
+            stack.extend(provider for provider in providers.get(pacman_db.dep_name(dep), []) if provider not in keep)
+    return sorted(name for name in packages if name not in keep)
+
+
+def parse_package_filename(filename):
+    """Return (name, version, arch) for a package file name, or None for other files."""
+    match = _PACKAGE_FILE_RE.match(filename)
+    if not match:
+        return None
+    return match.group("name"), match.group("version"), match.group("arch")
+
+
+def scan_cache(cache_dir=PACKAGE_CACHE):
+    """Return {(name, arch): [(version, path, size)]}, newest version first; sizes include signatures."""
+    groups = {}
+    try:
+        entries = os.scandir(cache_dir)
+    except FileNotFoundError:
+        logging.warning(f"Package cache '{cache_dir}' not found.")
+        return groups
+    with entries:
+        files = {entry.name: entry for entry in entries if entry.is_file()}
+    for filename, entry in files.items():
+        parsed = parse_package_filename(filename)
+        if parsed is None:
+            continue
+        name, version, arch = parsed
+        size = entry.stat().st_size
+        signature = files.get(f"{filename}.sig")
+        if signature is not None:
+            size += signature.stat().st_size
+        groups.setdefault((name, arch), []).append((version, entry.path, size))
+    for versions in groups.values():
+        versions.sort(key=cmp_to_key(lambda a, b: pacman_db.vercmp(b[0], a[0])))
+    return groups
+
+
+def plan_cache_cleanup(packages, cache_dir=PACKAGE_CACHE, keep=3, keep_uninstalled=1, free_target=None):
+    """Return [(path, size, reason)] of cached package files to delete.
+
+    Like paccache, the newest keep versions of installed packages and the
+    newest keep_uninstalled versions of removed ones are retained. With
+    free_target (bytes), further old versions are added oldest-first until
+    that much space would be free; the installed version is never removed.
+    """
+    plan, extra = [], []
+    for (name, _), versions in scan_cache(cache_dir).items():
+        installed = packages.get(name)
+        limit = keep if installed else keep_uninstalled
+        for position, (version, path, size) in enumerate(versions):
+            if installed and version == installed["version"]:
+                continue
+            if position >= limit:
+                reason = f"older than the newest {limit}" if installed else "not installed"
+                plan.append((path, size, reason))
+            else:
+                extra.append((position, path, size))
+
+    if free_target is not None:
+        free = shutil.disk_usage(cache_dir).free + sum(size for _, size, _ in plan)
+        # Highest positions are the oldest retained versions
+        for _, path, size in sorted(extra, key=lambda item: -item[0]):
+            if free >= free_target:
+                break
+            plan.append((path, size, "needed for the free-space target"))
+            free += size
+    return plan
+
+
+def plan_orphan_removal(packages, keep_optional=True):
+    """Return [(name, installed size)] for the orphans."""
+    return [(name, packages[name]["size"]) for name in find_orphans(packages, keep_optional)]
+
+
+def print_plan(rows, title):
+    total = sum(size for _, size, *_ in rows)
+    print(f"{title}: {len(rows)} item(s), {sizes.format_size(total)} reclaimable")
+    for name, size, *reason in rows:
+        print(f"  {sizes.format_size(size):>10}  {os.path.basename(name)}{'  (' + reason[0] + ')' if reason else ''}")
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plan removal of orphaned packages and old cached package files")
+    parser.add_argument("--db", default=pacman_db.LOCAL_DB)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    orphans_parser = subparsers.add_parser("orphans", help="List packages nothing explicit depends on")
+    orphans_parser.add_argument("--ignore-optdepends", action="store_true", help="Let optional dependencies be orphans too")
+    cache_parser = subparsers.add_parser("cache", help="Plan package cache retention")
+    cache_parser.add_argument("--cache-dir", default=PACKAGE_CACHE)
+    cache_parser.add_argument("--keep", type=int, default=3, help="Versions to keep per installed package")
+    cache_parser.add_argument("--keep-uninstalled", type=int, default=1, help="Versions to keep per removed package")
+    cache_parser.add_argument("--free-target", type=sizes.parse_size, help="Free space to reach, e.g. 10G")
+    args = parser.parse_args(argv)
+
+    packages = pacman_db.load_local(args.db)
+    if args.command == "orphans":
+        rows = plan_orphan_removal(packages, not args.ignore_optdepends)
+        print_plan(rows, "Orphaned packages")
+    else:
+        rows = plan_cache_cleanup(packages, args.cache_dir, args.keep, args.keep_uninstalled, args.free_target)
+        print_plan(rows, "Cached package files")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import re
+import bz2
+import sys
+import gzip
+import json
+import lzma
+import zlib
+import hashlib
+import logging
+import argparse
+
+import config_edit
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# pacman's DBPath; the override lets the benchmark run against a fake system
+DB_PATH = os.environ.get("ARCHSCRIPTS_PACMAN_DBPATH", "/var/lib/pacman")
+LOCAL_DB = os.path.join(DB_PATH, "local")
+SYNC_DIR = os.path.join(DB_PATH, "sync")
+PACMAN_CONF = os.environ.get("ARCHSCRIPTS_PACMAN_CONF", "/etc/pacman.conf")
+CACHE_DIR = os.path.expanduser("~/.cache/archscripts/pacman_db")
+CACHE_VERSION = 1
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_EMPTY_BLOCK = bytes(512)
+
+_DEP_NAME_RE = re.compile(r"[<>=:]")
+_DEP_RE = re.compile(r"^([^<>=:]+)(<=|>=|<|>|=)?([^:]*)")
+_ALNUM = frozenset("0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
+_DIGITS = frozenset("0123456789")
+
+
+def parse_desc(text):
+    """Return {FIELD: [values]} for a pacman desc file (%FIELD% followed by value lines)."""
+    fields, current = {}, None
+    for line in text.splitlines():
+        if line.startswith("%") and line.endswith("%") and len(line) > 2:
+            current = fields.setdefault(line[1:-1], [])
+        elif line and current is not None:
+            current.append(line)
+        else:
+            current = None
+    return fields
+
+
+def dep_name(dep):
+    """Strip version constraints and optdepends descriptions: 'python>=3.11: foo' -> 'python'."""
+    return _DEP_NAME_RE.split(dep, 1)[0].strip()
+
+
+def _package(fields):
+    return {
+        "name": fields["NAME"][0],
+        "version": fields["VERSION"][0],
+        "depends": fields.get("DEPENDS", []),
+        "optdepends": fields.get("OPTDEPENDS", []),
+        "provides": fields.get("PROVIDES", []),
+        # %REASON% 1 marks packages installed as a dependency; absent means explicit
+        "explicit": fields.get("REASON", ["0"])[0] != "1",
+        "size": int(fields.get("SIZE", fields.get("ISIZE", ["0"]))[0]),
+    }
+
+
+def _sync_package(fields):
+    package = _package(fields)
+    del package["explicit"]
+    package["filename"] = fields.get("FILENAME", [""])[0]
+    package["download_size"] = int(fields.get("CSIZE", ["0"])[0])
+    return package
+
+
+def _cache_path(source, cache_dir):
+    return os.path.join(cache_dir, hashlib.sha1(os.path.abspath(source).encode()).hexdigest() + ".json")
+
+
+def _cached(source, key, load, cache_dir):
+    # Return load() from the disk cache when key still matches, refreshing it otherwise
+    path = _cache_path(source, cache_dir) if cache_dir else None
+    if path:
+        try:
+            with open(path) as f:
+                cache = json.load(f)
+            if cache.get("version") == CACHE_VERSION and cache.get("key") == key:
+                return cache["packages"]
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+    packages = load()
+    if path:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            config_edit.write_atomic(path, json.dumps({"version": CACHE_VERSION, "key": key, "packages": packages}))
+        except OSError as e:
+            logging.debug(f"Could not write the package cache {path}: {e}")
+    return packages
+
+
+def _local_key(db_path):
+    # Installs and removals change the directory; pacman -D rewrites desc files in place
+    latest, count = 0, 0
+    with os.scandir(db_path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                count += 1
+                try:
+                    latest = max(latest, os.stat(os.path.join(entry.path, "desc")).st_mtime_ns)
+                except FileNotFoundError:
+                    pass
+    return [os.stat(db_path).st_mtime_ns, count, latest]
+
+
+def _read_local(db_path):
+    packages = {}
+    with os.scandir(db_path) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            try:
+                with open(os.path.join(entry.path, "desc"), encoding="utf-8", errors="replace") as f:
+                    package = _package(parse_desc(f.read()))
+            except (FileNotFoundError, KeyError, IndexError, ValueError):
+                logging.warning(f"Skipping unreadable package entry {entry.name}")
+                continue
+            packages[package["name"]] = package
+    return packages
+
+
+def load_local(db_path=LOCAL_DB, cache_dir=CACHE_DIR):
+    """Return {name: package dict} for every package in the local database.
+
+    The parsed database is cached on disk and reused until a package is
+    installed, removed or has its desc rewritten. cache_dir=None disables it.
+    """
+    try:
+        key = _local_key(db_path)
+    except FileNotFoundError:
+        logging.warning(f"Local pacman database '{db_path}' not found.")
+        return {}
+    return _cached(db_path, key, lambda: _read_local(db_path), cache_dir)
+
+
+def _decompress(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ValueError(f"{path} is zstd-compressed and the zstandard module is not installed")
+        # Repository databases are written without a content size, so stream them
+        return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
+    if data.startswith(b"\x1f\x8b"):
+        return gzip.decompress(data)
+    if data.startswith(b"\xfd7zXZ"):
+        return lzma.decompress(data)
+    if data.startswith(b"BZh"):
+        return bz2.decompress(data)
+    return data
+
+
+def _tar_files(data):
+    """Yield (name, content) for the regular files in an uncompressed tar archive.
+
+    Walking the 512-byte headers directly is several times faster than
+    tarfile for databases with tens of thousands of small members.
+    """
+    offset, long_name = 0, None
+    while offset + 512 <= len(data):
+        header = data[offset:offset + 512]
+        if header == _EMPTY_BLOCK:
+            break
+        size = int(header[124:136].rstrip(b"\0 ") or b"0", 8)
+        kind = header[156:157]
+        start = offset + 512
+        content = data[start:start + size]
+        offset = start + (size + 511) // 512 * 512
+        if kind == b"L":
+            long_name = content.rstrip(b"\0").decode("utf-8", errors="replace")
+            continue
+        if kind == b"x":
+            # pax extended header: records of "<length> key=value\n"
+            for record in content.decode("utf-8", errors="replace").splitlines():
+                key, _, value = record.partition(" ")[2].partition("=")
+                if key == "path":
+                    long_name = value
+            continue
+        name = long_name
+        long_name = None
+        if name is None:
+            name = header[0:100].split(b"\0", 1)[0].decode("utf-8", errors="replace")
+            prefix = header[345:500].split(b"\0", 1)[0]
+            if header[257:262] == b"ustar" and prefix:
+                name = prefix.decode("utf-8", errors="replace") + "/" + name
+        if kind in (b"0", b"\0"):
+            yield name, content
+
+
+def _read_sync(path):
+    # Entries are <name>-<version>/desc (and depends, in databases older than pacman 5)
+    texts = {}
+    for name, content in _tar_files(_decompress(path)):
+        directory, _, filename = name.partition("/")
+        if filename in ("desc", "depends"):
+            texts.setdefault(directory, []).append(content.decode("utf-8", errors="replace"))
+    packages = {}
+    for directory, parts in texts.items():
+        try:
+            package = _sync_package(parse_desc("\n\n".join(parts)))
+        except (KeyError, IndexError, ValueError):
+            logging.warning(f"Skipping unreadable entry {directory} in {path}")
+            continue
+        packages[package["name"]] = package
+    return packages
+
+
+def repo_order(sync_dir=SYNC_DIR, conf_path=PACMAN_CONF):
+    """Return the repositories in pacman.conf order, falling back to the databases present."""
+    available = sorted(name[:-len(".db")] for name in os.listdir(sync_dir) if name.endswith(".db"))
+    try:
+        with open(conf_path) as f:
+            sections = re.findall(r"^\s*\[([^\]]+)\]", f.read(), re.MULTILINE)
+    except FileNotFoundError:
+        return available
+    ordered = [name for name in sections if name in available]
+    return ordered + [name for name in available if name not in ordered]
+
+
+def load_sync(sync_dir=SYNC_DIR, cache_dir=CACHE_DIR, repos=None):
+    """Return {repo: {name: package dict}} from the sync database tarballs, in pacman.conf order."""
+    result = {}
+    try:
+        repos = repos or repo_order(sync_dir)
+    except FileNotFoundError:
+        logging.warning(f"Sync database directory '{sync_dir}' not found.")
+        return result
+    for repo in repos:
+        path = os.path.join(sync_dir, f"{repo}.db")
+        try:
+            st = os.stat(path)
+            result[repo] = _cached(path, [st.st_mtime_ns, st.st_size], lambda: _read_sync(path), cache_dir)
+        except (OSError, EOFError, ValueError, zlib.error, lzma.LZMAError) as e:
+            logging.warning(f"Could not read the {repo} database: {e}")
+    return result
+
+
+def provider_index(packages):
+    """Return {name: [package names]} covering package names and everything they provide."""
+    index = {}
+    for name, package in packages.items():
+        index.setdefault(name, []).append(name)
+        for provided in package["provides"]:
+            index.setdefault(dep_name(provided), []).append(name)
+    return index
+
+
+def _rpmvercmp(a, b):
+    # Port of libalpm's rpmvercmp: compare alternating digit and letter segments
+    if a == b:
+        return 0
+    one = two = 0
+    ptr1 = ptr2 = 0
+    while one < len(a) and two < len(b):
+        while one < len(a) and a[one] not in _ALNUM:
+            one += 1
+        while two < len(b) and b[two] not in _ALNUM:
+            two += 1
+        if one >= len(a) or two >= len(b):
+            break
+        # Differing separator lengths decide the comparison
+        if one - ptr1 != two - ptr2:
+            return -1 if one - ptr1 < two - ptr2 else 1
+
+        ptr1, ptr2 = one, two
+        isnum = a[ptr1] in _DIGITS
+        kind = _DIGITS if isnum else _ALNUM - _DIGITS
+        while ptr1 < len(a) and a[ptr1] in kind:
+            ptr1 += 1
+        while ptr2 < len(b) and b[ptr2] in kind:
+            ptr2 += 1
+        # Numeric segments are always newer than alpha segments
+        if two == ptr2:
+            return 1 if isnum else -1
+
+        seg1, seg2 = a[one:ptr1], b[two:ptr2]
+        if isnum:
+            seg1, seg2 = seg1.lstrip("0"), seg2.lstrip("0")
+            if len(seg1) != len(seg2):
+                return 1 if len(seg1) > len(seg2) else -1
+        if seg1 != seg2:
+            return 1 if seg1 > seg2 else -1
+        one, two = ptr1, ptr2
+
+    rest1, rest2 = a[one:], b[two:]
+    if not rest1 and not rest2:
+        return 0
+    # A remaining alpha segment never beats an empty string
+    if (not rest1 and not rest2[:1].isalpha()) or rest1[:1].isalpha():
+        return -1
+    return 1
+
+
+def _split_evr(version):
+    epoch, sep, rest = version.partition(":")
+    if not sep or not epoch.isdigit():
+        epoch, rest = "0", version
+    ver, sep, release = rest.rpartition("-")
+    if not sep:
+        return epoch, rest, None
+    return epoch, ver, release
+
+
+def vercmp(a, b):
+    """Compare two pacman versions ([epoch:]version[-release]); returns -1, 0 or 1 like vercmp(8)."""
+    if a == b:
+        return 0
+    epoch1, ver1, rel1 = _split_evr(a)
+    epoch2, ver2, rel2 = _split_evr(b)
+    result = _rpmvercmp(epoch1, epoch2) or _rpmvercmp(ver1, ver2)
+    if result == 0 and rel1 is not None and rel2 is not None:
+        result = _rpmvercmp(rel1, rel2)
+    return result
+
+
+def satisfies(version, op, wanted):
+    if not op:
+        return True
+    result = vercmp(version, wanted)
+    return {"=": result == 0, "<": result < 0, "<=": result <= 0, ">": result > 0, ">=": result >= 0}[op]
+
+
+def parse_dep(dep):
+    """Split 'name>=1.0' into ('name', '>=', '1.0'); the operator and version may be empty."""
+    match = _DEP_RE.match(dep)
+    return match.group(1).strip(), match.group(2) or "", match.group(3).strip()
+
+
+def satisfied(packages, providers, dep):
+    """Whether packages (indexed by provider_index as providers) satisfy a dependency string."""
+    name, op, wanted = parse_dep(dep)
+    for provider in providers.get(name, []):
+        package = packages[provider]
+        if provider == name and satisfies(package["version"], op, wanted):
+            return True
+        for provided in package["provides"]:
+            provided_name, _, provided_version = parse_dep(provided)
+            # An unversioned provide cannot satisfy a versioned dependency
+            if provided_name == name and (not op or (provided_version and satisfies(provided_version, op, wanted))):
+                return True
+    return False
+
+
+class PackageDB:
+    """Indexes over the local and sync databases, loaded on first use.
+
+    Lookups are dictionary reads, so planners can query it freely instead
+    of starting pacman.
+    """
+
+    def __init__(self, local_path=LOCAL_DB, sync_dir=SYNC_DIR, cache_dir=CACHE_DIR):
+        self.local_path = local_path
+        self.sync_dir = sync_dir
+        self.cache_dir = cache_dir
+        self._local = None
+        self._local_providers = None
+        self._sync = None
+        self._sync_providers = None
+
+    @property
+    def local(self):
+        if self._local is None:
+            self._local = load_local(self.local_path, self.cache_dir)
+            self._local_providers = provider_index(self._local)
+        return self._local
+
+    @property
+    def sync(self):
+        if self._sync is None:
+            self._sync = load_sync(self.sync_dir, self.cache_dir)
+            self._sync_providers = {}
+            # Repositories are in pacman.conf order, so the first entry is the one pacman picks
+            for repo, packages in self._sync.items():
+                for provided, names in provider_index(packages).items():
+                    self._sync_providers.setdefault(provided, []).extend((repo, name) for name in names)
+        return self._sync
+
+    def reload(self):
+        self._local = self._sync = None
+
+    def installed(self, name):
+        return name in self.local
+
+    def version(self, name):
+        package = self.local.get(name)
+        return package["version"] if package else None
+
+    def providers(self, name):
+        """Installed packages that are or provide name."""
+        self.local
+        return self._local_providers.get(dep_name(name), [])
+
+    def satisfied(self, dep):
+        """Whether an installed package satisfies a dependency string such as 'sh' or 'glibc>=2.38'."""
+        self.local
+        return satisfied(self._local, self._local_providers, dep)
+
+    def sync_package(self, name):
+        """Return (repo, package dict) for the package pacman -S name would pick, or None."""
+        self.sync
+        entries = self._sync_providers.get(dep_name(name), [])
+        exact = [entry for entry in entries if entry[1] == name]
+        if not (exact or entries):
+            return None
+        repo, package_name = (exact or entries)[0]
+        return repo, self._sync[repo][package_name]
+
+    def sync_providers(self, name):
+        self.sync
+        return list(self._sync_providers.get(dep_name(name), []))
+
+
+_db = None
+
+
+def get_db():
+    global _db
+    if _db is None:
+        _db = PackageDB()
+    return _db
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the pacman databases without running pacman")
+    parser.add_argument("--db", default=LOCAL_DB)
+    parser.add_argument("--sync-dir", default=SYNC_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="Installed packages and versions, like pacman -Q")
+    missing_parser = subparsers.add_parser("missing", help="Print the names or dependencies that are not installed")
+    missing_parser.add_argument("names", nargs="+")
+    version_parser = subparsers.add_parser("version", help="Print the installed version, exit 1 if not installed")
+    version_parser.add_argument("name")
+    provides_parser = subparsers.add_parser("provides", help="Installed and repository packages providing a name")
+    provides_parser.add_argument("name")
+    args = parser.parse_args(argv)
+
+    db = PackageDB(args.db, args.sync_dir)
+    if args.command == "list":
+        print("\n".join(f"{name} {package['version']}" for name, package in sorted(db.local.items())))
+    elif args.command == "missing":
+        missing = [name for name in args.names if not db.satisfied(name)]
+        if missing:
+            print("\n".join(missing))
+    elif args.command == "version":
+        version = db.version(args.name)
+        if version is None:
+            return 1
+        print(version)
+    elif args.command == "provides":
+        for name in db.providers(args.name):
+            print(f"local/{name} {db.local[name]['version']}")
+        for repo, name in db.sync_providers(args.name):
+            print(f"{repo}/{name} {db.sync[repo][name]['version']}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())
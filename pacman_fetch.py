@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import subprocess
+import logging
+import time
+import tempfile
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import telemetry
+
+PACMAN_CACHE_DIR = "/var/cache/pacman/pkg"
+USER_CACHE_DIR = os.path.expanduser("~/.cache/archscripts/pkg")
+
+
+def default_cache_dir():
+    """Return the pacman cache if it is writable, otherwise a per-user cache directory."""
+    if os.access(PACMAN_CACHE_DIR, os.W_OK):
+        return PACMAN_CACHE_DIR
+    return USER_CACHE_DIR
+
+
+def shared_cache_path(shared_cache):
+    # Accept both plain paths (e.g. an NFS mount) and file:// URLs
+    parsed = urllib.parse.urlparse(shared_cache)
+    if parsed.scheme == "file":
+        return urllib.request.url2pathname(parsed.path)
+    return shared_cache
+
+
+def resolve_package_urls(packages, extra_args=()):
+    """Return the URLs pacman would download for packages, dependencies included."""
+    if not packages:
+        return []
+    command = ["pacman", "-Sp", "--needed", "--noconfirm", "--print-format", "%u", *extra_args, *packages]
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    return [line.strip() for line in result.stdout.splitlines() if "://" in line]
+
+
+def write_atomic(dest, write):
+    """Have write(f) fill a temp file next to dest, then rename it over dest.
+
+    Each writer gets a temp file of its own, so two machines seeding the
+    same shared cache entry cannot interleave; the last rename wins.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=os.path.basename(dest) + ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        # mkstemp creates the file 0600; other users read the caches too
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, dest)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _copy_atomic(source, dest):
+    with open(source, "rb") as src:
+        write_atomic(dest, lambda f: shutil.copyfileobj(src, f, 1024 * 1024))
+
+
+def _download_atomic(url, dest):
+    with urllib.request.urlopen(url, timeout=60) as response:
+        write_atomic(dest, lambda f: shutil.copyfileobj(response, f, 1024 * 1024))
+
+
+def fetch_package(url, cache_dir, shared_cache=None):
+    """Place the package behind url into cache_dir, preferring the shared cache.
+
+    Returns a (filename, source, seconds) tuple where source is one of
+    "cached", "shared" or "mirror".
+    """
+    start = time.monotonic()
+    filename = os.path.basename(urllib.parse.urlparse(url).path)
+    dest = os.path.join(cache_dir, filename)
+
+    if os.path.exists(dest):
+        return filename, "cached", time.monotonic() - start
+
+    shared_dir = shared_cache_path(shared_cache) if shared_cache else None
+    if shared_dir:
+        shared_file = os.path.join(shared_dir, filename)
+        if os.path.exists(shared_file):
+            with telemetry.span("copy shared package", filename=filename):
+                _copy_atomic(shared_file, dest)
+            return filename, "shared", time.monotonic() - start
+
+    with telemetry.span("download package", filename=filename):
+        _download_atomic(url, dest)
+
+    # Seed the shared cache so the next machine finds the package there
+    if shared_dir and os.access(shared_dir, os.W_OK):
+        try:
+            _copy_atomic(dest, os.path.join(shared_dir, filename))
+        except OSError as e:
+            logging.warning(f"Could not seed shared cache with {filename}: {e}")
+
+    return filename, "mirror", time.monotonic() - start
+
+
+def prefetch_packages(urls, cache_dir, shared_cache=None, workers=4):
+    """Download urls into cache_dir concurrently.
+
+    Failures are logged and reported but never raised, since pacman will
+    simply download anything missing from the cache itself.
+    Returns a {filename: (source, seconds)} dict, source being "failed" on error.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    results = {}
+
+    def fetch(url):
+        try:
+            return fetch_package(url, cache_dir, shared_cache)
+        except OSError as e:
+            filename = os.path.basename(urllib.parse.urlparse(url).path)
+            logging.warning(f"Failed to prefetch {filename}: {e}")
+            return filename, "failed", 0.0
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for filename, source, elapsed in executor.map(fetch, urls):
+            results[filename] = (source, elapsed)
+            logging.info(f"Prefetched {filename} from {source} ({elapsed:.2f}s)")
+
+    return results
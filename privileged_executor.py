@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import atexit
+import logging
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import config_edit
+import telemetry
+
+
+class CommandError(subprocess.CalledProcessError):
+    """A failed privileged request, carrying its captured output and wall time."""
+
+    def __init__(self, returncode, cmd, stdout="", stderr="", elapsed=0.0):
+        super().__init__(returncode, cmd, output=stdout, stderr=stderr)
+        self.elapsed = elapsed
+
+    def __str__(self):
+        message = super().__str__()
+        if self.stderr:
+            message += f"\n{self.stderr.strip()}"
+        return message
+
+
+# --- Helper side: runs elevated and executes requests read from stdin ---
+
+def _op_run(request):
+    result = subprocess.run(
+        request["argv"],
+        input=request.get("input"),
+        stdin=None if request.get("input") is not None else subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+        env={**os.environ, **request.get("env", {})},
+    )
+    return result.returncode, result.stdout, result.stderr
+
+
+def _op_write_file(request):
+    config_edit.write_atomic(request["path"], request["content"], request.get("mode"))
+    return 0, "", ""
+
+
+def _op_edit_config(request):
+    changed = config_edit.apply_edits(request["path"], request["edits"], request.get("mode"), request.get("backup", True))
+    return 0, "changed" if changed else "unchanged", ""
+
+
+def _op_chmod(request):
+    os.chmod(request["path"], request["mode"])
+    return 0, "", ""
+
+
+OPERATIONS = {
+    "run": _op_run,
+    "write_file": _op_write_file,
+    "edit_config": _op_edit_config,
+    "chmod": _op_chmod,
+}
+
+
+def serve(stdin=sys.stdin, stdout=sys.stdout, workers=16):
+    """Answer JSON requests, one per line, until stdin closes.
+
+    Requests run concurrently, so responses may come back out of order;
+    each carries the id of its request.
+    """
+    write_lock = threading.Lock()
+
+    def handle(request):
+        start = time.monotonic()
+        try:
+            returncode, out, err = OPERATIONS[request["op"]](request)
+        except Exception as e:
+            returncode, out, err = 1, "", f"{type(e).__name__}: {e}"
+        response = {
+            "id": request.get("id"),
+            "returncode": returncode,
+            "stdout": out,
+            "stderr": err,
+            "elapsed": time.monotonic() - start,
+        }
+        with write_lock:
+            stdout.write(json.dumps(response) + "\n")
+            stdout.flush()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for line in stdin:
+            executor.submit(handle, json.loads(line))
+
+
+# --- Client side ---
+
+class PrivilegedExecutor:
+    """One long-lived elevated helper process taking structured requests over a pipe.
+
+    sudo is asked for once, when the helper starts; every later command or
+    file edit reuses the same process instead of spawning sudo and a shell.
+    Requests from several threads are in flight at once and matched to
+    their responses by id, so concurrent callers do not wait for each other.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.lock = threading.Lock()
+        self.next_id = 0
+        # Requests awaiting a response by id; None while no helper is reading responses
+        self.pending = None
+
+    def start(self):
+        command = [sys.executable, os.path.abspath(__file__), "--serve"]
+        if os.geteuid() != 0:
+            command = ["sudo", *command]
+        logging.info("Starting privileged helper process...")
+        # stderr is inherited so that sudo can prompt for a password
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        # A fresh table per helper, so a dying helper only fails its own requests
+        self.pending = {}
+        threading.Thread(target=self._read_responses, args=(self.process, self.pending), daemon=True).start()
+
+    def _read_responses(self, process, pending):
+        for line in process.stdout:
+            response = json.loads(line)
+            with self.lock:
+                waiter = pending.pop(response["id"], None)
+            if waiter is not None:
+                waiter.set_result(response)
+        # The helper may not be reaped yet, so mark it gone before anyone else writes to it
+        with self.lock:
+            waiters = list(pending.values())
+            pending.clear()
+            if self.pending is pending:
+                self.pending = None
+        for waiter in waiters:
+            waiter.set_result(None)
+
+    def request(self, op, **params):
+        target = params["argv"][0] if op == "run" else params.get("path", "")
+        waiter = Future()
+        with telemetry.span(f"sudo {op} {target}", op=op):
+            with self.lock:
+                if self.pending is None or self.process is None or self.process.poll() is not None:
+                    self.start()
+                self.next_id += 1
+                params.update(op=op, id=self.next_id)
+                self.pending[self.next_id] = waiter
+                process = self.process
+                process.stdin.write(json.dumps(params) + "\n")
+                process.stdin.flush()
+            response = waiter.result()
+        if response is None:
+            raise CommandError(process.poll() or 1, [op], stderr="Privileged helper exited unexpectedly")
+        return response
+
+    def _checked(self, cmd, response, check):
+        if check and response["returncode"] != 0:
+            raise CommandError(response["returncode"], cmd, response["stdout"], response["stderr"], response["elapsed"])
+        return response
+
+    def run(self, argv, check=True, input=None, env=None):
+        """Run argv elevated; returns a dict with returncode, stdout, stderr and elapsed."""
+        response = self.request("run", argv=list(argv), input=input, env=env or {})
+        return self._checked(list(argv), response, check)
+
+    def write_file(self, path, content, mode=None, check=True):
+        return self._checked(["write_file", path], self.request("write_file", path=path, content=content, mode=mode), check)
+
+    def edit_config(self, path, edits, mode=None, backup=True, check=True):
+        """Apply config_edit edits to a root-owned file; stdout is "changed" or "unchanged"."""
+        response = self.request("edit_config", path=path, edits=edits, mode=mode, backup=backup)
+        return self._checked(["edit_config", path], response, check)
+
+    def chmod(self, path, mode, check=True):
+        return self._checked(["chmod", path], self.request("chmod", path=path, mode=mode), check)
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+        with self.lock:
+            self.process = None
+            self.pending = None
+
+
+_executor = None
+
+
+def get_executor():
+    """Return the shared executor, starting its helper on first use."""
+    global _executor
+    if _executor is None:
+        _executor = PrivilegedExecutor()
+        atexit.register(_executor.close)
+    return _executor
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--serve"]:
+        serve()
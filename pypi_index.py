@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import difflib
+import logging
+import argparse
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import venv_index
+
+DB_PATH = os.path.expanduser("~/.cache/archscripts/pypi_index.sqlite3")
+# A URL of a PEP 691 simple index, or a local snapshot (JSON or HTML) for offline hosts
+DEFAULT_SOURCE = os.environ.get("ARCHSCRIPTS_PYPI_INDEX", "https://pypi.org/simple/")
+MAX_AGE = 24 * 3600
+SCHEMA_VERSION = "2"
+
+
+def connect(db_path=DB_PATH):
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    schema = _get_meta(conn, "schema")
+    if schema != SCHEMA_VERSION:
+        # The database only caches the simple index, so an old layout is rebuilt rather than migrated
+        conn.executescript("DROP TABLE IF EXISTS names; DROP TABLE IF EXISTS packages; DELETE FROM meta;")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS packages (
+            id INTEGER PRIMARY KEY,
+            normalized TEXT NOT NULL UNIQUE,
+            name TEXT NOT NULL,
+            serial INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    try:
+        # External content: the index stores only trigrams and reads names back from packages by id
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5("
+                     "normalized, content='packages', content_rowid='id', tokenize='trigram')")
+    except sqlite3.OperationalError:
+        # SQLite older than 3.34 has no trigram tokenizer; searches fall back to LIKE
+        logging.info("SQLite lacks the FTS5 trigram tokenizer, fuzzy search will be slower.")
+    if schema != SCHEMA_VERSION:
+        with conn:
+            _set_meta(conn, "schema", SCHEMA_VERSION)
+    return conn
+
+
+def _has_fts(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'names'").fetchone() is not None
+
+
+def _get_meta(conn, key):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_meta(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+def parse_snapshot(body, content_type=""):
+    """Return ({normalized: (name, serial)}, index serial) from a simple-index body.
+
+    PEP 691 project lists carry no summaries, so none are kept.
+    """
+    text = body.decode("utf-8", errors="replace") if isinstance(body, bytes) else body
+    if "json" in content_type or text.lstrip().startswith("{"):
+        data = json.loads(text)
+        projects = {}
+        for project in data.get("projects", []):
+            name = project["name"]
+            projects[venv_index.normalize_name(name)] = (name, project.get("_last-serial", 0))
+        return projects, data.get("meta", {}).get("_last-serial", 0)
+
+    names = re.findall(r"<a\b[^>]*>([^<]+)</a>", text)
+    return {venv_index.normalize_name(name): (name.strip(), 0) for name in names}, 0
+
+
+def _fetch(source, conn):
+    # Returns (body, content_type) or None when the snapshot has not changed
+    parsed = urllib.parse.urlparse(source)
+    if parsed.scheme in ("", "file"):
+        path = urllib.request.url2pathname(parsed.path) if parsed.scheme else source
+        version = str(os.stat(path).st_mtime_ns)
+        if _get_meta(conn, "version") == version:
+            return None
+        with open(path, "rb") as f:
+            body = f.read()
+        _set_meta(conn, "version", version)
+        return body, ""
+
+    request = urllib.request.Request(source, headers={"Accept": "application/vnd.pypi.simple.v1+json"})
+    etag = _get_meta(conn, "etag")
+    if etag:
+        request.add_header("If-None-Match", etag)
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            body = response.read()
+            if response.headers.get("ETag"):
+                _set_meta(conn, "etag", response.headers["ETag"])
+            return body, response.headers.get("Content-Type", "")
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise
+
+
+def refresh(source=DEFAULT_SOURCE, db_path=DB_PATH):
+    """Update the index from source, touching only rows that changed.
+
+    Unchanged snapshots are detected with ETag (HTTP) or mtime (files) and
+    cost one conditional request. Returns the number of changed rows.
+    """
+    conn = connect(db_path)
+    with conn:
+        if _get_meta(conn, "source") != source:
+            conn.execute("DELETE FROM meta WHERE key != 'schema'")
+            _set_meta(conn, "source", source)
+        fetched = _fetch(source, conn)
+        _set_meta(conn, "refreshed", time.time())
+        if fetched is None:
+            logging.info("Package index is up to date.")
+            return 0
+
+        projects, serial = parse_snapshot(*fetched)
+        if serial and str(serial) == _get_meta(conn, "serial"):
+            return 0
+
+        existing = {row[0]: (row[1], (row[2], row[3])) for row in conn.execute("SELECT normalized, id, name, serial FROM packages")}
+        removed = [(existing[key][0], key) for key in existing.keys() - projects.keys()]
+        added = [(key, *value) for key, value in projects.items() if key not in existing]
+        changed = [(*value, key) for key, value in projects.items() if key in existing and existing[key][1] != value]
+        # Only additions and removals touch the name index; a renamed or reserialed row keeps its normalized name
+        if _has_fts(conn):
+            conn.executemany("INSERT INTO names (names, rowid, normalized) VALUES ('delete', ?, ?)", removed)
+        conn.executemany("DELETE FROM packages WHERE id = ?", [(row_id,) for row_id, _ in removed])
+        conn.executemany("UPDATE packages SET name = ?, serial = ? WHERE normalized = ?", changed)
+        last_id = conn.execute("SELECT coalesce(max(id), 0) FROM packages").fetchone()[0]
+        conn.executemany("INSERT INTO packages (normalized, name, serial) VALUES (?, ?, ?)", added)
+        if _has_fts(conn):
+            # New rows are numbered past every existing one
+            conn.execute("INSERT INTO names (rowid, normalized) SELECT id, normalized FROM packages WHERE id > ?", (last_id,))
+        _set_meta(conn, "serial", serial)
+    logging.info(f"Package index refreshed: {len(added)} added, {len(changed)} changed, {len(removed)} removed.")
+    return len(added) + len(changed) + len(removed)
+
+
+def ensure_fresh(source=DEFAULT_SOURCE, db_path=DB_PATH, max_age=MAX_AGE):
+    conn = connect(db_path)
+    refreshed = _get_meta(conn, "refreshed")
+    current = _get_meta(conn, "source") == source
+    conn.close()
+    if not current or refreshed is None or time.time() - float(refreshed) > max_age:
+        refresh(source, db_path)
+
+
+def _prefix_search(conn, query, limit):
+    upper = query[:-1] + chr(ord(query[-1]) + 1)
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM packages WHERE normalized >= ? AND normalized < ? ORDER BY length(normalized), normalized LIMIT ?",
+        (query, upper, limit))]
+
+
+def _typo_candidates(conn, query, limit):
+    """Names of similar length that share the query's first letter or first bigram, for typos no trigram survives."""
+    first = query[0]
+    return conn.execute(
+        "SELECT name, normalized FROM packages "
+        "WHERE ((normalized >= ? AND normalized < ?) OR instr(normalized, ?) > 0) "
+        "AND length(normalized) BETWEEN ? AND ? LIMIT ?",
+        (first, chr(ord(first) + 1), query[:2], len(query) - 2, len(query) + 2, limit)).fetchall()
+
+
+def _fuzzy_candidates(conn, query, limit):
+    if _has_fts(conn) and len(query) >= 3:
+        grams = {query[i:i + 3] for i in range(len(query) - 2)}
+        match = " OR ".join('"' + gram.replace('"', '""') + '"' for gram in grams)
+        rows = conn.execute(
+            "SELECT p.name, p.normalized FROM names JOIN packages p ON p.id = names.rowid "
+            "WHERE names MATCH ? ORDER BY bm25(names) LIMIT ?", (match, limit)).fetchall()
+    else:
+        rows = conn.execute("SELECT name, normalized FROM packages WHERE normalized LIKE ? LIMIT ?",
+                            (f"%{query}%", limit)).fetchall()
+    if len(rows) < limit:
+        seen = {row[0] for row in rows}
+        rows += [row for row in _typo_candidates(conn, query, limit) if row[0] not in seen][:limit - len(rows)]
+    return rows
+
+
+def search(query, limit=20, db_path=DB_PATH):
+    """Return package names: prefix matches first, then the closest fuzzy matches."""
+    query = venv_index.normalize_name(query.strip())
+    if not query:
+        return []
+    conn = connect(db_path)
+    try:
+        results = _prefix_search(conn, query, limit)
+        seen = set(results)
+        if len(results) < limit:
+            candidates = [row for row in _fuzzy_candidates(conn, query, 500) if row[0] not in seen]
+            ranked = sorted(candidates, key=lambda row: -difflib.SequenceMatcher(None, query, row[1]).ratio())
+            results += [name for name, _ in ranked[:limit - len(results)]]
+        return results
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search a local index of PyPI package names")
+    parser.add_argument("query", nargs="?")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="Simple index URL or local snapshot file")
+    parser.add_argument("--refresh", action="store_true", help="Refresh the index before searching")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.refresh:
+        refresh(args.source)
+    else:
+        ensure_fresh(args.source)
+    if args.query:
+        for name in search(args.query, args.limit):
+            print(name)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+"""Byte sizes as people write and read them."""
+
+import re
+import argparse
+
+_SIZE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?", re.IGNORECASE)
+
+
+def parse_size(text):
+    """Return the bytes in a size like 512, 100M, 1.5GiB or 10G; usable as an argparse type."""
+    match = _SIZE_RE.fullmatch(text.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid size '{text}'")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** " KMGT".index(unit.upper() or " "))
+
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+import logging
+import time
+
+
+def input_hash(inputs):
+    """Return a stable content hash of JSON-serialisable step inputs."""
+    payload = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class StepJournal:
+    """Append-only JSON-lines record of pipeline steps and their results.
+
+    Only the latest entry of every step matters: a step is done when that
+    entry succeeded with the same input hash as the current run. A journal
+    without a path lives in memory only, which dry runs use.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._load()
+
+    def _load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A run killed mid-write leaves a truncated last line
+                        logging.warning(f"Ignoring corrupt journal line in {self.path}")
+                        continue
+                    self.entries[entry["step"]] = entry
+        except FileNotFoundError:
+            pass
+
+    def is_done(self, step, key):
+        entry = self.entries.get(step)
+        return entry is not None and entry["key"] == key and entry["status"] == "ok"
+
+    def last_result(self, step):
+        entry = self.entries.get(step)
+        return entry["result"] if entry else None
+
+    def last_elapsed(self, step):
+        entry = self.entries.get(step)
+        return entry["elapsed"] if entry else None
+
+    def record(self, step, key, status, elapsed, result=None):
+        entry = {
+            "step": step,
+            "key": key,
+            "status": status,
+            "finished": time.time(),
+            "elapsed": round(elapsed, 3),
+            "result": result,
+        }
+        self.entries[step] = entry
+        if self.path is None:
+            return
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def reset(self):
+        self.entries = {}
+        if self.path is None:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import time
+import shutil
+import logging
+import argparse
+import datetime
+import email.utils
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import mirror_rank
+import pacman_db
+import pacman_fetch
+import privileged_executor
+import sizes
+import telemetry
+
+# Private copies of the sync databases: planning and prefetching never touch
+# /var/lib/pacman, so a prefetch hours before the upgrade cannot leave the
+# system half-synced
+SYNC_DIR = os.path.expanduser("~/.cache/archscripts/sync")
+# Databases younger than this are reused, so an apply installs exactly what was prefetched
+MAX_DB_AGE = 24 * 3600
+# Installed first and on its own, so the rest is verified with current keys
+FIRST_PACKAGES = ("archlinux-keyring",)
+
+
+def read_repos(conf_path=pacman_db.PACMAN_CONF):
+    """Return [(repo, [server URLs])] in pacman.conf order, following Include lines."""
+    repos, current = [], None
+    try:
+        with open(conf_path) as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        logging.warning(f"{conf_path} not found.")
+        return repos
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        section = re.match(r"^\[(.+)\]$", line)
+        if section:
+            current = None if section.group(1) == "options" else (section.group(1), [])
+            if current:
+                repos.append(current)
+            continue
+        key, _, value = (part.strip() for part in line.partition("="))
+        if current is None or not value:
+            continue
+        if key == "Server":
+            current[1].append(value)
+        elif key == "Include":
+            current[1].extend(mirror_rank.read_servers(value, active_only=True))
+    return repos
+
+
+def read_ignored(conf_path=pacman_db.PACMAN_CONF):
+    """Return the IgnorePkg names from pacman.conf."""
+    ignored = set()
+    try:
+        with open(conf_path) as f:
+            for line in f:
+                key, _, value = line.split("#", 1)[0].partition("=")
+                if key.strip() == "IgnorePkg":
+                    ignored.update(value.split())
+    except FileNotFoundError:
+        pass
+    return ignored
+
+
+def repo_url(server, repo, filename=""):
+    url = server.replace("$repo", repo).replace("$arch", os.uname().machine).rstrip("/")
+    return f"{url}/{filename}" if filename else url
+
+
+def _download_db(url, dest):
+    # Conditional request: an unchanged database costs one round trip
+    request = urllib.request.Request(url)
+    if os.path.exists(dest):
+        request.add_header("If-Modified-Since", email.utils.formatdate(os.stat(dest).st_mtime, usegmt=True))
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            pacman_fetch.write_atomic(dest, lambda f: shutil.copyfileobj(response, f, 1024 * 1024))
+            modified = response.headers.get("Last-Modified")
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return False
+        raise
+    if modified:
+        timestamp = email.utils.parsedate_to_datetime(modified).timestamp()
+        os.utime(dest, (timestamp, timestamp))
+    return True
+
+
+def _download_signature(url, dest):
+    # Most repositories do not sign their databases; an old signature must not outlive its database
+    try:
+        with urllib.request.urlopen(url, timeout=60) as response:
+            pacman_fetch.write_atomic(dest, lambda f: shutil.copyfileobj(response, f))
+    except OSError:
+        try:
+            os.remove(dest)
+        except FileNotFoundError:
+            pass
+
+
+@telemetry.timed("refresh databases")
+def refresh_databases(repos, sync_dir=SYNC_DIR, max_age=MAX_DB_AGE):
+    """Download each repository's database into sync_dir unless it was checked within max_age seconds.
+
+    Each repository is tried against its servers in order, and the one
+    that answers is moved to the front of its list. max_age=0 always asks
+    the mirror.
+    """
+    os.makedirs(sync_dir, exist_ok=True)
+    marker = os.path.join(sync_dir, ".checked")
+    if max_age and os.path.exists(marker) and time.time() - os.stat(marker).st_mtime < max_age:
+        logging.info(f"Reusing the package databases in {sync_dir}.")
+        return False
+    changed = False
+    for repo, servers in repos:
+        for i, server in enumerate(servers):
+            url = repo_url(server, repo, f"{repo}.db")
+            dest = os.path.join(sync_dir, f"{repo}.db")
+            try:
+                if _download_db(url, dest):
+                    _download_signature(f"{url}.sig", f"{dest}.sig")
+                    changed = True
+                # Packages are then downloaded from the server that answered
+                servers.insert(0, servers.pop(i))
+                break
+            except (OSError, ValueError) as e:
+                logging.warning(f"Could not download {url}: {e}")
+        else:
+            raise OSError(f"No server for the {repo} repository could be reached")
+    with open(marker, "w"):
+        pass
+    return changed
+
+
+def plan_upgrade(local, sync, ignored=()):
+    """Return the entries an upgrade would download, in repository order.
+
+    Each entry is a dict with name, repo, old (None for a new dependency),
+    new, filename, download_size and size. Packages only pull in new
+    dependencies that nothing installed or upgraded already provides.
+    """
+    by_name = {}
+    for repo, packages in reversed(list(sync.items())):
+        for name, package in packages.items():
+            by_name[name] = (repo, package)
+    sync_providers = {}
+    for repo, packages in sync.items():
+        for provided, names in pacman_db.provider_index(packages).items():
+            sync_providers.setdefault(provided, []).extend((repo, name) for name in names)
+
+    entries = {}
+    for name, installed in local.items():
+        if name in ignored or name not in by_name:
+            continue
+        repo, package = by_name[name]
+        if pacman_db.vercmp(package["version"], installed["version"]) > 0:
+            entries[name] = _entry(repo, package, installed["version"])
+
+    # New dependencies of upgraded packages, resolved like pacman would: exact name first, then providers
+    state = dict(local, **{name: by_name[name][1] for name in entries})
+    providers = pacman_db.provider_index(state)
+    stack = [entry["package"] for entry in entries.values()]
+    while stack:
+        for dep in stack.pop()["depends"]:
+            if pacman_db.satisfied(state, providers, dep):
+                continue
+            name = pacman_db.dep_name(dep)
+            candidates = [by_name[name]] if name in by_name else \
+                [(repo, sync[repo][provider]) for repo, provider in sync_providers.get(name, [])]
+            if not candidates:
+                logging.warning(f"Nothing in the repositories provides {dep}.")
+                continue
+            repo, package = candidates[0]
+            entries[package["name"]] = _entry(repo, package, None)
+            state[package["name"]] = package
+            providers = pacman_db.provider_index(state)
+            stack.append(package)
+    repo_rank = {repo: i for i, repo in enumerate(sync)}
+    return sorted(entries.values(), key=lambda entry: (repo_rank[entry["repo"]], entry["name"]))
+
+
+def _entry(repo, package, old):
+    return {
+        "name": package["name"],
+        "repo": repo,
+        "old": old,
+        "new": package["version"],
+        "filename": package["filename"],
+        "download_size": package["download_size"],
+        "size": package["size"],
+        "package": package,
+    }
+
+
+def pending_download(entries, cache_dirs):
+    """Return the bytes still to download, counting packages already in any of cache_dirs as free."""
+    return sum(entry["download_size"] for entry in entries
+               if not any(os.path.exists(os.path.join(d, entry["filename"])) for d in cache_dirs))
+
+
+def _broken(state, providers, names):
+    return {(name, dep) for name in names if name in state for dep in state[name]["depends"]
+            if not pacman_db.satisfied(state, providers, dep)}
+
+
+def _with_packages(state, providers, packages):
+    # Stale provider entries are harmless: satisfied() rechecks each provider's current provides
+    state = dict(state, **{package["name"]: package for package in packages})
+    providers = dict(providers)
+    for provided, names in pacman_db.provider_index({package["name"]: package for package in packages}).items():
+        providers[provided] = providers.get(provided, []) + names
+    return state, providers
+
+
+def plan_chunks(local, entries, chunk_size=50):
+    """Split entries into ordered chunks, each leaving every dependency satisfied once installed.
+
+    A package stays with the upgrades or new packages it needs, i.e.
+    dependencies the installed system does not satisfy. Groups are added to
+    a chunk until it holds chunk_size packages and installing it breaks no
+    dependency that was intact before; chunk_size <= 0 means one chunk.
+    """
+    if not entries:
+        return []
+    if chunk_size <= 0:
+        return [entries]
+    providers = pacman_db.provider_index({entry["name"]: entry["package"] for entry in entries})
+    local_providers = pacman_db.provider_index(local)
+    parent = {entry["name"]: entry["name"] for entry in entries}
+
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    for entry in entries:
+        for dep in entry["package"]["depends"]:
+            if pacman_db.satisfied(local, local_providers, dep):
+                continue
+            for provider in providers.get(pacman_db.dep_name(dep), []):
+                parent[find(provider)] = find(entry["name"])
+
+    groups = {}
+    for entry in entries:
+        groups.setdefault(find(entry["name"]), []).append(entry)
+    repo_rank = {repo: i for i, repo in enumerate(dict.fromkeys(entry["repo"] for entry in entries))}
+    ordered = sorted(groups.values(), key=lambda group: (
+        not any(entry["name"] in FIRST_PACKAGES for entry in group),
+        min(repo_rank[entry["repo"]] for entry in group),
+        min(entry["name"] for entry in group)))
+
+    # Only a chunk's own packages and whatever depends on them can break
+    dependents = {}
+    for package in [*local.values(), *(entry["package"] for entry in entries)]:
+        for dep in package["depends"]:
+            dependents.setdefault(pacman_db.dep_name(dep), set()).add(package["name"])
+
+    state, providers = local, local_providers
+    chunks, chunk = [], []
+    for i, group in enumerate(ordered):
+        chunk += group
+        first = any(entry["name"] in FIRST_PACKAGES for entry in group)
+        if not first and len(chunk) < chunk_size and i < len(ordered) - 1:
+            continue
+        affected = set()
+        for entry in chunk:
+            names = [entry["name"], *entry["package"]["provides"], *state.get(entry["name"], {}).get("provides", [])]
+            affected.add(entry["name"])
+            affected.update(*(dependents.get(pacman_db.dep_name(name), ()) for name in names))
+        candidate, candidate_providers = _with_packages(state, providers, [entry["package"] for entry in chunk])
+        if _broken(candidate, candidate_providers, affected) - _broken(state, providers, affected) and i < len(ordered) - 1:
+            # Keep growing the chunk until what it breaks is fixed by later groups
+            continue
+        chunks.append(chunk)
+        state, providers, chunk = candidate, candidate_providers, []
+    return chunks
+
+
+def print_plan(entries, chunks, cache_dirs):
+    download = pending_download(entries, cache_dirs)
+    new = [entry for entry in entries if entry["old"] is None]
+    print(f"{len(entries) - len(new)} upgrade(s), {len(new)} new dependenc{'y' if len(new) == 1 else 'ies'}, "
+          f"{sizes.format_size(download)} to download in {len(chunks)} chunk(s)")
+    for number, chunk in enumerate(chunks, 1):
+        print(f"Chunk {number}:")
+        for entry in chunk:
+            print(f"  {entry['repo']}/{entry['name']:<40} {entry['old'] or '(new)':>20} -> {entry['new']:<20} "
+                  f"{sizes.format_size(entry['download_size']):>10}")
+
+
+def package_urls(entries, repos):
+    servers = dict(repos)
+    return [repo_url(servers[entry["repo"]][0], entry["repo"], entry["filename"])
+            for entry in entries if servers.get(entry["repo"])]
+
+
+def load_plan(conf_path=pacman_db.PACMAN_CONF, sync_dir=SYNC_DIR, max_age=MAX_DB_AGE, chunk_size=50):
+    """Refresh the private databases if needed and return (repos, entries, chunks)."""
+    repos = read_repos(conf_path)
+    refresh_databases(repos, sync_dir, max_age)
+    sync = pacman_db.load_sync(sync_dir, repos=[repo for repo, _ in repos])
+    local = pacman_db.load_local()
+    entries = plan_upgrade(local, sync, read_ignored(conf_path))
+    return repos, entries, plan_chunks(local, entries, chunk_size)
+
+
+def prefetch(entries, repos, cache_dir=None, shared_cache=None, workers=4):
+    """Download every planned package into cache_dir; returns pacman_fetch's report."""
+    cache_dir = cache_dir or pacman_fetch.default_cache_dir()
+    return pacman_fetch.prefetch_packages(package_urls(entries, repos), cache_dir, shared_cache, workers)
+
+
+def _cachedir_args(cache_dir):
+    if cache_dir == pacman_fetch.PACMAN_CACHE_DIR:
+        return []
+    return ["--cachedir", cache_dir, "--cachedir", pacman_fetch.PACMAN_CACHE_DIR]
+
+
+def install_databases(repos, sync_dir=SYNC_DIR, system_dir=pacman_db.SYNC_DIR):
+    """Install the private databases, with their signatures, as the system's sync databases.
+
+    A system database newer than the private copy was synced after the
+    plan was made and is kept; pacman then downloads whatever it adds.
+    Returns the repositories whose database was installed.
+    """
+    files, stale, installed = [], [], []
+    for repo, _ in repos:
+        private = os.path.join(sync_dir, f"{repo}.db")
+        system = os.path.join(system_dir, f"{repo}.db")
+        if os.path.exists(system) and os.stat(system).st_mtime > os.stat(private).st_mtime:
+            logging.info(f"Keeping {system}, which is newer than the planned copy.")
+            continue
+        files.append(private)
+        installed.append(repo)
+        # pacman checks a database against the .sig beside it, so a stale one fails the upgrade
+        if os.path.exists(f"{private}.sig"):
+            files.append(f"{private}.sig")
+        elif os.path.exists(f"{system}.sig"):
+            stale.append(f"{system}.sig")
+    executor = privileged_executor.get_executor()
+    if files:
+        executor.run(["install", "-m", "0644", *files, f"{system_dir}/"])
+    if stale:
+        executor.run(["rm", "-f", "--", *stale])
+    return installed
+
+
+@telemetry.timed("apply update")
+def apply(chunks, repos, sync_dir=SYNC_DIR, cache_dir=None, shared_cache=None, workers=4, dry_run=False):
+    """Install chunks in order while later chunks are still downloading.
+
+    The private databases are installed as the system's sync databases
+    first (see install_databases), so pacman sees exactly the planned
+    versions and finds them in the cache. A final pacman -Su picks up anything the chunks left, such
+    as replaced packages.
+    """
+    cache_dir = cache_dir or pacman_fetch.default_cache_dir()
+    if dry_run:
+        for number, chunk in enumerate(chunks, 1):
+            logging.info(f"[Dry Run] Skipping chunk {number}: {' '.join(entry['name'] for entry in chunk)}")
+        return
+
+    executor = privileged_executor.get_executor()
+    install_databases(repos, sync_dir)
+    pacman = ["pacman", "-S", "--noconfirm", *_cachedir_args(cache_dir)]
+
+    # One background worker downloads chunk by chunk, each with parallel downloads
+    with ThreadPoolExecutor(max_workers=1) as downloader:
+        downloads = [downloader.submit(prefetch, chunk, repos, cache_dir, shared_cache, workers) for chunk in chunks]
+        for number, (chunk, download) in enumerate(zip(chunks, downloads), 1):
+            download.result()
+            # New dependencies are left for pacman to pull in, so they stay marked as dependencies
+            names = [entry["name"] for entry in chunk if entry["old"] is not None]
+            logging.info(f"Installing chunk {number}/{len(chunks)}: {' '.join(names)}")
+            with telemetry.span("install chunk", chunk=number, packages=len(names)):
+                executor.run(pacman + names)
+    executor.run(["pacman", "-Su", "--noconfirm", *_cachedir_args(cache_dir)])
+
+
+def update(chunk_size=50, max_age=3600, shared_cache=None, workers=4, dry_run=False):
+    """Plan, report and apply a full system upgrade with downloads overlapping installation."""
+    mirror_rank.ensure_ranked(dry_run=dry_run)
+    repos, entries, chunks = load_plan(max_age=max_age, chunk_size=chunk_size)
+    cache_dir = pacman_fetch.default_cache_dir()
+    print_plan(entries, chunks, [cache_dir, pacman_fetch.PACMAN_CACHE_DIR])
+    if not entries:
+        print("The system is up to date.")
+        return
+    apply(chunks, repos, cache_dir=cache_dir, shared_cache=shared_cache, workers=workers, dry_run=dry_run)
+
+
+def seconds_until(clock, now=None):
+    """Seconds from now until the next HH:MM."""
+    now = now or datetime.datetime.now()
+    hour, minute = (int(part) for part in clock.split(":"))
+    start = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if start <= now:
+        start += datetime.timedelta(days=1)
+    return (start - now).total_seconds()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plan, prefetch and apply system upgrades in dependency-safe chunks")
+    parser.add_argument("--conf", default=pacman_db.PACMAN_CONF)
+    parser.add_argument("--sync-dir", default=SYNC_DIR, help="Where the private database copies are kept")
+    parser.add_argument("--cache-dir", help="Package cache to download into (default: pacman's if writable)")
+    parser.add_argument("--shared-cache", help="Shared package cache directory or file:// URL")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel downloads")
+    parser.add_argument("--chunk-size", type=int, default=50, help="Packages per transaction, 0 for one transaction")
+    parser.add_argument("--max-age", type=int, default=MAX_DB_AGE, help="Seconds before the databases are refreshed")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("plan", help="Show pending upgrades, download size and chunks")
+    prefetch_parser = subparsers.add_parser("prefetch", help="Download pending upgrades without installing them")
+    prefetch_parser.add_argument("--start-at", metavar="HH:MM", help="Wait until this time of day first, e.g. 02:30")
+    apply_parser = subparsers.add_parser("apply", help="Install pending upgrades chunk by chunk")
+    apply_parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.command == "prefetch" and args.start_at:
+        delay = seconds_until(args.start_at)
+        logging.info(f"Waiting {delay / 3600:.1f}h until {args.start_at} to start downloading...")
+        time.sleep(delay)
+    if args.command != "plan":
+        mirror_rank.ensure_ranked()
+
+    repos, entries, chunks = load_plan(args.conf, args.sync_dir, args.max_age, args.chunk_size)
+    cache_dir = args.cache_dir or pacman_fetch.default_cache_dir()
+    print_plan(entries, chunks, [cache_dir, pacman_fetch.PACMAN_CACHE_DIR])
+    if args.command == "prefetch":
+        results = prefetch(entries, repos, cache_dir, args.shared_cache, args.workers)
+        failed = [name for name, (source, _) in results.items() if source == "failed"]
+        print(f"Prefetched {len(results) - len(failed)} package(s), {len(failed)} failed.")
+        return 1 if failed else 0
+    if args.command == "apply" and entries:
+        apply(chunks, repos, args.sync_dir, cache_dir, args.shared_cache, args.workers, args.dry_run)
+    return 0
+
+
+if __name__ == "__main__":
+    telemetry.setup("system_update")
+    sys.exit(main())
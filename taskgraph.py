@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import step_journal
+import telemetry
+
+
+class Task:
+    """A provisioning step, the steps it depends on and the resources it holds.
+
+    Two tasks that name the same resource (e.g. "pacman-db" or a config
+    path) never run at the same time; everything else may run concurrently.
+    """
+
+    def __init__(self, name, func, deps=(), resources=(), inputs=None, estimate=0.1):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.resources = frozenset(resources)
+        self.inputs = inputs or {}
+        self.estimate = estimate
+
+
+def topological_order(tasks):
+    """Return tasks ordered so every task comes after its dependencies."""
+    by_name = {task.name: task for task in tasks}
+    order, state = [], {}
+
+    def visit(task):
+        if state.get(task.name) == "done":
+            return
+        if state.get(task.name) == "visiting":
+            raise ValueError(f"Dependency cycle involving '{task.name}'")
+        state[task.name] = "visiting"
+        for dep in task.deps:
+            if dep not in by_name:
+                raise ValueError(f"Task '{task.name}' depends on unknown task '{dep}'")
+            visit(by_name[dep])
+        state[task.name] = "done"
+        order.append(task)
+
+    for task in tasks:
+        visit(task)
+    return order
+
+
+def task_keys(tasks):
+    # A task's key covers its own inputs and the keys of its dependencies
+    keys = {}
+    for task in topological_order(tasks):
+        keys[task.name] = step_journal.input_hash({
+            "inputs": task.inputs,
+            "deps": [keys[dep] for dep in sorted(task.deps)],
+        })
+    return keys
+
+
+def estimated_durations(tasks, journal):
+    durations = {}
+    for task in tasks:
+        elapsed = journal.last_elapsed(task.name) if journal is not None else None
+        durations[task.name] = elapsed if elapsed is not None else task.estimate
+    return durations
+
+
+def simulate_schedule(tasks, durations, workers=4):
+    """Simulate the scheduler and return ([(name, start, end)], critical_path_seconds)."""
+    order = topological_order(tasks)
+
+    # Longest chain of dependencies, ignoring workers and resources
+    finish = {}
+    for task in order:
+        start = max((finish[dep] for dep in task.deps), default=0.0)
+        finish[task.name] = start + durations[task.name]
+    critical_path = max(finish.values(), default=0.0)
+
+    now, done, running, schedule = 0.0, {}, [], []
+    pending = list(order)
+    while pending or running:
+        held = set().union(*(task.resources for task, _ in running)) if running else set()
+        for task in list(pending):
+            if len(running) >= workers:
+                break
+            if all(dep in done for dep in task.deps) and not (task.resources & held):
+                end = now + durations[task.name]
+                running.append((task, end))
+                held |= task.resources
+                pending.remove(task)
+                schedule.append((task.name, now, end))
+        if not running:
+            raise ValueError("Tasks cannot be scheduled")
+        task, now = min(running, key=lambda item: item[1])
+        running.remove((task, now))
+        done[task.name] = now
+    return schedule, critical_path
+
+
+def print_schedule(tasks, journal=None, workers=4):
+    durations = estimated_durations(tasks, journal)
+    schedule, critical_path = simulate_schedule(tasks, durations, workers)
+    print(f"{'Task':<40} {'Start':>8} {'End':>8}")
+    for name, start, end in sorted(schedule, key=lambda item: (item[1], item[0])):
+        print(f"{name:<40} {start:>7.2f}s {end:>7.2f}s")
+    makespan = max((end for _, _, end in schedule), default=0.0)
+    print(f"Estimated total: {makespan:.2f}s with {workers} workers, critical path {critical_path:.2f}s")
+    return makespan, critical_path
+
+
+class _StepFailed(Exception):
+    def __init__(self, error, elapsed):
+        super().__init__(str(error))
+        self.error = error
+        self.elapsed = elapsed
+
+
+def _timed(func, name):
+    start = time.monotonic()
+    try:
+        with telemetry.span(f"step {name}"):
+            result = func()
+    except Exception as e:
+        raise _StepFailed(e, time.monotonic() - start)
+    return result, time.monotonic() - start
+
+
+def run_graph(tasks, journal, workers=4):
+    """Run tasks in a thread pool, honouring dependencies and resource locks.
+
+    Tasks the journal shows as done with the same key are skipped. On the
+    first failure no new tasks are started; running ones are awaited and the
+    error is re-raised.
+    """
+    keys = task_keys(tasks)
+    pending = topological_order(tasks)
+    done, running, held = set(), {}, set()
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while True:
+            progressed = error is None
+            while progressed:
+                # Skipping a task can unblock others, so rescan until nothing changes
+                progressed = False
+                for task in list(pending):
+                    if not all(dep in done for dep in task.deps) or task.resources & held:
+                        continue
+                    if journal.is_done(task.name, keys[task.name]):
+                        logging.info(f"Skipping step '{task.name}': unchanged since its last successful run.")
+                        pending.remove(task)
+                        done.add(task.name)
+                        progressed = True
+                        continue
+                    if len(running) >= workers:
+                        continue
+                    logging.info(f"Running step '{task.name}'...")
+                    pending.remove(task)
+                    held |= task.resources
+                    running[executor.submit(_timed, task.func, task.name)] = task
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                held -= task.resources
+                try:
+                    result, elapsed = future.result()
+                except _StepFailed as e:
+                    journal.record(task.name, keys[task.name], "failed", e.elapsed, str(e.error))
+                    logging.error(f"Step '{task.name}' failed: {e.error}")
+                    if error is None:
+                        error = e.error
+                    continue
+                journal.record(task.name, keys[task.name], "ok", elapsed, result)
+                done.add(task.name)
+
+    if error is not None:
+        raise error
+    if pending:
+        raise ValueError(f"Tasks never became runnable: {', '.join(task.name for task in pending)}")
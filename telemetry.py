@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import socket
+import logging
+import threading
+import subprocess
+import logging.handlers
+from contextlib import contextmanager
+from functools import wraps
+
+# JSON-lines event log shared by every script; collect these files from the fleet
+EVENTS_PATH = os.environ.get("ARCHSCRIPTS_TELEMETRY", os.path.expanduser("~/.cache/archscripts/telemetry.jsonl"))
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+_logger = logging.getLogger("archscripts.telemetry")
+_local = threading.local()
+_spans = []
+_spans_lock = threading.Lock()
+_state = {"script": os.path.basename(sys.argv[0]) or "python", "listener": None}
+
+
+class JsonLinesHandler(logging.Handler):
+    """Append one JSON object per record; span records carry their timing fields."""
+
+    def __init__(self, path):
+        super().__init__()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.stream = open(path, "a", buffering=1)
+        self.host = socket.gethostname()
+
+    def emit(self, record):
+        try:
+            event = {
+                "ts": record.created,
+                "host": self.host,
+                "script": _state["script"],
+                "pid": record.process,
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": record.getMessage(),
+            }
+            event.update(getattr(record, "span", {}))
+            self.stream.write(json.dumps(event, default=str) + "\n")
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.stream.close()
+        super().close()
+
+
+class _NoSpans(logging.Filter):
+    # Span records are for the event log, not for people reading the console
+    def filter(self, record):
+        return not hasattr(record, "span")
+
+
+def setup(script=None, level=logging.INFO, log_file=None, events_path=EVENTS_PATH, report=True, console_level=None):
+    """Route logging through a background thread to the console, log_file and the event log.
+
+    Callers only pay for putting a record on a queue; formatting and disk
+    writes happen in the listener thread. When report is set the slowest
+    spans are printed at exit. console_level lets scripts that already
+    print their own output keep the console quiet.
+    """
+    if _state["listener"] is not None:
+        return
+    if script:
+        _state["script"] = script
+
+    handlers = []
+    console = logging.StreamHandler()
+    console.setLevel(console_level or level)
+    handlers.append(console)
+    if log_file:
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setLevel(level)
+        handlers.append(file_handler)
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handler.addFilter(_NoSpans())
+    if events_path and events_path != "off":
+        try:
+            handlers.append(JsonLinesHandler(events_path))
+        except OSError as e:
+            print(f"Telemetry disabled, cannot open {events_path}: {e}", file=sys.stderr)
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    _state["listener"] = listener
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    # Span events are always recorded, whatever the console level is
+    _logger.setLevel(logging.DEBUG)
+    _logger.propagate = False
+    _logger.addHandler(logging.handlers.QueueHandler(records))
+
+    atexit.register(shutdown, report)
+
+
+def shutdown(report=True):
+    listener = _state["listener"]
+    if listener is None:
+        return
+    _state["listener"] = None
+    if report:
+        print_report()
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+@contextmanager
+def span(name, **fields):
+    """Time the enclosed block and record it as a span event.
+
+    Spans nest per thread; the event carries the parent span's name so the
+    event log can be rebuilt into a tree. Exceptions are recorded and re-raised.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = stack[-1] if stack else None
+    stack.append(name)
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        yield fields
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        with _spans_lock:
+            _spans.append((name, elapsed, status))
+        event = dict(fields, span=name, parent=parent, elapsed=round(elapsed, 6), status=status,
+                     thread=threading.current_thread().name)
+        _logger.debug(f"{name} took {elapsed:.3f}s ({status})", extra={"span": event})
+
+
+def timed(name=None):
+    """Decorator form of span(), named after the function by default."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def run(argv, **kwargs):
+    """subprocess.run inside a span named after the command."""
+    command = argv if isinstance(argv, str) else " ".join(str(arg) for arg in argv)
+    name = f"exec {command.split()[0] if command else ''}"
+    with span(name, command=command) as fields:
+        result = subprocess.run(argv, **kwargs)
+        fields["returncode"] = result.returncode
+        return result
+
+
+def summary():
+    """Return [(name, count, total seconds, max seconds, failures)] sorted by total time."""
+    totals = {}
+    with _spans_lock:
+        spans = list(_spans)
+    for name, elapsed, status in spans:
+        count, total, longest, failures = totals.get(name, (0, 0.0, 0.0, 0))
+        totals[name] = (count + 1, total + elapsed, max(longest, elapsed), failures + (status != "ok"))
+    return sorted(((name, *values) for name, values in totals.items()), key=lambda row: -row[2])
+
+
+def print_report(limit=10, file=None):
+    rows = summary()[:limit]
+    if not rows:
+        return
+    file = file or sys.stderr
+    print(f"\nSlowest steps ({_state['script']}):", file=file)
+    print(f"{'Step':<48} {'Count':>5} {'Total':>9} {'Max':>9} {'Failed':>6}", file=file)
+    for name, count, total, longest, failures in rows:
+        print(f"{name[:48]:<48} {count:>5} {total:>8.2f}s {longest:>8.2f}s {failures:>6}", file=file)
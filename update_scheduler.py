@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import glob
+import json
+import time
+import socket
+import hashlib
+import logging
+import argparse
+import statistics
+
+import config_edit
+import mirror_rank
+import pacman_fetch
+import privileged_executor
+import system_update
+import telemetry
+
+UNIT_DIR = "/etc/systemd/system"
+UNIT_NAME = "archscripts-update"
+HISTORY_PATH = os.path.expanduser("~/.local/share/archscripts/update_history.jsonl")
+HISTORY_LIMIT = 500
+POWER_SUPPLY_DIR = "/sys/class/power_supply"
+
+
+def host_slot(window_minutes, host_id=None):
+    """Return this host's minute offset into the update window, stable across runs.
+
+    Hashing the machine id spreads a fleet evenly over the window instead of
+    every host starting at the same second.
+    """
+    if host_id is None:
+        try:
+            with open("/etc/machine-id") as f:
+                host_id = f.read().strip()
+        except FileNotFoundError:
+            host_id = socket.gethostname()
+    return int.from_bytes(hashlib.sha256(host_id.encode()).digest()[:8], "big") % max(1, window_minutes)
+
+
+def parse_window(window):
+    """'02:00-05:00' -> (start minute of the day, length in minutes); the window may cross midnight."""
+    start, end = ((int(h) * 60 + int(m)) for h, m in (part.split(":") for part in window.split("-")))
+    return start, (end - start) % (24 * 60) or 24 * 60
+
+
+def on_calendar(window, host_id=None):
+    start, length = parse_window(window)
+    minute = (start + host_slot(length, host_id)) % (24 * 60)
+    return f"*-*-* {minute // 60:02d}:{minute % 60:02d}:00"
+
+
+def render_units(window="02:00-05:00", jitter=900, max_load=0.75, require_ac=True, gate_wait=1800, chunk_size=50,
+                 host_id=None):
+    """Return {unit file name: content} for the update service and its timer."""
+    script = os.path.abspath(__file__)
+    run_args = f"--max-load {max_load} --gate-wait {gate_wait} --chunk-size {chunk_size}"
+    if not require_ac:
+        run_args += " --allow-battery"
+    service = f"""[Unit]
+Description=archscripts unattended system update
+Wants=network-online.target
+After=network-online.target
+
+[Service]
+Type=oneshot
+ExecStart={sys.executable} {script} run {run_args}
+Nice=10
+IOSchedulingClass=best-effort
+IOSchedulingPriority=7
+"""
+    # The host-hashed slot spreads the fleet over the window; RandomizedDelaySec
+    # adds a little more so hosts sharing a slot do not start together
+    timer = f"""[Unit]
+Description=Run the archscripts system update in this host's slot
+
+[Timer]
+OnCalendar={on_calendar(window, host_id)}
+RandomizedDelaySec={jitter}
+AccuracySec=1min
+Persistent=true
+
+[Install]
+WantedBy=timers.target
+"""
+    return {f"{UNIT_NAME}.service": service, f"{UNIT_NAME}.timer": timer}
+
+
+def install(unit_dir=UNIT_DIR, dry_run=False, **options):
+    """Write the units and enable the timer; returns the OnCalendar line used."""
+    units = render_units(**options)
+    if dry_run:
+        for name, content in units.items():
+            print(f"# {os.path.join(unit_dir, name)}\n{content}")
+    else:
+        executor = privileged_executor.get_executor()
+        for name, content in units.items():
+            executor.write_file(os.path.join(unit_dir, name), content, 0o644)
+        executor.run(["systemctl", "daemon-reload"])
+        executor.run(["systemctl", "enable", "--now", f"{UNIT_NAME}.timer"])
+    return units[f"{UNIT_NAME}.timer"].split("OnCalendar=", 1)[1].split("\n", 1)[0]
+
+
+def remove(unit_dir=UNIT_DIR):
+    executor = privileged_executor.get_executor()
+    executor.run(["systemctl", "disable", "--now", f"{UNIT_NAME}.timer"], check=False)
+    executor.run(["rm", "-f", "--", *(os.path.join(unit_dir, f"{UNIT_NAME}.{kind}") for kind in ("service", "timer"))])
+    executor.run(["systemctl", "daemon-reload"])
+
+
+def on_ac_power(power_supply_dir=POWER_SUPPLY_DIR):
+    """True on mains power or on machines without a battery."""
+    def read(path):
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except OSError:
+            return ""
+
+    supplies = [os.path.dirname(path) for path in glob.glob(os.path.join(power_supply_dir, "*", "type"))]
+    kinds = {supply: read(os.path.join(supply, "type")) for supply in supplies}
+    if not any(kind == "Battery" for kind in kinds.values()):
+        return True
+    return any(kind == "Mains" and read(os.path.join(supply, "online")) == "1" for supply, kind in kinds.items())
+
+
+def check_gates(max_load=0.75, require_ac=True):
+    """Return None if an update may be applied now, otherwise the reason it may not."""
+    load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    if load > max_load:
+        return f"load {load:.2f} per CPU is above {max_load}"
+    if require_ac and not on_ac_power():
+        return "running on battery"
+    return None
+
+
+def wait_for_gates(max_load=0.75, require_ac=True, wait=1800, interval=60):
+    """Poll the gates for up to wait seconds; returns None once they pass, otherwise the last reason."""
+    deadline = time.monotonic() + wait
+    while True:
+        reason = check_gates(max_load, require_ac)
+        if reason is None or time.monotonic() + interval > deadline:
+            return reason
+        logging.info(f"Not applying yet: {reason}. Checking again in {interval}s.")
+        time.sleep(interval)
+
+
+def record_run(entry, path=HISTORY_PATH, limit=HISTORY_LIMIT):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    history = load_history(path)[-(limit - 1):] + [entry]
+    config_edit.write_atomic(path, "".join(json.dumps(item) + "\n" for item in history))
+
+
+def load_history(path=HISTORY_PATH):
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def run(max_load=0.75, require_ac=True, gate_wait=1800, chunk_size=50, history_path=HISTORY_PATH):
+    """Prefetch, wait for the gates, then apply; every run is recorded in the history.
+
+    Downloads happen regardless of the gates, so a deferred run still
+    leaves the packages in the cache for the next one.
+    """
+    entry = {"started": time.time(), "status": "ok", "packages": 0, "download_bytes": 0}
+    start = time.monotonic()
+    try:
+        mirror_rank.ensure_ranked()
+        repos, entries, chunks = system_update.load_plan(max_age=0, chunk_size=chunk_size)
+        cache_dir = pacman_fetch.default_cache_dir()
+        entry["packages"] = len(entries)
+        entry["download_bytes"] = system_update.pending_download(entries, [cache_dir, pacman_fetch.PACMAN_CACHE_DIR])
+        if entries:
+            with telemetry.span("prefetch update"):
+                system_update.prefetch(entries, repos, cache_dir)
+        entry["prefetch_seconds"] = time.monotonic() - start
+
+        reason = wait_for_gates(max_load, require_ac, gate_wait) if entries else None
+        if reason:
+            entry.update(status="deferred", reason=reason)
+            logging.warning(f"Update deferred: {reason}")
+        elif entries:
+            apply_start = time.monotonic()
+            system_update.apply(chunks, repos, cache_dir=cache_dir)
+            entry["apply_seconds"] = time.monotonic() - apply_start
+    except Exception as e:
+        entry.update(status="failed", reason=f"{type(e).__name__}: {e}")
+        logging.error(f"Update failed: {e}")
+    entry["seconds"] = time.monotonic() - start
+    record_run(entry, history_path)
+    return entry
+
+
+def print_history(history, limit=20):
+    print(f"{'Started':<17} {'Status':<9} {'Packages':>8} {'Download':>10} {'Prefetch':>9} {'Apply':>8}  Reason")
+    for item in history[-limit:]:
+        started = time.strftime("%Y-%m-%d %H:%M", time.localtime(item["started"]))
+        download = f"{item['download_bytes'] / (1024 * 1024):.1f}M"
+        prefetch = f"{item['prefetch_seconds']:.0f}s" if "prefetch_seconds" in item else "-"
+        apply_seconds = f"{item['apply_seconds']:.0f}s" if "apply_seconds" in item else "-"
+        print(f"{started:<17} {item['status']:<9} {item['packages']:>8} {download:>10} {prefetch:>9} {apply_seconds:>8}  "
+              f"{item.get('reason', '')}")
+    applied = [item["apply_seconds"] for item in history if "apply_seconds" in item]
+    if applied:
+        print(f"Median apply time over {len(applied)} run(s): {statistics.median(applied):.0f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Schedule unattended system updates with a systemd timer")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    install_parser = subparsers.add_parser("install", help="Write and enable the timer and service")
+    install_parser.add_argument("--window", default="02:00-05:00", help="Update window; each host gets a fixed slot in it")
+    install_parser.add_argument("--jitter", type=int, default=900, help="RandomizedDelaySec on top of the slot")
+    install_parser.add_argument("--dry-run", action="store_true", help="Print the units instead of installing them")
+    subparsers.add_parser("remove", help="Disable and delete the timer and service")
+    run_parser = subparsers.add_parser("run", help="Prefetch and apply now (what the service runs)")
+    subparsers.add_parser("history", help="Show recent runs")
+    for subparser in (install_parser, run_parser):
+        subparser.add_argument("--max-load", type=float, default=0.75, help="Highest 1-minute load per CPU to apply at")
+        subparser.add_argument("--allow-battery", action="store_true", help="Apply on battery power too")
+        subparser.add_argument("--gate-wait", type=int, default=1800, help="Seconds to wait for the gates before deferring")
+        subparser.add_argument("--chunk-size", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    if args.command == "install":
+        calendar = install(dry_run=args.dry_run, window=args.window, jitter=args.jitter, max_load=args.max_load,
+                           require_ac=not args.allow_battery, gate_wait=args.gate_wait, chunk_size=args.chunk_size)
+        print(f"Updates run at {calendar.split()[-1]} plus up to {args.jitter}s of random delay.")
+    elif args.command == "remove":
+        remove()
+    elif args.command == "run":
+        entry = run(args.max_load, not args.allow_battery, args.gate_wait, args.chunk_size)
+        return 1 if entry["status"] == "failed" else 0
+    else:
+        print_history(load_history())
+    return 0
+
+
+if __name__ == "__main__":
+    telemetry.setup("update_scheduler")
+    sys.exit(main())
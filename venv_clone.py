@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import errno
+import fcntl
+import shutil
+import logging
+import tempfile
+
+# ioctl(dest_fd, FICLONE, src_fd) shares extents on btrfs/XFS (copy-on-write)
+FICLONE = 0x40049409
+
+_REFLINK_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS)
+# Site-packages files that tools edit in place or that belong to one environment;
+# a hardlink would carry an edit in the clone back into the source
+_ALWAYS_COPY = {"RECORD", "INSTALLER", "direct_url.json"}
+
+
+def reflink(src, dst):
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    shutil.copystat(src, dst)
+
+
+def _is_text(data):
+    return b"\0" not in data[:1024]
+
+
+def _rewrite_paths(data, src, dst):
+    # Only replace whole path components so /envs/a does not match /envs/ab
+    pattern = re.compile(re.escape(src.encode()) + rb"(?![\w.-])")
+    return pattern.sub(lambda _: dst.encode(), data)
+
+
+def _needs_rewrite(rel_path):
+    return rel_path == "pyvenv.cfg" or rel_path.split(os.sep)[0] in ("bin", "Scripts")
+
+
+def _in_site_packages(rel_path):
+    return f"{os.sep}site-packages{os.sep}" in f"{os.sep}{rel_path}"
+
+
+def _may_hardlink(rel_path):
+    name = os.path.basename(rel_path)
+    return _in_site_packages(rel_path) and name not in _ALWAYS_COPY and not name.endswith(".pth")
+
+
+def clone_env(src_env_path, dest_env_path, mode="auto"):
+    """Clone a virtual environment and make it usable at its new location.
+
+    In "auto" mode every file is reflinked when the filesystem supports it;
+    otherwise files in site-packages (which pip only ever replaces, never
+    edits in place) are hardlinked and the rest are copied; .pth files and
+    per-install metadata (RECORD, INSTALLER, direct_url.json) are always
+    copied. Scripts in bin/ and pyvenv.cfg are always rewritten to point at
+    the clone. "copy" mode copies everything. Returns a {method: file
+    count} dict.
+
+    The clone is built in a temporary directory next to dest_env_path and
+    renamed into place when complete, so a failed clone leaves nothing
+    behind.
+    """
+    src = os.path.abspath(src_env_path)
+    dst = os.path.abspath(dest_env_path)
+    if os.path.exists(dst):
+        raise FileExistsError(f"{dst} already exists")
+
+    build = tempfile.mkdtemp(dir=os.path.dirname(dst), prefix=f".{os.path.basename(dst)}.")
+    try:
+        stats = _clone_tree(src, dst, build, mode)
+        os.rename(build, dst)
+    except BaseException:
+        shutil.rmtree(build, ignore_errors=True)
+        raise
+    return stats
+
+
+def _clone_tree(src, dst, build, mode):
+    # Files go into build; paths inside them are rewritten for dst, where build ends up
+    stats = {"reflinked": 0, "hardlinked": 0, "copied": 0, "rewritten": 0, "symlinks": 0}
+    use_reflink = mode == "auto"
+
+    for root, dirs, files in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        target_root = build if rel_root == "." else os.path.join(build, rel_root)
+        os.makedirs(target_root, exist_ok=True)
+        shutil.copystat(root, target_root)
+
+        for name in dirs + files:
+            source = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            rel_path = os.path.normpath(os.path.join(rel_root, name))
+
+            if os.path.islink(source):
+                link = os.readlink(source)
+                if link == src or link.startswith(src + os.sep):
+                    link = dst + link[len(src):]
+                os.symlink(link, target)
+                stats["symlinks"] += 1
+                continue
+            if name in dirs:
+                continue
+
+            if _needs_rewrite(rel_path):
+                with open(source, "rb") as f:
+                    data = f.read()
+                if _is_text(data):
+                    with open(target, "wb") as f:
+                        f.write(_rewrite_paths(data, src, dst))
+                    shutil.copystat(source, target)
+                    stats["rewritten"] += 1
+                    continue
+
+            if use_reflink:
+                try:
+                    reflink(source, target)
+                    stats["reflinked"] += 1
+                    continue
+                except OSError as e:
+                    if e.errno not in _REFLINK_UNSUPPORTED:
+                        raise
+                    logging.info(f"Reflinks not supported for {dst}, falling back to hardlinks and copies.")
+                    use_reflink = False
+                    if os.path.exists(target):
+                        os.unlink(target)
+
+            if mode == "auto" and _may_hardlink(rel_path):
+                try:
+                    os.link(source, target)
+                    stats["hardlinked"] += 1
+                    continue
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                        raise
+
+            shutil.copy2(source, target)
+            stats["copied"] += 1
+
+    return stats
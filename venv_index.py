@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import json
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import config_edit
+import telemetry
+
+try:
+    from packaging.requirements import Requirement
+    from packaging.version import Version, InvalidVersion
+except ImportError:
+    Requirement = None
+
+CACHE_PATH = os.path.expanduser("~/.cache/archscripts/venv_index.json")
+CACHE_VERSION = 1
+
+
+def normalize_name(name):
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def is_virtual_environment(path):
+    return os.path.isfile(os.path.join(path, "pyvenv.cfg"))
+
+
+def read_pyvenv_cfg(env_path):
+    config = {}
+    with open(os.path.join(env_path, "pyvenv.cfg")) as f:
+        for line in f:
+            key, sep, value = line.partition("=")
+            if sep:
+                config[key.strip()] = value.strip()
+    return config
+
+
+def site_packages_dirs(env_path):
+    env = Path(env_path)
+    return sorted(str(p) for p in [*env.glob("lib/python*/site-packages"), *env.glob("Lib/site-packages")] if p.is_dir())
+
+
+def _read_metadata_headers(path):
+    # Name and Version live in the header block, before the first blank line
+    headers = {}
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if not line.strip():
+                break
+            key, sep, value = line.partition(":")
+            if sep and key in ("Name", "Version"):
+                headers[key] = value.strip()
+    return headers
+
+
+def read_distributions(site_packages):
+    """Return {normalized name: [name, version]} from the *.dist-info/*.egg-info metadata."""
+    packages = {}
+    with os.scandir(site_packages) as entries:
+        for entry in entries:
+            if entry.name.endswith(".dist-info"):
+                metadata = os.path.join(entry.path, "METADATA")
+            elif entry.name.endswith(".egg-info"):
+                metadata = os.path.join(entry.path, "PKG-INFO") if entry.is_dir() else entry.path
+            else:
+                continue
+            try:
+                headers = _read_metadata_headers(metadata)
+            except OSError:
+                continue
+            if "Name" in headers and "Version" in headers:
+                packages[normalize_name(headers["Name"])] = [headers["Name"], headers["Version"]]
+    return packages
+
+
+def env_mtime(env_path):
+    # Installing, upgrading or removing a package adds or removes a
+    # *.dist-info directory (bumping site-packages) and writes into it
+    mtimes = [os.stat(path).st_mtime_ns for path in (env_path, os.path.join(env_path, "pyvenv.cfg"))]
+    for site_packages in site_packages_dirs(env_path):
+        mtimes.append(os.stat(site_packages).st_mtime_ns)
+        with os.scandir(site_packages) as entries:
+            mtimes += [entry.stat().st_mtime_ns for entry in entries if entry.name.endswith((".dist-info", ".egg-info"))]
+    return max(mtimes)
+
+
+def scan_env(env_path):
+    config = read_pyvenv_cfg(env_path)
+    packages = {}
+    for site_packages in site_packages_dirs(env_path):
+        packages.update(read_distributions(site_packages))
+    return {
+        "path": env_path,
+        "mtime": env_mtime(env_path),
+        "python": config.get("version") or config.get("version_info", ""),
+        "packages": packages,
+    }
+
+
+def load_cache(cache_path=CACHE_PATH):
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return cache.get("envs", {}) if cache.get("version") == CACHE_VERSION else {}
+
+
+def save_cache(envs, cache_path=CACHE_PATH):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    config_edit.write_atomic(cache_path, json.dumps({"version": CACHE_VERSION, "envs": envs}))
+
+
+@telemetry.timed("index environments")
+def build_index(folder_path, workers=8, cache_path=CACHE_PATH):
+    """Return {env path: record} for every virtual environment in folder_path.
+
+    Environments whose mtime matches the cached record are not rescanned;
+    the rest are scanned in parallel and the cache is rewritten.
+    """
+    cache = load_cache(cache_path)
+    env_paths = [entry.path for entry in os.scandir(folder_path) if entry.is_dir() and is_virtual_environment(entry.path)]
+
+    def refresh(env_path):
+        try:
+            cached = cache.get(env_path)
+            if cached and cached["mtime"] == env_mtime(env_path):
+                return env_path, cached, False
+            return env_path, scan_env(env_path), True
+        except OSError as e:
+            logging.warning(f"Could not scan {env_path}: {e}")
+            return env_path, None, False
+
+    index, changed = {}, False
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for env_path, record, rescanned in executor.map(refresh, env_paths):
+            if record is not None:
+                index[env_path] = record
+            changed |= rescanned
+
+    # Envs from other folders stay cached; deleted envs of this one are dropped
+    folder = os.path.abspath(folder_path)
+    merged = {path: record for path, record in cache.items() if os.path.dirname(os.path.abspath(path)) != folder}
+    merged.update(index)
+    if changed or len(merged) != len(cache):
+        save_cache(merged, cache_path)
+    return index
+
+
+def _version_key(version):
+    return tuple(int(part) for part in re.findall(r"\d+", version))
+
+
+_SPEC_RE = re.compile(r"\s*(~=|==|!=|<=|>=|<|>)\s*([^,\s]+)")
+
+
+def _fallback_matcher(requirement):
+    match = re.match(r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)(.*)", requirement)
+    if not match:
+        raise ValueError(f"Invalid requirement '{requirement}'")
+    name, rest = match.groups()
+    specs = [(op, _version_key(version)) for op, version in _SPEC_RE.findall(rest)]
+    checks = {
+        "==": lambda a, b: a == b, "!=": lambda a, b: a != b,
+        "<=": lambda a, b: a <= b, ">=": lambda a, b: a >= b,
+        "<": lambda a, b: a < b, ">": lambda a, b: a > b,
+        "~=": lambda a, b: a >= b and a[:len(b) - 1] == b[:len(b) - 1],
+    }
+    return name, lambda version: all(checks[op](_version_key(version), wanted) for op, wanted in specs)
+
+
+def requirement_matcher(requirement):
+    """Return (normalized name, predicate on version strings) for a requirement string."""
+    if Requirement is None:
+        name, matches = _fallback_matcher(requirement)
+        return normalize_name(name), matches
+
+    parsed = Requirement(requirement)
+
+    def matches(version):
+        try:
+            return parsed.specifier.contains(Version(version), prereleases=True)
+        except InvalidVersion:
+            return False
+
+    return normalize_name(parsed.name), matches
+
+
+def find_envs(index, requirement):
+    """Return [(env path, installed version)] for envs with a distribution matching requirement."""
+    name, matches = requirement_matcher(requirement)
+    found = []
+    for env_path, record in sorted(index.items()):
+        installed = record["packages"].get(name)
+        if installed and matches(installed[1]):
+            found.append((env_path, installed[1]))
+    return found
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import errno
+import fcntl
+import shutil
+import hashlib
+import logging
+import argparse
+import subprocess
+import tempfile
+from contextlib import contextmanager
+
+import config_edit
+import sizes
+import telemetry
+import venv_index
+
+STORE_PATH = os.path.expanduser("~/.cache/archscripts/wheelhouse")
+# Installed files smaller than this are not worth a pool entry
+DEDUPE_MIN_SIZE = 16 * 1024
+# pip logs this for each wheel it builds from an sdist instead of downloading
+_BUILT_RE = re.compile(r"Created wheel for \S+: filename=(\S+)")
+
+
+def store_paths(store=STORE_PATH):
+    return {
+        "objects": os.path.join(store, "objects"),
+        "wheels": os.path.join(store, "wheels"),
+        "files": os.path.join(store, "files"),
+        "index": os.path.join(store, "index.json"),
+        "lock": os.path.join(store, "index.lock"),
+    }
+
+
+def parse_wheel_filename(filename):
+    """Return (normalized name, version, interpreter tag) for a wheel filename."""
+    parts = filename[:-len(".whl")].split("-")
+    if len(parts) not in (5, 6):
+        raise ValueError(f"Not a wheel filename: {filename}")
+    return venv_index.normalize_name(parts[0]), parts[1], "-".join(parts[-3:])
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_index(store=STORE_PATH):
+    try:
+        with open(store_paths(store)["index"]) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_index(index, store=STORE_PATH):
+    config_edit.write_atomic(store_paths(store)["index"], json.dumps(index, indent=1, sort_keys=True))
+
+
+@contextmanager
+def locked_index(store=STORE_PATH):
+    """Yield the index under an exclusive lock on the store, saving it if the block succeeds.
+
+    Batch installs run in parallel processes; reading the index only once
+    the lock is held keeps one from dropping the entries another added.
+    """
+    os.makedirs(store, exist_ok=True)
+    with open(store_paths(store)["lock"], "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        index = load_index(store)
+        yield index
+        save_index(index, store)
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(source, target)
+
+
+def add_wheel(path, index, store=STORE_PATH, built=False):
+    """Store the wheel at path under its content hash and expose it by filename.
+
+    built marks a wheel pip built here; its hash matches no index, so it never goes in a lock file.
+    """
+    paths = store_paths(store)
+    filename = os.path.basename(path)
+    if filename in index and os.path.exists(os.path.join(paths["wheels"], filename)):
+        return filename
+
+    sha256 = file_hash(path)
+    obj = os.path.join(paths["objects"], sha256[:2], sha256)
+    if not os.path.exists(obj):
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        # A temp file of its own, so a concurrent store of the same wheel cannot publish a half copy
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(obj), prefix=f".{sha256}.")
+        try:
+            with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, obj)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    os.makedirs(paths["wheels"], exist_ok=True)
+    exposed = os.path.join(paths["wheels"], filename)
+    if not os.path.exists(exposed):
+        try:
+            _link_or_copy(obj, exposed)
+        except FileExistsError:
+            pass
+
+    name, version, tag = parse_wheel_filename(filename)
+    index[filename] = {
+        "sha256": sha256,
+        "name": name,
+        "version": version,
+        "tag": tag,
+        "built": built,
+        "size": os.path.getsize(obj),
+        "last_used": time.time(),
+    }
+    return filename
+
+
+def ensure_wheels(env_path, requirements, store=STORE_PATH):
+    """Build or download wheels for requirements (and their dependencies) into the store.
+
+    Wheels already in the store are reused by pip through --find-links, so
+    only missing ones are fetched or built.
+    """
+    paths = store_paths(store)
+    os.makedirs(paths["wheels"], exist_ok=True)
+    pip = os.path.join(env_path, "bin", "pip")
+    with tempfile.TemporaryDirectory(prefix="wheels.") as tmp:
+        log = os.path.join(tmp, "pip.log")
+        telemetry.run([pip, "wheel", "--wheel-dir", tmp, "--log", log, "--find-links", paths["wheels"], *requirements],
+                      check=True)
+        try:
+            with open(log, errors="replace") as f:
+                built = set(_BUILT_RE.findall(f.read()))
+        except FileNotFoundError:
+            built = set()
+        # pip runs unlocked; only storing the results holds up other installs
+        with locked_index(store) as index:
+            added = [add_wheel(os.path.join(tmp, name), index, store, built=name in built)
+                     for name in os.listdir(tmp) if name.endswith(".whl")]
+    return added
+
+
+def _pip_install_offline(env_path, requirements, store, upgrade=False, quiet=False):
+    command = [os.path.join(env_path, "bin", "pip"), "install", "--no-index", "--find-links", store_paths(store)["wheels"]]
+    if upgrade:
+        command.append("--upgrade")
+    return telemetry.run(command + list(requirements), capture_output=quiet)
+
+
+def mark_used(env_path, store=STORE_PATH):
+    # Refresh the LRU clock of every stored wheel matching an installed distribution
+    installed = venv_index.scan_env(env_path)["packages"]
+    now = time.time()
+    with locked_index(store) as index:
+        for entry in index.values():
+            if installed.get(entry["name"], [None, None])[1] == entry["version"]:
+                entry["last_used"] = now
+
+
+@telemetry.timed("wheel install")
+def install(env_path, requirements, upgrade=False, store=STORE_PATH, dedupe=True):
+    """Install requirements into env_path from the wheel store.
+
+    Pinned or plain installs are tried offline first. Upgrades, or offline
+    installs that miss a wheel, resolve against the index once, add the
+    wheels to the store and then install offline.
+    """
+    records_before = record_files(env_path) if dedupe else {}
+    if not upgrade and _pip_install_offline(env_path, requirements, store, quiet=True).returncode == 0:
+        logging.info(f"Installed {' '.join(requirements)} into {env_path} from the wheel store.")
+    else:
+        ensure_wheels(env_path, requirements, store)
+        result = _pip_install_offline(env_path, requirements, store, upgrade)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, result.args)
+    mark_used(env_path, store)
+    if dedupe:
+        # pip writes a fresh RECORD for every distribution it (re)installs
+        changed = [record for record, mtime in record_files(env_path).items() if records_before.get(record) != mtime]
+        dedupe_env(env_path, store, changed)
+
+
+def record_files(env_path):
+    """Return {RECORD path: mtime_ns} for every distribution installed in env_path."""
+    records = {}
+    for site_packages in venv_index.site_packages_dirs(env_path):
+        for entry in os.scandir(site_packages):
+            if entry.name.endswith(".dist-info"):
+                record = os.path.join(entry.path, "RECORD")
+                try:
+                    records[record] = os.stat(record).st_mtime_ns
+                except FileNotFoundError:
+                    pass
+    return records
+
+
+def _recorded_paths(record, env_path):
+    # RECORD paths are relative to site-packages; scripts reach into bin/ with ../
+    site_packages = os.path.dirname(os.path.dirname(record))
+    env_prefix = os.path.join(os.path.abspath(env_path), "")
+    with open(record, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if row:
+                path = os.path.normpath(os.path.join(site_packages, row[0]))
+                if path.startswith(env_prefix):
+                    yield path
+
+
+def _walk_files(directory):
+    for root, _, files in os.walk(directory):
+        for name in files:
+            yield os.path.join(root, name)
+
+
+def _dedupe_file(path, pool):
+    """Hardlink path to its pooled twin, or pool it; returns the bytes saved."""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return 0
+    if not os.path.isfile(path) or os.path.islink(path) or st.st_size < DEDUPE_MIN_SIZE:
+        return 0
+    pooled = os.path.join(pool, file_hash(path))
+    try:
+        pool_st = os.stat(pooled)
+    except FileNotFoundError:
+        try:
+            os.link(path, pooled)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+        return 0
+    if pool_st.st_ino == st.st_ino or pool_st.st_dev != st.st_dev:
+        return 0
+    tmp = f"{path}.dedupe"
+    os.link(pooled, tmp)
+    os.replace(tmp, path)
+    return st.st_size
+
+
+@telemetry.timed("dedupe environment")
+def dedupe_env(env_path, store=STORE_PATH, records=None):
+    """Replace installed files with hardlinks to identical files already in the pool.
+
+    Only the files listed in records (RECORD paths, as from record_files)
+    are hashed; with None, all of site-packages is. Returns the number of
+    bytes saved.
+    """
+    pool = store_paths(store)["files"]
+    os.makedirs(pool, exist_ok=True)
+    if records is None:
+        paths = (path for site_packages in venv_index.site_packages_dirs(env_path) for path in _walk_files(site_packages))
+    else:
+        paths = (path for record in records for path in _recorded_paths(record, env_path))
+    saved = sum(_dedupe_file(path, pool) for path in paths)
+    if saved:
+        logging.info(f"Deduplicated {saved} bytes in {env_path}.")
+    return saved
+
+
+def evict(max_bytes, store=STORE_PATH):
+    """Remove least recently used wheels until the store holds at most max_bytes of wheels."""
+    paths = store_paths(store)
+    removed = []
+    with locked_index(store) as index:
+        total = sum(entry["size"] for entry in index.values())
+        for filename, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+            if total <= max_bytes:
+                break
+            for path in (os.path.join(paths["wheels"], filename),
+                         os.path.join(paths["objects"], entry["sha256"][:2], entry["sha256"])):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= entry["size"]
+            removed.append(filename)
+            del index[filename]
+
+    # Pool files only linked from the pool itself are no longer installed anywhere
+    if os.path.isdir(paths["files"]):
+        for entry in os.scandir(paths["files"]):
+            if entry.stat().st_nlink == 1:
+                os.remove(entry.path)
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the shared wheel store")
+    parser.add_argument("--store", default=STORE_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    evict_parser = subparsers.add_parser("evict", help="Drop least recently used wheels above a size limit")
+    evict_parser.add_argument("--max-size", type=sizes.parse_size, required=True, help="e.g. 5G")
+    subparsers.add_parser("stats", help="Show the store size")
+    args = parser.parse_args(argv)
+
+    if args.command == "evict":
+        removed = evict(args.max_size, args.store)
+        print(f"Evicted {len(removed)} wheel(s).")
+    else:
+        index = load_index(args.store)
+        print(f"{len(index)} wheels, {sum(entry['size'] for entry in index.values()) / 1024 ** 2:.1f} MiB")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())